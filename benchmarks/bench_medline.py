@@ -0,0 +1,99 @@
+'''
+Benchmarks the field-selective MEDLINE reader (biologyfinder_medline) against Bio.Medline on synthetic efetch responses, checks that both give the same values for the tags BiologyFinder reads, and reports time and peak memory.
+
+Example:
+python benchmarks/bench_medline.py --records 20000 --json medline.json
+'''
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from Bio import Medline
+import biologyfinder_medline as bfmedline
+
+
+WORDS = "cell plant root growth division microtubule protein signaling arabidopsis maize spindle polarity auxin kinase gene expression".split()
+
+
+def synthetic_record(pmid, rng):
+    """Returns one MEDLINE record (str) shaped like a PubMed efetch record, with wrapped title, abstract and affiliation lines."""
+    num_authors = rng.randint(1, 12)
+    lines = ["PMID- {}".format(pmid), "OWN - NLM", "STAT- MEDLINE", "DCOM- 20190101", "IS  - 1234-5678 (Print)", "VI  - 12", "IP  - 3", "DP  - {} {}".format(rng.randint(1960, 2020), rng.choice(["Jan", "Feb", "Mar"]))]
+    title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))).capitalize() + "."
+    lines.append("TI  - " + title[:82])
+    lines.extend("      " + title[start:start + 82] for start in range(82, len(title), 82))
+    lines.append("PG  - 100-10")
+    abstract = " ".join(rng.choice(WORDS) for _ in range(rng.randint(100, 300)))
+    lines.append("AB  - " + abstract[:82])
+    lines.extend("      " + abstract[start:start + 82] for start in range(82, len(abstract), 82))
+    for author in range(num_authors):
+        last_name = rng.choice(WORDS).capitalize() + str(author)
+        first_name = rng.choice(["Carolyn", "John", "Amy", "Wei"])
+        lines.append("FAU - {}, {} {}".format(last_name, first_name, rng.choice("ABCDEFG")))
+        lines.append("AU  - {} {}".format(last_name, first_name[0]))
+        lines.append("AD  - Department of Botany and Plant Sciences, University of California Riverside,")
+        lines.append("      Riverside, CA, USA.")
+    lines.extend("MH  - " + rng.choice(WORDS).capitalize() + "/metabolism" for _ in range(rng.randint(5, 15)))
+    lines.extend(["LA  - eng", "PT  - Journal Article", "PL  - United States", "TA  - Plant Cell", "JT  - The Plant cell", "JID - 9208688", "SO  - Plant Cell. 2019;12(3):100-10."])
+    return "\n".join(lines) + "\n"
+
+
+def synthetic_response(num_records, seed=0):
+    """Returns the bytes of a synthetic MEDLINE efetch response with num_records records."""
+    rng = random.Random(seed)
+    return "\n".join(synthetic_record(10000000 + number, rng) for number in range(num_records)).encode("utf-8")
+
+
+def biopython_fields(body, tags):
+    return [{tag: record[tag] for tag in tags if tag in record} for record in Medline.parse(io.StringIO(body.decode("utf-8")))]
+
+
+def streaming_fields(body, tags):
+    return [{tag: record[tag] for tag in tags if tag in record} for record in bfmedline.parse(io.BytesIO(body), tags)]
+
+
+def measure(func, *args):
+    """Runs func and returns its result, the time taken (s) and the peak memory traced (bytes)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=10000, help="number of MEDLINE records in the response")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per parser, the fastest is reported")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+    body = synthetic_response(args.records)
+    results = {"records": args.records, "response_bytes": len(body), "tag_sets": {}}
+    for name, tags in (("citation", bfmedline.CITATION_TAGS), ("author", bfmedline.AUTHOR_TAGS)):
+        timings = {}
+        for parser_name, func in (("biopython", biopython_fields), ("streaming", streaming_fields)):
+            runs = [measure(func, body, tags) for _ in range(args.repeat)]
+            timings[parser_name] = {"seconds": min(run[1] for run in runs), "peak_bytes": min(run[2] for run in runs)}
+            timings[parser_name + "_output"] = runs[0][0]
+        if timings.pop("biopython_output") != timings.pop("streaming_output"):
+            raise AssertionError("The parsers disagree on the {} tags.".format(name))
+        timings["speedup"] = timings["biopython"]["seconds"] / timings["streaming"]["seconds"]
+        results["tag_sets"][name] = timings
+        print("{:<9} tags {}: Bio.Medline {:.3f}s {:.1f} MB, streaming {:.3f}s {:.1f} MB, {:.1f}x faster".format(
+            name, ",".join(tags), timings["biopython"]["seconds"], timings["biopython"]["peak_bytes"] / 1e6,
+            timings["streaming"]["seconds"], timings["streaming"]["peak_bytes"] / 1e6, timings["speedup"]))
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(results, handle, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
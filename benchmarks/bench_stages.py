@@ -0,0 +1,140 @@
+'''
+Times and memory-profiles every stage of the phased BiologyFinder pipeline, from the master list through create_similarity_scores_df and reading_list, against a local E-utilities stand-in so results are not dominated by network jitter.  Runs on synthetic citation graphs at multiples of the Rasmussen example in the report (237 biologists, about 136k papers) or replays recorded fixtures, and writes the results as JSON so regressions can be tracked.
+
+Examples:
+python benchmarks/bench_stages.py --scales 1 10 --output stages.json
+python benchmarks/bench_stages.py --record fixtures.jsonl --pmids 30150312 29146775 28202734 --email you@example.org
+python benchmarks/bench_stages.py --fixtures fixtures.jsonl --pmids 30150312 29146775 28202734
+'''
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import numpy as np
+import scipy
+from Bio import Entrez
+import biologyfinder_fxn as bffxn
+import biologyfinder_cache as bfcache
+import biologyfinder_scheduler as bfscheduler
+import fake_eutils
+
+
+def git_commit():
+    """Returns the commit (str) of the working tree or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StageTimer:
+    """Runs stages one at a time, recording wall time, peak traced memory and the requests each stage sent to the server."""
+
+    def __init__(self, server, trace_memory=True):
+        self.server = server
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    def run(self, name, func, *args, **kwargs):
+        requests_before, bytes_before = self.server.counters()
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        if self.trace_memory:
+            tracemalloc.stop()
+        requests_after, bytes_after = self.server.counters()
+        self.stages.append({
+            "stage": name,
+            "seconds": seconds,
+            "peak_bytes": peak,
+            "requests": {endpoint: count - requests_before.get(endpoint, 0) for endpoint, count in requests_after.items() if count != requests_before.get(endpoint, 0)},
+            "response_bytes": sum(bytes_after.values()) - sum(bytes_before.values()),
+        })
+        logging.getLogger(__name__).warning("  {:<40} {:8.3f}s {:>10}".format(name, seconds, "" if peak is None else "{:.1f} MB".format(peak / 1e6)))
+        return result
+
+
+def run_stages(server, paper_list, top_percent=0.2, reading_list_size=10, metric="pearson", trace_memory=True):
+    """Runs the phased pipeline of main.py stage by stage against server and returns the timings and the size of the result."""
+    logger = logging.getLogger("biologyfinder.bench")
+    timer = StageTimer(server, trace_memory)
+    master_list = timer.run("create_master_biologist_list", bffxn.create_master_biologist_list, paper_list, logger)
+    biologist_paper_dict = timer.run("create_biologist_paper_dict", bffxn.create_biologist_paper_dict, master_list, logger)
+    paper_refs_dict = timer.run("create_paper_refs_dict", bffxn.create_paper_refs_dict, biologist_paper_dict, logger)
+    cited_papers_dict = timer.run("create_biologist_cited_papers_dict", bffxn.create_biologist_cited_papers_dict, biologist_paper_dict, logger, paper_refs_dict)
+    features = timer.run("create_paper_features_list", bffxn.create_paper_features_list, cited_papers_dict)
+    feature_matrix = timer.run("create_binary_feature_vectors", bffxn.create_binary_feature_vectors, cited_papers_dict, features)
+    comparison = timer.run("create_comparison_binary_vector", bffxn.create_comparison_binary_vector, paper_list, features, logger)
+    bf_matrix = timer.run("create_biologist_finder_matrix", bffxn.create_biologist_finder_matrix, feature_matrix, features, cited_papers_dict, comparison)
+    similarity_df = timer.run("create_similarity_scores_df", bffxn.create_similarity_scores_df, bf_matrix, metric)
+    top_df = timer.run("most_sim_biologists", bffxn.most_sim_biologists, similarity_df, top_percent)
+    timer.run("reading_list", bffxn.reading_list, bf_matrix, top_df, logger, reading_list_size)
+    return {
+        "stages": timer.stages,
+        "total_seconds": sum(stage["seconds"] for stage in timer.stages),
+        "num_biologists": len(master_list),
+        "matrix_shape": list(bf_matrix.matrix.shape),
+        "matrix_nnz": int(bf_matrix.matrix.nnz),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 10], help="sizes of the synthetic graphs relative to the Rasmussen example, e.g. 1 10 100")
+    parser.add_argument("--fixtures", help="replay recorded responses from this JSON lines file instead of a synthetic graph")
+    parser.add_argument("--record", help="record live PubMed responses to this JSON lines file while benchmarking")
+    parser.add_argument("--pmids", nargs="+", help="seed paper IDs for --fixtures and --record, the synthetic seed papers otherwise")
+    parser.add_argument("--email", default="", help="email address sent to NCBI when recording")
+    parser.add_argument("--metric", choices=bffxn.SIMILARITY_METRICS, default="pearson", help="similarity metric")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent requests to the local server")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, which slows the Python-heavy stages down")
+    parser.add_argument("--output", default="bench_stages.json", help="JSON file for the results")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    logging.getLogger("biologyfinder").setLevel(logging.ERROR)
+    Entrez.email = args.email
+    bfcache.disable_cache()
+
+    if args.record or args.fixtures:
+        if not args.pmids:
+            parser.error("--fixtures and --record need --pmids")
+        runs = [("recorded", ["--record", args.record] if args.record else ["--fixtures", args.fixtures], args.pmids)]
+    else:
+        runs = [("synthetic_{:g}x".format(scale), ["--scale", str(scale)], args.pmids or fake_eutils.SyntheticPubMed(scale).seed_papers) for scale in args.scales]
+
+    results = {
+        "benchmark": "stages",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "runs": [],
+    }
+    for name, server_args, paper_list in runs:
+        logging.getLogger(__name__).warning("{}:".format(name))
+        with fake_eutils.ServerProcess(server_args) as server:
+            # A live recording keeps to NCBI's limits, the local server needs none
+            bfscheduler.configure_scheduler(base_url=server.url, max_workers=None if args.record else args.workers, rate=None if args.record else 1e6)
+            run = run_stages(server, paper_list, metric=args.metric, trace_memory=not args.no_memory)
+            run["requests"], run["response_bytes"] = server.counters()
+        run["name"] = name
+        results["runs"].append(run)
+        logging.getLogger(__name__).warning("  {} biologists, matrix {} x {} with {} citations, {:.2f}s in total".format(run["num_biologists"], run["matrix_shape"][0], run["matrix_shape"][1], run["matrix_nnz"], run["total_seconds"]))
+    bfscheduler.configure_scheduler()
+    with open(args.output, "w") as handle:
+        json.dump(results, handle, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+'''
+Local stand-in for the NCBI E-utilities used by the BiologyFinder benchmarks.  A FakeEutilsServer answers esearch, epost, efetch (MEDLINE text) and elink requests on localhost from one of three backends:
+
+SyntheticPubMed - a deterministic synthetic citation graph whose size is a multiple of the Rasmussen example in the report (237 biologists and about 136k cited papers)
+FixtureReplay - responses recorded earlier from the live servers, served back byte for byte
+RecordingProxy - forwards requests to the live servers and records the responses as fixtures
+
+Point BiologyFinder at the server with biologyfinder_scheduler.configure_scheduler(base_url=server.url).  Run this file to serve from a separate process, which keeps the server's work out of the timings of the process being benchmarked, e.g. python fake_eutils.py --scale 10
+
+'''
+import argparse
+import json
+import re
+import subprocess
+import sys
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import urlopen
+import numpy as np
+
+
+LIVE_BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+# Request parameters that identify the caller rather than the request
+IGNORED_PARAMS = ("email", "tool", "api_key")
+# Size of the Rasmussen example in the report
+BASE_BIOLOGISTS = 237
+BASE_PAPERS = 136641
+
+LAST_NAMES = ("Rasmussen", "Smith", "Chen", "Garcia", "Muller", "Tanaka", "Okafor", "Novak", "Silva", "Kowalski", "Nguyen", "Larsen", "Rossi", "Haddad", "Ivanova", "Murphy")
+FIRST_NAMES = ("Carolyn", "John", "Wei", "Maria", "Ahmed", "Yuki", "Chidi", "Petra", "Lucas", "Anna", "Minh", "Freya", "Marco", "Leila", "Olga", "Sean")
+WORDS = ("cell", "plant", "root", "division", "microtubule", "protein", "signaling", "arabidopsis", "maize", "spindle", "polarity", "auxin", "kinase", "phragmoplast", "cortex", "growth")
+JOURNALS = ("The Plant cell", "Current biology", "Development", "Journal of cell science", "Plant physiology", "eLife")
+
+ESEARCH_DOCTYPE = '<!DOCTYPE eSearchResult PUBLIC "-//NLM//DTD esearch 20060628//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20060628/esearch.dtd">'
+EPOST_DOCTYPE = '<!DOCTYPE ePostResult PUBLIC "-//NLM//DTD epost 20090526//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20090526/epost.dtd">'
+ELINK_DOCTYPE = '<!DOCTYPE eLinkResult PUBLIC "-//NLM//DTD elink 20101123//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20101123/elink.dtd">'
+
+
+def fixture_key(endpoint, params):
+    """Returns the key (str) a request is recorded under: the endpoint and its parameters with the caller's credentials left out and ID lists split on commas."""
+    normalized = {}
+    for name, values in params.items():
+        if name.lower() in IGNORED_PARAMS:
+            continue
+        items = []
+        for value in values:
+            items.extend(value.split(",") if name.lower() == "id" else [value])
+        normalized[name.lower()] = items
+    return json.dumps([endpoint, normalized], sort_keys=True)
+
+
+class ErrorResponse(Exception):
+    """Raised by a backend to answer a request with an HTTP error status instead of a body, e.g. 429 or 503 to exercise the retries of the scheduler.
+
+    Arguments:
+    status - int; HTTP status code
+    message (optional) - str; response body
+    """
+
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.status = status
+
+
+class SyntheticPubMed:
+    """Deterministic synthetic PubMed.  Everything is derived from the PMID or biologist number, so no graph is held in memory and any scale can be served.
+
+    Biologist b (b < num_biologists) is the last author of papers AUTHORED_BASE + b * 200 + j for j below their paper count (5 to 75, 40 on average) and is found by searching their name.  Each authored paper references about refs_per_paper papers from a pool of num_papers cited papers (about 90% of the pool ends up cited), half drawn from a skewed global popularity (the classics) and half from the block of the pool belonging to the biologist's topic.  The three seed papers reference papers of topic 0 and are cited by one paper of every biologist, so the master list holds every biologist.
+
+    Arguments:
+    scale (optional) - float; size relative to the Rasmussen example (237 biologists and about 136k cited papers at scale 1)
+    refs_per_paper (optional) - int; mean number of references of an authored paper
+    num_topics (optional) - int; number of topics the biologists are split into
+    seed (optional) - int; changes every random choice
+    """
+
+    AUTHORED_BASE = 20000000
+    POOL_BASE = 1000000
+    SEED_BASE = 39000000
+
+    def __init__(self, scale=1, refs_per_paper=40, num_topics=20, seed=0):
+        self.scale = scale
+        self.num_biologists = max(int(round(BASE_BIOLOGISTS * scale)), 2)
+        self.num_papers = max(int(round(BASE_PAPERS * scale)), num_topics)
+        self.refs_per_paper = refs_per_paper
+        self.num_topics = num_topics
+        self.seed = seed
+        self.seed_papers = [str(self.SEED_BASE + number) for number in range(1, 4)]
+        self._webenvs = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, number):
+        return np.random.default_rng([self.seed, number])
+
+    def biologist_name(self, biologist):
+        """Returns the MEDLINE full name (FAU) of a biologist."""
+        return "{}{}, {} {}".format(LAST_NAMES[biologist % len(LAST_NAMES)], biologist, FIRST_NAMES[biologist // len(LAST_NAMES) % len(FIRST_NAMES)], chr(65 + biologist % 26))
+
+    def num_authored(self, biologist):
+        return 5 + int(self._rng(biologist).integers(0, 71))
+
+    def authored_papers(self, biologist):
+        """Returns the PMIDs (list of str) of the papers a biologist is the last author of, newest first."""
+        first = self.AUTHORED_BASE + biologist * 200
+        return [str(first + number) for number in reversed(range(self.num_authored(biologist)))]
+
+    def owner(self, pmid):
+        """Returns the biologist who is last author of a paper, or None for the seed papers."""
+        if pmid >= self.SEED_BASE:
+            return None
+        if pmid >= self.AUTHORED_BASE:
+            return (pmid - self.AUTHORED_BASE) // 200
+        return (pmid - self.POOL_BASE) % self.num_biologists
+
+    def authors(self, pmid):
+        """Returns the MEDLINE full names of the authors of any paper."""
+        owner = self.owner(pmid)
+        if owner is None:
+            return ["Rasmussen, Carolyn G"]
+        first = int(self._rng(pmid).integers(0, self.num_biologists - 1))
+        first += first >= owner
+        return [self.biologist_name(first), "Student, Alex", self.biologist_name(owner)]
+
+    def topic_refs(self, rng, topic, count):
+        """Draws count cited papers: half from the skewed global popularity and half from the topic's block of the pool."""
+        popular = (self.num_papers * rng.random(count // 2) ** 3).astype(np.int64)
+        block = self.num_papers // self.num_topics
+        topical = topic * block + rng.integers(0, block, count - count // 2)
+        return [str(self.POOL_BASE + index) for index in dict.fromkeys(np.concatenate([popular, topical]).tolist())]
+
+    def refs(self, pmid):
+        """Returns the PMIDs (list of str) referenced by a paper.  Papers of the cited pool have no references."""
+        if pmid >= self.SEED_BASE:
+            return self.topic_refs(self._rng(pmid), 0, 50)
+        if pmid >= self.AUTHORED_BASE:
+            rng = self._rng(pmid)
+            return self.topic_refs(rng, self.owner(pmid) % self.num_topics, int(rng.poisson(self.refs_per_paper)))
+        return []
+
+    def citedin(self, pmid):
+        """Returns the PMIDs (list of str) citing a paper.  Only the seed papers have citing papers, one authored paper of every biologist."""
+        if pmid >= self.SEED_BASE:
+            return [str(self.AUTHORED_BASE + biologist * 200) for biologist in range(self.num_biologists) if biologist % 3 == pmid % 3]
+        return []
+
+    def year(self, pmid):
+        """Returns the publication year of a paper, the same as its MEDLINE record gives."""
+        return 1970 + int(self._rng(pmid + 7).integers(0, 51))
+
+    def in_window(self, pmid, params):
+        """Returns whether the year of a paper falls between the mindate and maxdate of a request (always True without them)."""
+        mindate = params.get("mindate", [""])[0]
+        maxdate = params.get("maxdate", [""])[0]
+        year = self.year(pmid)
+        return (not mindate or year >= int(mindate[:4])) and (not maxdate or year <= int(maxdate[:4]))
+
+    def medline(self, pmid):
+        """Returns the MEDLINE text record of a paper."""
+        rng = self._rng(pmid + 7)
+        lines = ["PMID- {}".format(pmid), "DP  - {} {}".format(1970 + int(rng.integers(0, 51)), "Jan"), "TI  - " + " ".join(WORDS[index] for index in rng.integers(0, len(WORDS), 10)).capitalize() + "."]
+        for author in self.authors(pmid):
+            last_name, _, first_name = author.partition(", ")
+            lines.append("FAU - " + author)
+            lines.append("AU  - {} {}".format(last_name, "".join(word[0] for word in first_name.split())))
+            lines.append("AD  - Department of Biology, University of {}, USA.".format(LAST_NAMES[zlib.crc32(last_name.encode()) % len(LAST_NAMES)]))
+        lines.append("JT  - " + JOURNALS[pmid % len(JOURNALS)])
+        return "\n".join(lines) + "\n"
+
+    def _post(self, ids):
+        with self._lock:
+            webenv = "MCID_synthetic_{}".format(len(self._webenvs) + 1)
+            self._webenvs[webenv] = ids
+        return webenv
+
+    def _history_ids(self, params):
+        with self._lock:
+            return self._webenvs.get(params.get("webenv", [""])[0], [])
+
+    def respond(self, endpoint, params):
+        """Returns the response body (bytes) for a request, params as parsed by urllib.parse.parse_qs."""
+        params = {name.lower(): values for name, values in params.items()}
+        if endpoint == "esearch":
+            match = re.search(r"[A-Za-z]+(\d+)", params.get("term", [""])[0])
+            biologist = int(match.group(1)) if match else None
+            ids = self.authored_papers(biologist) if biologist is not None and biologist < self.num_biologists else []
+            ids = [pmid for pmid in ids if self.in_window(int(pmid), params)]
+            count = len(ids)
+            start = int(params.get("retstart", ["0"])[0])
+            ids = ids[start:start + int(params.get("retmax", ["20"])[0])]
+            id_xml = "".join("<Id>{}</Id>".format(pmid) for pmid in ids)
+            body = '<?xml version="1.0" encoding="UTF-8" ?>\n{}\n<eSearchResult><Count>{}</Count><RetMax>{}</RetMax><RetStart>{}</RetStart><QueryKey>1</QueryKey><WebEnv>{}</WebEnv><IdList>{}</IdList><TranslationSet/><QueryTranslation>{}</QueryTranslation></eSearchResult>'.format(ESEARCH_DOCTYPE, count, len(ids), start, self._post(ids), id_xml, params.get("term", [""])[0])
+        elif endpoint == "epost":
+            ids = [pmid for value in params.get("id", []) for pmid in value.split(",")]
+            body = '<?xml version="1.0" encoding="UTF-8" ?>\n{}\n<ePostResult><QueryKey>1</QueryKey><WebEnv>{}</WebEnv></ePostResult>'.format(EPOST_DOCTYPE, self._post(ids))
+        elif endpoint == "efetch":
+            ids = self._history_ids(params) if "webenv" in params else [pmid for value in params.get("id", []) for pmid in value.split(",")]
+            start = int(params.get("retstart", ["0"])[0])
+            ids = ids[start:start + int(params.get("retmax", [str(len(ids))])[0])]
+            body = "\n".join(self.medline(int(pmid)) for pmid in ids)
+        elif endpoint == "elink":
+            linkname = params.get("linkname", ["pubmed_pubmed_refs"])[0]
+            links = self.refs if linkname.endswith("refs") else self.citedin
+            linksets = []
+            for pmid in [pmid for value in params.get("id", []) for pmid in value.split(",")]:
+                found = [link for link in links(int(pmid)) if self.in_window(int(link), params)]
+                link_xml = "<LinkSetDb><DbTo>pubmed</DbTo><LinkName>{}</LinkName>{}</LinkSetDb>".format(linkname, "".join("<Link><Id>{}</Id></Link>".format(link) for link in found)) if found else ""
+                linksets.append("<LinkSet><DbFrom>pubmed</DbFrom><IdList><Id>{}</Id></IdList>{}</LinkSet>".format(pmid, link_xml))
+            body = '<?xml version="1.0" encoding="UTF-8" ?>\n{}\n<eLinkResult>{}</eLinkResult>'.format(ELINK_DOCTYPE, "".join(linksets))
+        else:
+            raise KeyError("Unsupported E-utility {}".format(endpoint))
+        return body.encode("utf-8")
+
+
+class FixtureReplay:
+    """Serves responses recorded by RecordingProxy.
+
+    Arguments:
+    path - str; JSON lines fixture file, one {"key", "body"} object per response
+    """
+
+    def __init__(self, path):
+        self.responses = {}
+        with open(path) as handle:
+            for line in handle:
+                entry = json.loads(line)
+                self.responses[entry["key"]] = entry["body"].encode("utf-8")
+
+    def respond(self, endpoint, params):
+        key = fixture_key(endpoint, params)
+        if key not in self.responses:
+            raise KeyError("No recorded response for {}".format(key))
+        return self.responses[key]
+
+
+class RecordingProxy:
+    """Forwards requests to the live E-utilities and appends every response to a fixture file.  Requests already recorded are answered from the file, so a recording can be resumed.
+
+    Arguments:
+    path - str; JSON lines fixture file
+    base_url (optional) - str; E-utilities to record from
+    """
+
+    def __init__(self, path, base_url=LIVE_BASE_URL):
+        self.path = path
+        self.base_url = base_url
+        self._lock = threading.Lock()
+        try:
+            self.replay = FixtureReplay(path)
+        except FileNotFoundError:
+            self.replay = None
+
+    def respond(self, endpoint, params):
+        key = fixture_key(endpoint, params)
+        if self.replay is not None and key in self.replay.responses:
+            return self.replay.responses[key]
+        with urlopen(self.base_url + endpoint + ".fcgi", data=urlencode(params, doseq=True).encode("utf-8"), timeout=120) as handle:
+            body = handle.read()
+        with self._lock:
+            with open(self.path, "a") as handle:
+                handle.write(json.dumps({"key": key, "body": body.decode("utf-8")}) + "\n")
+        return body
+
+
+class FakeEutilsServer:
+    """E-utilities stand-in on localhost serving one of the backends above from a background thread.  Counts requests and response bytes per endpoint.  A backend answers an unknown request by raising KeyError (HTTP 404) and can answer with any other error status by raising ErrorResponse.
+
+    Arguments:
+    backend - object with respond(endpoint, params) returning bytes
+    port (optional) - int; 0 picks a free port
+    """
+
+    def __init__(self, backend, port=0):
+        self.backend = backend
+        self.requests = {}
+        self.bytes_sent = {}
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _answer(self, query):
+                endpoint = urlparse(self.path).path.rsplit("/", 1)[-1].replace(".fcgi", "")
+                try:
+                    body = server.backend.respond(endpoint, parse_qs(query, keep_blank_values=True))
+                    status = 200
+                except KeyError as err:
+                    body = str(err).encode("utf-8")
+                    status = 404
+                except ErrorResponse as err:
+                    body = str(err).encode("utf-8")
+                    status = err.status
+                with server._lock:
+                    server.requests[endpoint] = server.requests.get(endpoint, 0) + 1
+                    server.bytes_sent[endpoint] = server.bytes_sent.get(endpoint, 0) + len(body)
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if urlparse(self.path).path.endswith("/_counters"):
+                    body = json.dumps(server.counters()).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                self._answer(urlparse(self.path).query)
+
+            def do_POST(self):
+                self._answer(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:{}/".format(self.httpd.server_address[1])
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def counters(self):
+        """Returns a copy of the request and byte counts per endpoint (dicts)."""
+        with self._lock:
+            return dict(self.requests), dict(self.bytes_sent)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class ServerProcess:
+    """Runs a FakeEutilsServer in a child process (see main) and reads its counters over HTTP, so the server's work does not show up in the timings or memory of the benchmarking process.
+
+    Arguments:
+    args - list of str; command line arguments of this file, e.g. ["--scale", "10"]
+    """
+
+    def __init__(self, args):
+        self.args = list(args)
+        self.process = None
+        self.url = None
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, __file__] + self.args, stdout=subprocess.PIPE, text=True)
+        self.url = self.process.stdout.readline().strip()
+        if not self.url:
+            raise RuntimeError("The fake E-utilities server did not start.")
+        return self
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+    def counters(self):
+        """Returns the request and byte counts per endpoint (dicts) of the server."""
+        with urlopen(self.url + "_counters", timeout=30) as handle:
+            return tuple(json.loads(handle.read()))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def build_backend(args):
+    """Returns the backend selected on the command line."""
+    if args.record:
+        return RecordingProxy(args.record)
+    if args.fixtures:
+        return FixtureReplay(args.fixtures)
+    return SyntheticPubMed(args.scale, seed=args.seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serves a local stand-in for the NCBI E-utilities and prints its URL.")
+    parser.add_argument("--scale", type=float, default=1, help="size of the synthetic graph relative to the Rasmussen example")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic graph")
+    parser.add_argument("--fixtures", help="replay recorded responses from this JSON lines file")
+    parser.add_argument("--record", help="forward to the live E-utilities and record the responses to this JSON lines file")
+    parser.add_argument("--port", type=int, default=0, help="port to listen on, 0 picks a free one")
+    args = parser.parse_args(argv)
+    server = FakeEutilsServer(build_backend(args), args.port)
+    print(server.url, flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+'''
+Library API for BiologyFinder.  A BiologyFinder object runs a whole analysis for one seed scientist without prompting, and run_manifest runs many seed scientists in a process pool that shares one on-disk fetch cache.
+'''
+import csv
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from Bio import Entrez
+import biologyfinder_fxn as bffxn
+import biologyfinder_cache as bfcache
+import biologyfinder_pipeline as bfpipeline
+import biologyfinder_scheduler as bfscheduler
+import biologyfinder_metrics as bfmetrics
+import biologyfinder_pagerank as bfpagerank
+import biologyfinder_state as bfstate
+import biologyfinder_storage as bfstorage
+
+
+class BiologyFinder:
+    """Finds biologists whose citation history is similar to a set of seed papers and builds a reading list for the subfield.
+
+    Arguments:
+    name (optional) - str; scientist name in the format "firstname middleinit lastname", used to find seed papers when seed_pmids is not provided
+    affiliation (optional) - str; scientist's institutional affiliation
+    seed_pmids (optional) - list; paper IDs (str) of the originating set of papers
+    top_percent (optional) - float; fraction of the master list reported as most similar, e.g. .2 for 20%
+    reading_list_size (optional) - int; number of papers on the reading list
+    metric (optional) - str; "pearson", "jaccard", "cosine" or "tanimoto"
+    num_seed_papers (optional) - int; number of the scientist's most recent papers used when seed_pmids is not provided
+    run_id (optional) - str; checkpoint the run under this ID ("new" for a fresh ID) instead of streaming it
+    weighting (optional) - str; "count" ranks the reading list by citation counts, "similarity" weights each citation by the citing biologist's similarity score and "recency" favors recent papers
+    min_df (optional) - int; drop papers cited by fewer biologists before scoring, None keeps every paper
+    max_df (optional) - int or float; drop papers cited by more biologists (a float is a fraction of the biologists) before scoring
+    seed_sets (optional) - dict; keys are seed set names (str) and the values are lists of paper IDs (str), e.g. one per project of a lab, scored separately by run_seed_sets against one citation matrix built from all their papers
+    engine (optional) - str; "similarity" compares citation vectors with the metric, "pagerank" ranks biologists and the reading list with personalized PageRank on the co-citation graphs
+    logger (optional) - logging.Logger; receives the progress messages
+    """
+
+    def __init__(self, name=None, affiliation=None, seed_pmids=None, top_percent=0.2, reading_list_size=10, metric="pearson", num_seed_papers=3, run_id=None, weighting="count", min_df=None, max_df=None, seed_sets=None, engine="similarity", logger=None):
+        if not name and not seed_pmids and not seed_sets:
+            raise ValueError("Either a scientist name, seed PMIDs or seed sets are needed.")
+        self.seed_sets = {seed_set: [str(pmid) for pmid in pmids] for seed_set, pmids in seed_sets.items()} if seed_sets else {}
+        if not seed_pmids and not name:
+            seed_pmids = list(dict.fromkeys(pmid for pmids in self.seed_sets.values() for pmid in pmids))
+        self.name = name
+        self.affiliation = affiliation or None
+        self.seed_pmids = [str(pmid) for pmid in seed_pmids] if seed_pmids else None
+        self.top_percent = top_percent
+        self.reading_list_size = reading_list_size
+        self.metric = metric
+        self.num_seed_papers = num_seed_papers
+        self.run_id = run_id
+        self.weighting = weighting
+        self.min_df = min_df
+        self.max_df = max_df
+        self.engine = engine
+        self.logger = logger or logging.getLogger(__name__)
+        self.biologist_finder = None
+        self.comparison_matrix = None
+        self.similarity_df = None
+
+    @classmethod
+    def from_saved_matrix(cls, path, **kwargs):
+        """Returns a BiologyFinder that scores a citation matrix saved with save_matrix instead of fetching citation data.  Other arguments are passed to BiologyFinder."""
+        biologist_finder = bfstorage.load_citation_matrix(path)
+        kwargs.setdefault("seed_pmids", bfstorage.load_citation_meta(path)["seed_pmids"] or ["unknown"])
+        finder = cls(**kwargs)
+        finder.biologist_finder = biologist_finder
+        return finder
+
+    def save_matrix(self, path):
+        """Saves the citation matrix in the compact binary format of biologyfinder_storage so it can be rescored later without fetching anything."""
+        if self.biologist_finder is None:
+            self.build()
+        return bfstorage.save_citation_matrix(self.biologist_finder, path, self.seed_pmids)
+
+    def seed_papers(self):
+        """Returns the seed paper IDs, looking up the scientist's most recent papers if none were given."""
+        if self.seed_pmids is None:
+            id_list = bffxn.get_scientist_papers(self.name, self.affiliation, max_results=self.num_seed_papers)[0]
+            self.seed_pmids = id_list[:self.num_seed_papers]
+            self.logger.info("Using the {} most recent papers of {} as seed papers: {}".format(len(self.seed_pmids), self.name, self.seed_pmids))
+        return self.seed_pmids
+
+    @bfmetrics.timed
+    def build(self):
+        """Gathers the citation data and returns the CitationMatrix with the comparison vector as its last row."""
+        if self.run_id is not None:
+            self.biologist_finder = bfstate.run_resumable(self.seed_papers(), self.logger, None if self.run_id == "new" else self.run_id)[0]
+        else:
+            self.biologist_finder = bfpipeline.run_pipeline(self.seed_papers(), self.logger, self.metric)[0]
+        self._prune()
+        return self.biologist_finder
+
+    def refresh(self, until=None, datetype="edat"):
+        """Updates the checkpointed run run_id with what PubMed added since its last sync instead of building it again (see biologyfinder_state.refresh_run).  Call run afterwards to score the refreshed citation matrix.
+
+        Arguments:
+        until (optional) - str; last day of the refresh as "YYYY/MM/DD", today if not provided
+        datetype (optional) - str; "edat", "pdat" or "mdat", the PubMed date the refresh window applies to
+
+        Returns:
+        changes - dict; the refresh window, the number of new papers, the new and removed biologists and the number of matrix rows rebuilt
+        """
+        if self.run_id in (None, "new"):
+            raise ValueError("Only a checkpointed run can be refreshed, give its run_id.")
+        self.biologist_finder, state, changes = bfstate.refresh_run(self.run_id, self.logger, until=until, datetype=datetype)
+        self.seed_pmids = state.seed_papers
+        self._prune()
+        return changes
+
+    def _prune(self):
+        self.comparison_matrix = None
+        if not self.seed_sets and self.min_df is None and self.max_df is None:
+            return
+        unpruned_papers = self.biologist_finder.papers
+        if self.seed_sets:
+            # Built before pruning so the papers only the seed sets cite are kept
+            self.comparison_matrix = bffxn.create_comparison_matrix(self.seed_sets, unpruned_papers, self.logger)
+        if self.min_df is not None or self.max_df is not None:
+            protected_columns = None if self.comparison_matrix is None else np.unique(self.comparison_matrix.indices)
+            self.biologist_finder = bffxn.prune_paper_features(self.biologist_finder, self.logger, self.min_df or 1, self.max_df, protected_columns=protected_columns)
+            if self.comparison_matrix is not None:
+                self.comparison_matrix = bffxn.select_paper_columns(self.comparison_matrix, unpruned_papers, self.biologist_finder.papers)
+
+    def run(self):
+        """Runs the full analysis.
+
+        Returns:
+        result - dict; the seed scientist and papers, the most similar biologists with their scores, the reading list and the size of the citation matrix
+        """
+        if self.biologist_finder is None:
+            self.build()
+        self.similarity_df = bffxn.create_similarity_scores_df(self.biologist_finder, self.metric, self.engine)
+        return self._result(self.similarity_df, self.seed_pmids)
+
+    def run_seed_sets(self, max_workers=None):
+        """Scores every seed set against one citation matrix, built from the papers of all the seed sets unless seed PMIDs or a name were given.  All comparison vectors are scored in one sparse matrix product spread across cores, and each seed set gets its own ranking and reading list.
+
+        Arguments:
+        max_workers (optional) - int; number of threads used for scoring, defaults to the number of cores
+
+        Returns:
+        results - dict; keys are seed set names (str) and the values are results in the form returned by run, with the seed set name added
+        """
+        if not self.seed_sets:
+            raise ValueError("No seed sets to score.")
+        if self.biologist_finder is None:
+            self.build()
+        comparison_matrix = self.comparison_matrix
+        if comparison_matrix is None:
+            comparison_matrix = bffxn.create_comparison_matrix(self.seed_sets, self.biologist_finder.papers, self.logger)
+        similarity_dfs = bffxn.create_multi_similarity_scores_dfs(self.biologist_finder, comparison_matrix, list(self.seed_sets), self.metric, max_workers, self.engine)
+        if self.engine == "pagerank":
+            paper_scores = bfpagerank.paper_pagerank(self.biologist_finder, comparison_matrix=comparison_matrix)
+        results = {}
+        for column, (seed_set, similarity_df) in enumerate(similarity_dfs.items()):
+            seed_set_paper_scores = paper_scores[:, column] if self.engine == "pagerank" else None
+            results[seed_set] = dict(self._result(similarity_df, self.seed_sets[seed_set], seed_set_paper_scores), seed_set=seed_set)
+        return results
+
+    def _result(self, similarity_df, seed_pmids, paper_scores=None):
+        top_sim_bio_df = bffxn.most_sim_biologists(similarity_df, self.top_percent)
+        with bfmetrics.span("reading_list"):
+            if paper_scores is None:
+                citation_counts, paper_scores = bffxn.paper_citation_counts(self.biologist_finder, top_sim_bio_df, self.logger, self.weighting, engine=self.engine, num_papers=self.reading_list_size)[:2]
+            else:
+                citation_counts = bffxn.paper_citation_counts(self.biologist_finder, top_sim_bio_df, self.logger)[0]
+            reading_list = [{"pmid": self.biologist_finder.papers[column], "citations": int(citation_counts[column]), "score": float(paper_scores[column])} for column in bffxn.top_papers(paper_scores, self.reading_list_size)]
+        return {
+            "name": self.name,
+            "affiliation": self.affiliation,
+            "seed_pmids": seed_pmids,
+            "metric": self.metric,
+            "weighting": self.weighting,
+            "engine": self.engine,
+            "num_biologists": len(self.biologist_finder.biologists) - 1,
+            "num_papers": len(self.biologist_finder.papers),
+            "similar_biologists": [{"scientist": row.Scientist, "similarity": None if pd.isna(row.similarity) else float(row.similarity)} for row in top_sim_bio_df.itertuples()],
+            "reading_list": reading_list,
+        }
+
+
+def read_manifest(manifest_path):
+    """Reads a manifest of seed scientists.  JSON manifests hold a list of objects with the BiologyFinder arguments as keys.  CSV manifests have one row per scientist with the same column names and the seed PMIDs separated by spaces or semicolons.
+
+    Arguments:
+    manifest_path - str; path to a .json or .csv file
+
+    Returns:
+    entries - list of dicts; BiologyFinder keyword arguments for each seed scientist
+    """
+    if manifest_path.endswith(".json"):
+        with open(manifest_path) as handle:
+            return json.load(handle)
+    entries = []
+    with open(manifest_path, newline="") as handle:
+        for row in csv.DictReader(handle):
+            entry = {key: value for key, value in row.items() if value not in (None, "")}
+            if "seed_pmids" in entry:
+                entry["seed_pmids"] = re.split(r"[;\s,]+", entry["seed_pmids"].strip())
+            for key, convert in (("top_percent", float), ("reading_list_size", int), ("num_seed_papers", int), ("min_df", int), ("max_df", bffxn.parse_document_frequency)):
+                if key in entry:
+                    entry[key] = convert(entry[key])
+            entries.append(entry)
+    return entries
+
+
+def result_file_name(entry, position):
+    """Builds a file name (str, no extension) for the results of a manifest entry."""
+    label = entry.get("name") or "_".join(entry.get("seed_pmids", []))
+    return "{:03d}_{}".format(position, re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_").lower())
+
+
+def write_result(result, path, output_format="json"):
+    """Writes the result of a BiologyFinder run as JSON, or as Parquet (one table of similar biologists and one of the reading list, requires pyarrow).
+
+    Arguments:
+    result - dict; returned by BiologyFinder.run
+    path - str; output path without extension
+    output_format (optional) - str; "json" or "parquet"
+
+    Returns:
+    paths - list; files written
+    """
+    if output_format == "parquet":
+        biologists_path = path + "_biologists.parquet"
+        reading_path = path + "_reading_list.parquet"
+        pd.DataFrame(result["similar_biologists"]).to_parquet(biologists_path)
+        pd.DataFrame(result["reading_list"]).to_parquet(reading_path)
+        return [biologists_path, reading_path]
+    with open(path + ".json", "w") as handle:
+        json.dump(result, handle, indent=2)
+    return [path + ".json"]
+
+
+def _init_worker(email, api_key, cache_path, offline, rate):
+    Entrez.email = email
+    Entrez.api_key = api_key
+    if cache_path:
+        bfcache.configure_cache(cache_path, offline=offline)
+    bfscheduler.configure_scheduler(rate=rate)
+
+
+def _run_entry(job):
+    entry, path, output_format = job
+    logger = logging.getLogger("biologyfinder.{}".format(os.path.basename(path)))
+    try:
+        result = BiologyFinder(logger=logger, **entry).run()
+    except Exception as err:
+        return {"entry": entry, "error": repr(err)}
+    return {"entry": entry, "files": write_result(result, path, output_format)}
+
+
+def run_manifest(manifest_path, output_dir, processes=4, cache_path="BiologyFinder_cache.sqlite", offline=False, output_format="json"):
+    """Runs BiologyFinder for every seed scientist in a manifest using a pool of processes.  The processes share one SQLite fetch cache and split NCBI's request rate between them.
+
+    Arguments:
+    manifest_path - str; .json or .csv manifest, see read_manifest
+    output_dir - str; directory the results are written to
+    processes (optional) - int; number of worker processes
+    cache_path (optional) - str; SQLite file of the shared fetch cache, None turns caching off
+    offline (optional) - bool; answer only from the cache
+    output_format (optional) - str; "json" or "parquet"
+
+    Returns:
+    summary - list of dicts; the manifest entry and either the files written or the error for each seed scientist
+    """
+    entries = read_manifest(manifest_path)
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [(entry, os.path.join(output_dir, result_file_name(entry, position)), output_format) for position, entry in enumerate(entries, 1)]
+    rate = bfscheduler.allowed_rate() / max(processes, 1)
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(Entrez.email, Entrez.api_key, cache_path, offline, rate)) as executor:
+        summary = list(executor.map(_run_entry, jobs))
+    with open(os.path.join(output_dir, "summary.json"), "w") as handle:
+        json.dump(summary, handle, indent=2)
+    return summary
@@ -0,0 +1,261 @@
+'''
+Author identity index for BiologyFinder.  Author names are interned to integer identity IDs and grouped in hash buckets keyed on (last name, first initial), so name variants such as "Smith, J A" and "Smith, John A" merge no matter where they fall in a sorted list.  Each identity also carries co-author and affiliation fingerprints from the MEDLINE FAU/AD fields.  Two people with the same name are only kept apart on positive evidence, a known institution that differs from every institution seen for the existing identity with no co-author in common; a sighting without an affiliation or co-authors is unknown evidence and merges.
+'''
+import re
+import unicodedata
+
+
+# Words that mark the institution part of a MEDLINE affiliation
+INSTITUTION_WORDS = ("universit", "institut", "college", "center", "centre", "laborator", "hospital", "school", "academy", "foundation")
+# Words left out when comparing institutions, so "Stanford University" and "Stanford University School of Medicine" are the same place
+GENERIC_INSTITUTION_WORDS = frozenset(("of", "the", "and", "for", "at", "in", "de", "la", "du", "der", "des", "di", "medicine", "medical", "department", "dept", "faculty", "division", "graduate", "science", "sciences"))
+# Share of distinctive words two institutions need in common to count as the same
+INSTITUTION_MATCH = 0.5
+
+
+def simplify(text):
+    """Lower-cases text and strips accents and punctuation other than spaces and hyphens."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"[^\w\s-]", " ", text.lower()).strip()
+
+
+def split_name(full_name):
+    """Splits a MEDLINE full author name ("lastname, firstname middlename") into the simplified last name and a list of simplified first and middle name tokens.  Runs of initials such as "JA" are split into single letters."""
+    last_name, _, first_names = full_name.partition(",")
+    tokens = []
+    for token in re.split(r"[\s.-]+", first_names.strip()):
+        if not token:
+            continue
+        if token.isupper() and len(token) <= 3:
+            tokens.extend(simplify(token))
+        else:
+            tokens.append(simplify(token))
+    return simplify(last_name), [token for token in tokens if token]
+
+
+def bucket_key(full_name):
+    """Returns the (last name, first initial) hash bucket of an author name."""
+    last_name, tokens = split_name(full_name)
+    return last_name, tokens[0][0] if tokens else ""
+
+
+def first_names_compatible(tokens, other_tokens):
+    """Checks whether two lists of first/middle name tokens can belong to the same person.  Tokens are compared position by position and an initial matches any name that starts with it, while a missing middle name matches anything."""
+    for token, other in zip(tokens, other_tokens):
+        if len(token) == 1 or len(other) == 1:
+            if token[0] != other[0]:
+                return False
+        elif token != other:
+            return False
+    return True
+
+
+def affiliation_institution(affiliation):
+    """Picks the institution out of a MEDLINE affiliation string, e.g. "University of California Riverside" from "Department of Botany, University of California Riverside, Riverside, CA, USA."."""
+    parts = [part.strip(" .") for part in affiliation.split(",") if part.strip(" .")]
+    for part in parts:
+        if any(word in part.lower() for word in INSTITUTION_WORDS):
+            return part
+    return parts[0] if parts else ""
+
+
+def institution_words(institution):
+    """Returns the distinctive words (frozenset of str) of an institution name, leaving out generic ones such as "university", "school" or "of"."""
+    return frozenset(word for word in simplify(institution).split() if word not in GENERIC_INSTITUTION_WORDS and not any(word.startswith(generic) for generic in INSTITUTION_WORDS))
+
+
+def same_institution(institution, other):
+    """Checks whether two institution names can be the same place.  Names whose distinctive words overlap by at least INSTITUTION_MATCH (Jaccard) match, and a name with no distinctive words matches anything."""
+    words, other_words = institution_words(institution), institution_words(other)
+    if not words or not other_words:
+        return True
+    return len(words & other_words) / len(words | other_words) >= INSTITUTION_MATCH
+
+
+def coauthor_key(full_name):
+    """Returns the "lastname|firstinitial" key used for co-author fingerprints."""
+    return "|".join(bucket_key(full_name))
+
+
+class AuthorIdentity:
+    """One person in the AuthorIdentityIndex."""
+    __slots__ = ("identity_id", "last_name", "first_tokens", "full_name", "variants", "coauthors", "affiliations", "papers", "label")
+
+    def __init__(self, identity_id, full_name):
+        self.identity_id = identity_id
+        self.last_name, self.first_tokens = split_name(full_name)
+        self.full_name = full_name
+        self.variants = {full_name}
+        self.coauthors = set()
+        self.affiliations = {}
+        self.papers = set()
+        self.label = None
+
+    def add(self, full_name, pmid=None, coauthors=(), affiliation=None):
+        self.variants.add(full_name)
+        last_name, first_tokens = split_name(full_name)
+        # Keep the most complete spelling of the name, e.g. "Smith, John A" over "Smith, J A"
+        if sum(len(token) for token in first_tokens) > sum(len(token) for token in self.first_tokens):
+            self.first_tokens = first_tokens
+            self.full_name = full_name
+        if pmid is not None:
+            self.papers.add(pmid)
+        self.coauthors.update(coauthors)
+        if affiliation:
+            self.affiliations[affiliation] = self.affiliations.get(affiliation, 0) + 1
+
+    def main_affiliation(self):
+        """Returns the institution seen most often for this person or None."""
+        if not self.affiliations:
+            return None
+        return max(self.affiliations, key=self.affiliations.get)
+
+    def match_score(self, coauthors, institution):
+        """Returns how well a new sighting fits this person: the number of shared co-authors plus one for a matching institution.  Returns None when the sighting conflicts, i.e. both sides have a known institution, they differ (see same_institution) and no co-author is shared.  A missing institution on either side is unknown rather than a mismatch."""
+        shared = len(self.coauthors.intersection(coauthors))
+        if institution is None or not self.affiliations:
+            return shared
+        if any(same_institution(institution, known) for known in self.affiliations):
+            return shared + 1
+        return shared if shared else None
+
+
+class AuthorIdentityIndex:
+    """Interns author names to integer identity IDs, merging spelling variants of the same person and splitting people who share a name.
+
+    Arguments:
+    split_homonyms (optional) - bool; keep same-name authors apart when they were seen at different institutions and share no co-author
+    """
+
+    def __init__(self, split_homonyms=True):
+        self.split_homonyms = split_homonyms
+        self.identities = []
+        self.buckets = {}
+        self.name_ids = {}
+        self.labels = {}
+
+    def add_author(self, full_name, pmid=None, coauthors=(), affiliation=None):
+        """Adds one sighting of an author and returns their identity ID (int) and whether the identity is new (bool).
+
+        Arguments:
+        full_name - str; MEDLINE FAU name "lastname, firstname middlename"
+        pmid (optional) - str; paper the author was seen on
+        coauthors (optional) - iterable; full names of the other authors of the paper
+        affiliation (optional) - str; MEDLINE AD affiliation of the author on the paper
+        """
+        last_name, first_tokens = split_name(full_name)
+        if not last_name:
+            raise ValueError("Author name {} has no last name.".format(full_name))
+        fingerprint = {coauthor_key(name) for name in coauthors if name != full_name}
+        institution = affiliation_institution(affiliation) if affiliation else None
+        bucket = self.buckets.setdefault(bucket_key(full_name), [])
+        best_id = None
+        best_score = -2
+        for identity_id in bucket:
+            identity = self.identities[identity_id]
+            if not first_names_compatible(first_tokens, identity.first_tokens):
+                continue
+            score = identity.match_score(fingerprint, institution)
+            if score is None:
+                if self.split_homonyms:
+                    continue
+                score = -1
+            if score > best_score:
+                best_id, best_score = identity_id, score
+        is_new = best_id is None
+        if is_new:
+            best_id = len(self.identities)
+            self.identities.append(AuthorIdentity(best_id, full_name))
+            bucket.append(best_id)
+        self.identities[best_id].add(full_name, pmid, fingerprint, institution)
+        self.name_ids[full_name] = best_id
+        return best_id, is_new
+
+    def add_record(self, pmid, authors, affiliations=()):
+        """Adds the first and last authors of a MEDLINE record with the other authors as co-author fingerprints.  The first affiliation is credited to the first author and the last one to the last author.
+
+        Arguments:
+        pmid - str; paper ID
+        authors - list; MEDLINE FAU names of all the authors in order
+        affiliations (optional) - list; MEDLINE AD affiliations in order
+
+        Returns:
+        identity_ids - list; identity IDs (int) of the first and last author
+        """
+        if not authors:
+            return []
+        identity_ids = [self.add_author(authors[0], pmid, authors, affiliations[0] if affiliations else None)[0]]
+        if len(authors) > 1:
+            identity_ids.append(self.add_author(authors[-1], pmid, authors, affiliations[-1] if affiliations else None)[0])
+        return identity_ids
+
+    def label(self, identity_id):
+        """Returns the name used for an identity in results and searches, unique among the labels given out so far and kept until biologist_list relabels every identity.  It is formatted "lastname, firstname" (see format_name) and people sharing that name get their main institution added in parentheses.  People with the same formatted name share a hash bucket, so only the bucket is scanned for them."""
+        identity = self.identities[identity_id]
+        if identity.label is None:
+            name = format_name(identity.full_name)
+            same_name = any(other_id != identity_id and format_name(self.identities[other_id].full_name) == name for other_id in self.buckets[bucket_key(identity.full_name)])
+            identity.label = unique_label(identity, name, same_name, self.labels)
+            self.labels[identity.label] = identity_id
+        return identity.label
+
+    def biologist_list(self):
+        """Returns the labels (list of str) of every identity, alphabetized.  Every identity is labeled again from everything seen so far, so a label given out earlier by label may change, and every identity gets a different label."""
+        plain_names = {}
+        for identity in self.identities:
+            plain_names.setdefault(format_name(identity.full_name), []).append(identity)
+        self.labels = {}
+        for name, identities in plain_names.items():
+            for identity in identities:
+                identity.label = unique_label(identity, name, len(identities) > 1, self.labels)
+                self.labels[identity.label] = identity.identity_id
+        return sorted(self.labels)
+
+
+def unique_label(identity, name, same_name, taken):
+    """Returns the first label of an identity that is not in taken: its formatted name, with its main institution in parentheses first when others share the name, then the same with its full MEDLINE name and last a counter in brackets.
+
+    Arguments:
+    identity - AuthorIdentity; person to label
+    name - str; formatted name of the person, see format_name
+    same_name - bool; whether other people have the same formatted name
+    taken - set or dict; labels (str) already in use
+    """
+    institution = identity.main_affiliation()
+    candidates = []
+    for candidate_name in dict.fromkeys((name, identity.full_name)):
+        with_institution = "{} ({})".format(candidate_name, institution) if institution else None
+        candidates.extend([with_institution, candidate_name] if same_name else [candidate_name, with_institution])
+    for candidate in candidates:
+        if candidate is not None and candidate not in taken:
+            return candidate
+    counter = 2
+    while "{} [{}]".format(candidates[0] or name, counter) in taken:
+        counter += 1
+    return "{} [{}]".format(candidates[0] or name, counter)
+
+
+def format_name(full_name):
+    """Formats a MEDLINE full name as "lastname, firstname" for PubMed author searches (a first name made of initials such as "J A" becomes "JA")."""
+    last_name, _, first_name = full_name.partition(",")
+    first_name = first_name.strip()
+    if len(first_name) > 1 and first_name[1] == " ":
+        first_name = first_name[0] + first_name[-1]
+    elif len(first_name) <= 1:
+        first_name = first_name[:1]
+    return "{}, {}".format(last_name, first_name)
+
+
+def split_biologist_label(label):
+    """Splits a biologist label into the name to search for and the institution added to tell same-name authors apart.  A counter added to keep labels unique is dropped.
+
+    Arguments:
+    label - str; "lastname, firstname" or "lastname, firstname (institution)", optionally followed by " [counter]"
+
+    Returns:
+    name - str; "lastname, firstname"
+    affiliation - str or None; institution of the author
+    """
+    match = re.match(r"^(.*?)(?: \((.+)\))?(?: \[\d+\])?$", label)
+    return match.group(1), match.group(2)
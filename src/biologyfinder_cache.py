@@ -0,0 +1,314 @@
+'''
+Persistent on-disk cache for the Entrez/PubMed requests made by BiologyFinder.  Responses are stored in a SQLite file keyed by the normalized request parameters so that re-running an analysis (or a slightly different one) is answered from disk instead of the network.
+'''
+import hashlib
+import io
+import json
+import sqlite3
+import threading
+import time
+from Bio import Entrez
+import biologyfinder_scheduler as bfscheduler
+import biologyfinder_metrics as bfmetrics
+
+
+# Seconds a cached response stays fresh for each E-utility.  Search results change as PubMed grows, the WebEnv returned by epost expires on the NCBI side after a few hours and fetched records and links change rarely.
+DEFAULT_TTLS = {"esearch": 24 * 3600, "epost": 4 * 3600, "efetch": 30 * 24 * 3600, "elink": 7 * 24 * 3600}
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Once over max_bytes, responses are evicted in batches (doubling up to EVICT_BATCH) until the cache is back under EVICT_TO of max_bytes, so a full cache does not evict on every write
+EVICT_BATCH = 256
+EVICT_TO = 0.9
+# Parameters that do not change the response and are left out of the cache key
+IGNORED_PARAMS = ("email", "tool", "api_key")
+
+
+class OfflineCacheMiss(LookupError):
+    """Raised in offline mode when a request has no cached response."""
+
+
+class EntrezCache:
+    """SQLite-backed store of raw E-utilities responses with per-endpoint TTLs and size-bounded LRU eviction.
+
+    Arguments:
+    path (optional) - str; SQLite file, ":memory:" keeps a throwaway cache for tests
+    ttls (optional) - dict; endpoint name (str) to seconds (int), merged over DEFAULT_TTLS
+    max_bytes (optional) - int; responses are evicted least recently used first once the cache grows past this size
+    offline (optional) - bool; answer only from the cache (stale entries included) and never use the network
+    """
+
+    def __init__(self, path=":memory:", ttls=None, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, body BLOB, size INTEGER, created REAL, accessed REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS history (webenv TEXT, query_key TEXT, request TEXT, PRIMARY KEY (webenv, query_key))")
+        self._conn.commit()
+        # Running total of the response sizes, so writes do not have to sum the whole table
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, endpoint, key):
+        """Returns the cached response body (bytes) for a key or None if it is missing or expired."""
+        with self._lock:
+            row = self._conn.execute("SELECT body, created FROM responses WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or (not self.offline and now - row[1] > self.ttls.get(endpoint, 0)):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return bytes(row[0])
+
+    def put(self, endpoint, key, body):
+        """Stores a response body (bytes) and evicts the least recently used responses if the cache is over max_bytes."""
+        now = time.time()
+        with self._lock:
+            replaced = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", (key, endpoint, sqlite3.Binary(body), len(body), now, now))
+            self._total_bytes += len(body) - (replaced[0] if replaced else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Other processes may share the file, so the total is read again before evicting
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        target = self.max_bytes * EVICT_TO
+        batch = 8
+        while self._total_bytes > target:
+            freed, evicted = self._conn.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM (SELECT size FROM responses ORDER BY accessed LIMIT ?)", (batch,)).fetchone()
+            if not evicted:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)", (batch,))
+            self._total_bytes -= freed
+            batch = min(batch * 2, EVICT_BATCH)
+
+    def remember_history(self, webenv, query_key, request):
+        """Records which request (normalized params, str) a WebEnv/query_key pair stands for."""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO history VALUES (?, ?, ?)", (webenv, str(query_key), request))
+            self._conn.commit()
+
+    def resolve_history(self, webenv, query_key):
+        """Returns the request a WebEnv/query_key pair stands for or None if it is unknown."""
+        with self._lock:
+            row = self._conn.execute("SELECT request FROM history WHERE webenv = ? AND query_key = ?", (webenv, str(query_key))).fetchone()
+        return None if row is None else row[0]
+
+    def clear(self):
+        """Deletes every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("DELETE FROM history")
+            self._conn.commit()
+            self._total_bytes = 0
+
+    def close(self):
+        self._conn.close()
+
+
+_cache = None
+
+
+def configure_cache(path=":memory:", ttls=None, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+    """Turns on caching for every request made through this module.
+
+    Arguments:
+    path (optional) - str; SQLite file holding the cache
+    ttls (optional) - dict; endpoint name (str) to seconds (int)
+    max_bytes (optional) - int; size limit of the cache
+    offline (optional) - bool; answer only from the cache
+
+    Returns:
+    cache - EntrezCache; the cache now in use
+    """
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = EntrezCache(path, ttls, max_bytes, offline)
+    return _cache
+
+
+def get_cache():
+    """Returns the EntrezCache in use or None if caching is off."""
+    return _cache
+
+
+def disable_cache():
+    """Turns caching off."""
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None
+
+
+def normalize_params(endpoint, params, cache=None):
+    """Builds a canonical string for a request.  Parameter names are lower-cased, parameters that do not affect the response are dropped and a WebEnv/query_key pair is replaced by the request it stands for when the cache knows it, so the key stays the same when NCBI hands out a new WebEnv.
+
+    Arguments:
+    endpoint - str; E-utility name ("esearch", "efetch", "epost" or "elink")
+    params - dict; keyword arguments of the request
+    cache (optional) - EntrezCache; used to resolve WebEnv/query_key pairs
+
+    Returns:
+    normalized - str; JSON encoding of the endpoint and parameters
+    """
+    normalized = {}
+    for name, value in params.items():
+        name = name.lower()
+        if name in IGNORED_PARAMS or value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = [str(item) for item in value]
+        else:
+            value = str(value)
+        normalized[name] = value
+    if cache is not None and "webenv" in normalized and "query_key" in normalized:
+        history = cache.resolve_history(normalized["webenv"], normalized["query_key"])
+        if history is not None:
+            del normalized["webenv"]
+            del normalized["query_key"]
+            normalized["history"] = history
+    return json.dumps([endpoint, normalized], sort_keys=True)
+
+
+def _fetch(endpoint, params):
+    return bfscheduler.request(endpoint, params)
+
+
+def _lookup(cache, endpoint, params):
+    normalized = normalize_params(endpoint, params, cache)
+    key = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+    body = cache.get(endpoint, key)
+    bfmetrics.record_cache(endpoint, body is not None)
+    if body is None and cache.offline:
+        raise OfflineCacheMiss("No cached response for {}".format(normalized))
+    return normalized, key, body
+
+
+class CachingStream:
+    """Passes a response stream through to its reader and stores the whole body in the cache once it has been read to the end.  A body that is not read to the end is not cached.
+
+    Arguments:
+    stream - biologyfinder_scheduler.ResponseStream; response being read
+    cache - EntrezCache; cache to store the body in
+    endpoint - str; E-utility name
+    key - str; cache key of the request
+    """
+
+    def __init__(self, stream, cache, endpoint, key):
+        self._stream = stream
+        self._cache = cache
+        self._endpoint = endpoint
+        self._key = key
+        self._chunks = []
+        self._stored = False
+
+    def read(self, size=-1):
+        if size == 0:
+            return b""
+        data = self._stream.read(size)
+        self._chunks.append(data)
+        if not self._stored and (size is None or size < 0 or not data):
+            self._stored = True
+            self._cache.put(self._endpoint, self._key, b"".join(self._chunks))
+            self._chunks = []
+        return data
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def stream(endpoint, params):
+    """Returns a binary handle to the response of an E-utilities request that can be parsed as it arrives, answering from the cache when possible.  A response fetched from the network is added to the cache once it has been read to the end.
+
+    Arguments:
+    endpoint - str; E-utility name ("esearch", "efetch", "epost" or "elink")
+    params - dict; keyword arguments of the request as they would be passed to Bio.Entrez
+
+    Returns:
+    handle - binary file-like object; response body, to be closed by the caller
+    """
+    cache = _cache
+    if cache is None:
+        return bfscheduler.open_stream(endpoint, params)
+    key, body = _lookup(cache, endpoint, params)[1:]
+    if body is not None:
+        return io.BytesIO(body)
+    return CachingStream(bfscheduler.open_stream(endpoint, params), cache, endpoint, key)
+
+
+def _history_from_response(body):
+    try:
+        record = Entrez.read(io.BytesIO(body))
+        return record["WebEnv"], record["QueryKey"]
+    except Exception:
+        return None
+
+
+def request(endpoint, params):
+    """Returns the raw response (bytes) for an E-utilities request, answering from the cache when possible.
+
+    Arguments:
+    endpoint - str; E-utility name ("esearch", "efetch", "epost" or "elink")
+    params - dict; keyword arguments of the request as they would be passed to Bio.Entrez
+
+    Returns:
+    body - bytes; response body
+    """
+    cache = _cache
+    if cache is None:
+        return _fetch(endpoint, params)
+    normalized, key, body = _lookup(cache, endpoint, params)
+    if body is None:
+        body = _fetch(endpoint, params)
+        cache.put(endpoint, key, body)
+    if endpoint == "epost" or params.get("usehistory") == "y":
+        history = _history_from_response(body)
+        if history is not None:
+            cache.remember_history(history[0], history[1], normalized)
+    return body
+
+
+def _handle(body, params):
+    if params.get("retmode") == "text":
+        return io.StringIO(body.decode("utf-8"))
+    return io.BytesIO(body)
+
+
+def esearch(**params):
+    """Cached Entrez.esearch.  Returns a handle to the response."""
+    return _handle(request("esearch", params), params)
+
+
+def efetch(**params):
+    """Cached Entrez.efetch.  Returns a handle to the response (text handle when retmode="text")."""
+    return _handle(request("efetch", params), params)
+
+
+def efetch_stream(**params):
+    """Cached Entrez.efetch read as it arrives, for parsing large MEDLINE responses record by record (see stream).  Returns a binary handle to the response, to be closed by the caller."""
+    return stream("efetch", params)
+
+
+def epost(**params):
+    """Cached Entrez.epost.  Returns a handle to the response."""
+    return _handle(request("epost", params), params)
+
+
+def elink(**params):
+    """Cached Entrez.elink.  Returns a handle to the response."""
+    return _handle(request("elink", params), params)
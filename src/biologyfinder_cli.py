@@ -0,0 +1,186 @@
+'''
+Non-interactive command line interface for BiologyFinder.
+
+Examples:
+python biologyfinder_cli.py run --name "carolyn g rasmussen" --pmids 30150312 29146775 28202734 --top-percent .2 --reading-list-size 10 --output rasmussen
+python biologyfinder_cli.py rescore rasmussen_matrix --metric jaccard --top-percent .1
+python biologyfinder_cli.py refresh 20240101-120000 --output rasmussen_nightly
+python biologyfinder_cli.py batch seeds.csv --output-dir results --processes 4
+'''
+import argparse
+import logging
+import os
+import sys
+from Bio import Entrez
+import biologyfinder as bf
+import biologyfinder_cache as bfcache
+import biologyfinder_graph as bfgraph
+import biologyfinder_fxn as bffxn
+import biologyfinder_metrics as bfmetrics
+import biologyfinder_state as bfstate
+
+
+def build_parser():
+    """Returns the argparse.ArgumentParser of the command line interface."""
+    parser = argparse.ArgumentParser(description="Find biologists whose citation history is similar to a seed scientist and build a reading list for the subfield.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--email", default="", help="email address sent to NCBI with every request")
+    common.add_argument("--api-key", default="", help="NCBI API key (raises the request limit from 3 to 10 per second)")
+    common.add_argument("--cache", default="BiologyFinder_cache.sqlite", help="SQLite file of the fetch cache, 'none' turns caching off")
+    common.add_argument("--offline", action="store_true", help="answer only from the fetch cache")
+    common.add_argument("--format", dest="output_format", choices=("json", "parquet"), default="json", help="output format")
+    common.add_argument("--log", default=None, help="also write progress messages to this file")
+    common.add_argument("--quiet", action="store_true", help="only report warnings and errors")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", parents=[common], help="analyze one seed scientist")
+    run_parser.add_argument("--name", help='scientist name, "firstname middleinit lastname"')
+    run_parser.add_argument("--affiliation", help="scientist's institutional affiliation, no abbreviations")
+    run_parser.add_argument("--pmids", nargs="+", help="seed paper IDs, by default the scientist's most recent papers")
+    run_parser.add_argument("--num-seed-papers", type=int, default=3, help="number of recent papers used when --pmids is not given")
+    run_parser.add_argument("--top-percent", type=float, default=0.2, help="fraction of the master list reported as most similar, e.g. .2 for 20%%")
+    run_parser.add_argument("--reading-list-size", type=int, default=10, help="number of papers on the reading list")
+    run_parser.add_argument("--metric", choices=bffxn.SIMILARITY_METRICS, default="pearson", help="similarity metric")
+    run_parser.add_argument("--engine", choices=bffxn.SCORING_ENGINES, default="similarity", help="rank biologists and papers by similarity of citation vectors or by personalized PageRank on the co-citation graphs")
+    run_parser.add_argument("--weighting", choices=bffxn.READING_LIST_WEIGHTINGS, default="count", help="how citations are weighted when ranking the reading list")
+    run_parser.add_argument("--min-df", type=int, help="drop papers cited by fewer biologists before scoring")
+    run_parser.add_argument("--max-df", type=bffxn.parse_document_frequency, help="drop papers cited by more biologists before scoring, a whole number is a number of biologists and a decimal (e.g. 0.5 or 1.0) a fraction of the biologists")
+    run_parser.add_argument("--seed-set", nargs="+", action="append", metavar=("NAME", "PMID"), help="score a named set of seed papers separately, e.g. one per project; repeat for each set.  The citation matrix is built once from all the sets unless --name or --pmids is given, and each set's results are written to OUTPUT_NNN_NAME")
+    run_parser.add_argument("--run-id", help="checkpoint the run under this ID ('new' for a fresh ID) so it can be resumed")
+    run_parser.add_argument("--graph-store", default="BiologyFinder_graph", help="directory of the shared local citation graph, 'none' turns it off")
+    run_parser.add_argument("--output", default="BiologyFinder_results", help="output path without extension")
+    run_parser.add_argument("--metrics", help="save stage timings, request statistics and memory use to this JSON file (and a chrome://tracing trace next to it) and log a summary table")
+    run_parser.add_argument("--save-matrix", help="also save the citation matrix to this directory so it can be rescored later")
+
+    rescore_parser = subparsers.add_parser("rescore", parents=[common], help="score a saved citation matrix again without fetching anything")
+    rescore_parser.add_argument("matrix", help="directory written by run --save-matrix")
+    rescore_parser.add_argument("--top-percent", type=float, default=0.2, help="fraction of the master list reported as most similar, e.g. .2 for 20%%")
+    rescore_parser.add_argument("--reading-list-size", type=int, default=10, help="number of papers on the reading list")
+    rescore_parser.add_argument("--metric", choices=bffxn.SIMILARITY_METRICS, default="pearson", help="similarity metric")
+    rescore_parser.add_argument("--engine", choices=bffxn.SCORING_ENGINES, default="similarity", help="rank biologists and papers by similarity of citation vectors or by personalized PageRank on the co-citation graphs")
+    rescore_parser.add_argument("--weighting", choices=bffxn.READING_LIST_WEIGHTINGS, default="count", help="how citations are weighted when ranking the reading list")
+    rescore_parser.add_argument("--seed-set", nargs="+", action="append", metavar=("NAME", "PMID"), help="score a named set of seed papers against the saved matrix instead of its own seed papers; repeat for each set")
+    rescore_parser.add_argument("--metrics", help="save stage timings and memory use to this JSON file and log a summary table")
+    rescore_parser.add_argument("--output", default="BiologyFinder_results", help="output path without extension")
+
+    refresh_parser = subparsers.add_parser("refresh", parents=[common], help="update a checkpointed run with the papers PubMed added since its last sync and score it again")
+    refresh_parser.add_argument("run_id", help="ID of a run made with run --run-id")
+    refresh_parser.add_argument("--until", help="last day of the refresh as YYYY/MM/DD, today by default")
+    refresh_parser.add_argument("--datetype", choices=("edat", "pdat", "mdat"), default="edat", help="PubMed date the refresh window applies to: added to PubMed (edat), published (pdat) or modified (mdat)")
+    refresh_parser.add_argument("--top-percent", type=float, default=0.2, help="fraction of the master list reported as most similar, e.g. .2 for 20%%")
+    refresh_parser.add_argument("--reading-list-size", type=int, default=10, help="number of papers on the reading list")
+    refresh_parser.add_argument("--metric", choices=bffxn.SIMILARITY_METRICS, default="pearson", help="similarity metric")
+    refresh_parser.add_argument("--engine", choices=bffxn.SCORING_ENGINES, default="similarity", help="rank biologists and papers by similarity of citation vectors or by personalized PageRank on the co-citation graphs")
+    refresh_parser.add_argument("--weighting", choices=bffxn.READING_LIST_WEIGHTINGS, default="count", help="how citations are weighted when ranking the reading list")
+    refresh_parser.add_argument("--min-df", type=int, help="drop papers cited by fewer biologists before scoring")
+    refresh_parser.add_argument("--max-df", type=bffxn.parse_document_frequency, help="drop papers cited by more biologists before scoring, a whole number is a number of biologists and a decimal (e.g. 0.5 or 1.0) a fraction of the biologists")
+    refresh_parser.add_argument("--graph-store", default="BiologyFinder_graph", help="directory of the shared local citation graph, 'none' turns it off")
+    refresh_parser.add_argument("--output", default="BiologyFinder_results", help="output path without extension")
+    refresh_parser.add_argument("--metrics", help="save stage timings, request statistics and memory use to this JSON file and log a summary table")
+
+    batch_parser = subparsers.add_parser("batch", parents=[common], help="analyze every seed scientist in a manifest")
+    batch_parser.add_argument("manifest", help=".json or .csv manifest of seed scientists")
+    batch_parser.add_argument("--output-dir", default="BiologyFinder_batch", help="directory for the results")
+    batch_parser.add_argument("--processes", type=int, default=4, help="number of worker processes")
+    return parser
+
+
+def setup_logging(log_path=None, quiet=False):
+    """Sends progress messages to the console and optionally to a log file."""
+    logger = logging.getLogger()
+    logger.setLevel(logging.WARNING if quiet else logging.INFO)
+    handlers = [logging.StreamHandler()]
+    if log_path:
+        handlers.append(logging.FileHandler(log_path, mode='w'))
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+
+def parse_seed_sets(seed_set_args, parser):
+    """Turns repeated --seed-set NAME PMID [PMID ...] arguments into a dict of seed set names (str) and paper IDs (list of str)."""
+    seed_sets = {}
+    for seed_set in seed_set_args or []:
+        if len(seed_set) < 2:
+            parser.error("--seed-set needs a name and at least one PMID")
+        seed_sets[seed_set[0]] = seed_set[1:]
+    return seed_sets
+
+
+def write_results(finder, output, output_format, logger):
+    """Runs a BiologyFinder and writes its results, one file per seed set if it has seed sets."""
+    if not finder.seed_sets:
+        results = [(output, finder.run())]
+    else:
+        results = [("{}_{}".format(output, bf.result_file_name({"name": seed_set}, position)), result) for position, (seed_set, result) in enumerate(finder.run_seed_sets().items(), 1)]
+    for path, result in results:
+        for written in bf.write_result(result, path, output_format):
+            logger.info("Results written to {}".format(written))
+
+
+def write_metrics(path, logger):
+    """Logs the summary table of the recorded metrics and saves them to path as JSON and to path with a .trace.json extension as a chrome://tracing trace.  Does nothing if path is None."""
+    if not path:
+        return
+    recorder = bfmetrics.get_metrics()
+    logger.info(recorder.summary_table())
+    recorder.write_json(path)
+    logger.info("Metrics written to {} and {}".format(path, recorder.write_trace(os.path.splitext(path)[0] + ".trace.json")))
+
+
+def main(argv=None):
+    """Runs the command line interface.
+
+    Arguments:
+    argv (optional) - list; command line arguments, sys.argv[1:] if not provided
+
+    Returns:
+    exit_code - int; 0 on success, 1 if any seed scientist failed
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logger = setup_logging(args.log, args.quiet)
+    Entrez.email = args.email
+    Entrez.api_key = args.api_key
+    cache_path = None if args.cache.lower() == "none" else args.cache
+    if args.command == "batch":
+        summary = bf.run_manifest(args.manifest, args.output_dir, args.processes, cache_path, args.offline, args.output_format)
+        failed = [item for item in summary if "error" in item]
+        for item in failed:
+            logger.error("Failed: {} ({})".format(item["entry"], item["error"]))
+        logger.info("Finished {} of {} seed scientists.".format(len(summary) - len(failed), len(summary)))
+        return 1 if failed else 0
+    if cache_path:
+        bfcache.configure_cache(cache_path, offline=args.offline)
+    if args.metrics:
+        bfmetrics.configure_metrics()
+    if args.command == "rescore":
+        finder = bf.BiologyFinder.from_saved_matrix(args.matrix, top_percent=args.top_percent, reading_list_size=args.reading_list_size, metric=args.metric, weighting=args.weighting, seed_sets=parse_seed_sets(args.seed_set, parser), engine=args.engine, logger=logger)
+        write_results(finder, args.output, args.output_format, logger)
+        write_metrics(args.metrics, logger)
+        return 0
+    if args.graph_store.lower() != "none":
+        bfgraph.configure_graph_store(args.graph_store)
+    if args.command == "refresh":
+        if args.run_id not in bfstate.list_runs():
+            parser.error("no saved run {} in {}".format(args.run_id, bfstate.DEFAULT_RUNS_DIR))
+        finder = bf.BiologyFinder(seed_pmids=["unknown"], top_percent=args.top_percent, reading_list_size=args.reading_list_size, metric=args.metric, run_id=args.run_id, weighting=args.weighting, min_df=args.min_df, max_df=args.max_df, engine=args.engine, logger=logger)
+        changes = finder.refresh(args.until, args.datetype)
+        logger.info("Refreshed from {} to {}: {} new papers, {} new and {} removed biologists, {} matrix rows rebuilt.".format(changes["since"], changes["until"], changes["new_papers"], len(changes["new_biologists"]), len(changes["removed_biologists"]), changes["rows_rebuilt"]))
+        write_results(finder, args.output, args.output_format, logger)
+        write_metrics(args.metrics, logger)
+        return 0
+    seed_sets = parse_seed_sets(args.seed_set, parser)
+    if not args.name and not args.pmids and not seed_sets:
+        parser.error("run needs --name, --pmids or --seed-set")
+    finder = bf.BiologyFinder(args.name, args.affiliation, args.pmids, args.top_percent, args.reading_list_size, args.metric, args.num_seed_papers, args.run_id, args.weighting, args.min_df, args.max_df, seed_sets, args.engine, logger)
+    write_results(finder, args.output, args.output_format, logger)
+    if args.save_matrix:
+        logger.info("Citation matrix saved to {}".format(finder.save_matrix(args.save_matrix)))
+    write_metrics(args.metrics, logger)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,25 @@
 import numpy as np
 import pandas as pd
 from Bio import Entrez
-from Bio import Medline
-from scipy.stats import pearsonr
+from scipy import sparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import datetime
 import logging
+import os
+import biologyfinder_cache as bfcache
+import biologyfinder_scheduler as bfscheduler
+import biologyfinder_graph as bfgraph
+import biologyfinder_authors as bfauthors
+import biologyfinder_medline as bfmedline
+import biologyfinder_metrics as bfmetrics
+import biologyfinder_pagerank as bfpagerank
+
+
+# Sparse biologist x paper citation matrix.  "matrix" is a scipy CSR matrix of 1s, "biologists" labels its rows and
+# "papers" (the paper features list) labels its columns.  After columns are pruned, "row_sums" and "num_papers" keep the
+# row sums and width of the unpruned matrix so similarity scores stay the same.
+CitationMatrix = namedtuple("CitationMatrix", ["matrix", "biologists", "papers", "row_sums", "num_papers"], defaults=(None, None))
 
 
 def user_entered_info():
@@ -29,12 +45,46 @@ def user_entered_info():
     return name, affliation
 
 
-def get_scientist_papers(name, affiliation=None):
-    """Searches PubMed for papers whose author list and affiliation list contain the provided author name and affiliation.
+# PubMed's esearch does not return results past the first 10,000 of a search
+ESEARCH_MAX_RESULTS = 10000
+
+
+def search_pubmed(term, page_size=200, max_results=None, **date_range):
+    """Searches PubMed and pages through the results with retstart, so searches with more results than one esearch returns (retmax) are not cut short.
+
+    Arguments:
+    term - str; PubMed search term
+    page_size (optional) - int; number of paper IDs per esearch request
+    max_results (optional) - int; stop after this many paper IDs, every result (up to ESEARCH_MAX_RESULTS) if not provided
+    date_range (optional) - str; esearch date limits, e.g. mindate="2024/01/01", maxdate="2024/01/31", datetype="edat" for the date the papers were added to PubMed
+
+    Returns:
+    ids - list; paper IDs (str), most recent first
+    webenv - str; used to reference cached NCBI search session in future efetch queries
+    query_key - str; used to reference cached NCBI search session in future efetch queries
+    """
+    if max_results is not None:
+        page_size = max(min(page_size, max_results), 1)
+    record = Entrez.read(bfcache.esearch(db='pubmed', term=term, retmax=page_size, usehistory="y", **date_range))
+    ids = list(record['IdList'])
+    count = min(int(record['Count']), ESEARCH_MAX_RESULTS if max_results is None else max_results)
+    while len(ids) < count:
+        page = Entrez.read(bfcache.esearch(db='pubmed', term=term, retstart=len(ids), retmax=min(page_size, count - len(ids)), **date_range))['IdList']
+        if not page:
+            break
+        ids.extend(page)
+    # Papers added while paging shift the later pages, which can repeat an ID
+    return list(dict.fromkeys(ids))[:count], record["WebEnv"], record["QueryKey"]
+
+
+def get_scientist_papers(name, affiliation=None, max_results=None, **date_range):
+    """Searches PubMed for papers whose author list and affiliation list contain the provided author name and affiliation.  Every paper is returned, not only the first page of results (see search_pubmed).
 
     Arguments:
     name - str; complete scientist name in the format "lastname, firstname middleinitial"
     affiliation (optional) - str
+    max_results (optional) - int; only return this many of the most recent papers
+    date_range (optional) - str; only find papers in a date window, e.g. mindate="2024/01/01", maxdate="2024/01/31", datetype="edat"
 
     Returns:
     ids - list; list of paper IDs
@@ -42,15 +92,10 @@ def get_scientist_papers(name, affiliation=None):
     query_key - str; used to reference cached NCBI search session in future efetch queries
     """
     if affiliation == None:
-        handle = Entrez.esearch(db='pubmed', term=name, retmax=200, usehistory="y")
+        terms = name
     else:
         terms = "{} AND {}".format(name, affiliation)
-        handle = Entrez.esearch(db='pubmed', term=terms, retmax=200, usehistory="y")
-    record = Entrez.read(handle)
-    ids = record['IdList']
-    webenv = record["WebEnv"]
-    query_key = record["QueryKey"]
-    return ids, webenv, query_key
+    return search_pubmed(terms, max_results=max_results, **date_range)
 
 
 def user_selected_papers(id_list, webenv, query_key):
@@ -64,10 +109,9 @@ def user_selected_papers(id_list, webenv, query_key):
     Returns
     select_list - list; paper ids of user selected papers
     """
-    from Bio import Medline
     print("Please select up to 3 papers by keying in the corresponding number(s). Seperate each number by a comma.")
-    handle = Entrez.efetch(db="pubmed", id=id_list, rettype='medline', retmode='text', webenv=webenv, query_key=query_key)
-    records = Medline.parse(handle)
+    with bfcache.efetch_stream(db="pubmed", id=id_list, rettype='medline', retmode='text', webenv=webenv, query_key=query_key) as handle:
+        records = list(bfmedline.parse(handle, bfmedline.CITATION_TAGS))
     for index, record in enumerate(records, 1):
         print("{}. {} {}. {}. {}. ({})".format(index, record.get("TI", "?"), record.get("AU", "?"), record.get("JT", "?"), record.get("DP", "?"), record.get("PMID", "?")))
     paper_num = input("Which papers would you like to select? ")
@@ -86,7 +130,7 @@ def user_selected_papers(id_list, webenv, query_key):
 
 
 def compile_refs_and_citedin(paper_list, logger):
-    """Takes a list of paper IDs and returns a list of the IDs for papers referenced in the original paper list.  The reference list may be incomplete since PubMed does not provide references for all papers.
+    """Takes a list of paper IDs and returns a list of the IDs for papers referenced in the original paper list or that cite a paper in the original list.  The reference list may be incomplete since PubMed does not provide references for all papers.
 
     Arguments:
     paper_list - list; paper IDs (str)
@@ -94,105 +138,86 @@ def compile_refs_and_citedin(paper_list, logger):
     Returns:
     pubmed_refs - list; paper IDs (str)
     """
-    str_paper_list = ",".join(paper_list)
-    search_results = Entrez.read(Entrez.epost("pubmed", id=str_paper_list))
-    query_key = search_results["QueryKey"]
-    webenv = search_results["WebEnv"]
-    pub_records = Entrez.read(Entrez.elink(dbfrom="pubmed", WebEnv=webenv, query_key=query_key))
-    ref_ids = []
-    for entry in pub_records[0]["LinkSetDb"]:
-        if entry["LinkName"] == 'pubmed_pubmed_refs':
-            refs = entry["Link"]
-            try:
-                for ref in refs:
-                    ref_ids.append(ref['Id'])
-            except UnboundLocalError:
-                logger.info("No references found")
-        if entry["LinkName"] == 'pubmed_pubmed_citedin':
-            cites = entry["Link"]
-            try:
-                for cite in cites:
-                    ref_ids.append(cite['Id'])
-            except UnboundLocalError:
-                logger.info("No cited in found")
-    #logger.info("Ref_ids list contains {} ids.".format(len(ref_ids)))
-    #logger.info("After removing duplicates, the ", len(set(ref_ids)))
-    return list(set(ref_ids))
+    paper_refs_dict = get_links_bulk(paper_list, logger, 'pubmed_pubmed_refs')
+    paper_citedin_dict = get_links_bulk(paper_list, logger, 'pubmed_pubmed_citedin')
+    ref_ids = compile_refs(paper_list, paper_refs_dict)
+    cite_ids = compile_refs(paper_list, paper_citedin_dict)
+    if not ref_ids:
+        logger.info("No references found")
+    if not cite_ids:
+        logger.info("No cited in found")
+    return list(dict.fromkeys(ref_ids + cite_ids))
 
 
-def get_first_last_authors(paper_id):
-    """Given a paper, returns the first and last authors of the paper.
+def split_into_chunks(id_list, chunk_size):
+    """Splits a list into consecutive chunks.
 
     Arguments:
-    paper_id - str; paper ids
+    id_list - list; paper IDs (str)
+    chunk_size - int; maximum number of IDs per chunk
 
     Returns:
-    authors - list of strs; list of full names of the first and last authors of the provided paper id
+    chunks - list of lists; the IDs in order, chunk_size at a time
     """
-    handle = Entrez.efetch(db='pubmed', id=paper_id, rettype='medline', retmode="text", retmax=200)
-    record = Medline.read(handle)
-    authors = record.get("FAU", "?")
-    first_last_authors = [authors[0], authors[-1]]
-    return first_last_authors
+    return [id_list[i:i + chunk_size] for i in range(0, len(id_list), chunk_size)]
 
 
-def author_formatting(author_list):
-    """Changes the formatting of author name strings to give the best PubMed search results.
+def get_author_records_bulk(paper_list, logger, chunk_size=200):
+    """Given a list of papers, returns the full author list and affiliations of every paper.  The IDs are posted to the NCBI history server a chunk at a time and each chunk is fetched with a single efetch, so the number of requests is the number of chunks rather than the number of papers.  Papers already in the citation graph store are answered locally and fetched papers are added to it.
 
     Arguments:
-    author_list - list of str; list of author names
+    paper_list - list; paper IDs (str)
+    chunk_size (optional) - int; number of papers per epost/efetch request
 
     Returns:
-    formatted_author_list - list of str; alphabetized list of author names formatted "lastname, firstname"
+    author_records - dict; keys are paper IDs (str) and the values are dicts with "authors" (list of full author names, MEDLINE FAU) and "affiliations" (list of str, MEDLINE AD).  Papers without an author list are left out.
     """
-    formatted_author_list = []
-    for author in author_list:
-        #print(author)
-        last_name = author.split(',')[0]
-        first_name = author.split(',')[1].lstrip()
-        try:
-            if first_name[1] == " ":
-                try:
-                    first_name = first_name[0] + first_name[-1]
-                except:
-                    first_name = first_name[0]
-        except:
-            first_name = first_name[0]
-        new_name = "{}, {}".format(last_name, first_name)
-        #print(new_name)
-        formatted_author_list.append(new_name)
-    return sorted(formatted_author_list)
-
-
-def remove_duplicates(sorted_list):
-    """Takes a sorted list of authors and if 2 authors have the same last name and first initial, removes the name with only the first initial leaving behind the one that has the full first name.
+    def fetch_chunk(chunk):
+        search_results = Entrez.read(bfcache.epost(db="pubmed", id=",".join(chunk)))
+        query_key = search_results["QueryKey"]
+        webenv = search_results["WebEnv"]
+        with bfcache.efetch_stream(db="pubmed", rettype='medline', retmode='text', retmax=len(chunk), webenv=webenv, query_key=query_key) as handle:
+            return list(bfmedline.parse(handle, bfmedline.AUTHOR_TAGS))
+
+    store = bfgraph.get_graph_store()
+    author_records = {}
+    missing = []
+    for paper in dict.fromkeys(paper_list):
+        stored = store.get_authors(paper) if store is not None else None
+        if stored is None:
+            missing.append(paper)
+        elif stored[0]:
+            author_records[paper] = {"authors": stored[0], "affiliations": stored[1]}
+    for records in bfscheduler.map_concurrent(fetch_chunk, split_into_chunks(missing, chunk_size)):
+        for record in records:
+            authors = record.get("FAU", [])
+            if store is not None and "PMID" in record:
+                store.add_authors(record["PMID"], authors, record.get("AD", []))
+            if not authors:
+                logger.info("No authors found for paper {}.".format(record.get("PMID", "?")))
+                continue
+            author_records[record.get("PMID", "?")] = {"authors": authors, "affiliations": record.get("AD", [])}
+    return author_records
+
+
+def create_author_index(author_records):
+    """Builds an author identity index from the first and last authors of a set of papers.  Name variants of one person are merged and people sharing a name are told apart by their co-authors and affiliations.
 
     Arguments:
-    sorted_list - list; alphabetized list of authors in the format "lastname, firstname middleinit" or "lastname, firstinit middleinit"
+    author_records - dict; keys are paper IDs (str) and the values are dicts with "authors" and "affiliations" lists, see get_author_records_bulk
 
     Returns:
-    author_no_dup_list - list; alphabetized list of authors with duplicates removed
+    author_index - biologyfinder_authors.AuthorIdentityIndex
     """
-    author_no_dup_list = []
-    most_recent_author = " , "
-    for i, author in enumerate(sorted_list):
-        if author.split(',')[0] == most_recent_author.split(',')[0]:
-            if author.split(',')[1].lstrip()[0] != most_recent_author.split(',')[1].lstrip()[0]:
-                author_no_dup_list.append(author)
-                #print("(1) Compared {} to {} and appended {}".format(author, most_recent_author, author))
-            else:
-                #print("(2) Compared {} to {} and deleted {} and appended {}".format(author, most_recent_author, author_no_dup_list[-1], author))
-                del author_no_dup_list[-1]
-                author_no_dup_list.append(author)
-        else:
-            author_no_dup_list.append(author)
-            #print("(3) Compared {} to {} and appended {}".format(author, most_recent_author, author))
-        most_recent_author = author
-    return author_no_dup_list
+    author_index = bfauthors.AuthorIdentityIndex()
+    for paper, record in author_records.items():
+        author_index.add_record(paper, record["authors"], record.get("affiliations", []))
+    return author_index
 
 
+@bfmetrics.timed
 def create_master_biologist_list(paper_list, logger):
-    """Searches PubMed for all the papers cited by or that cites a paper on the paper list.  Returns a list of the first and last authors of those papers (duplicates removed).
+    """Searches PubMed for all the papers cited by or that cites a paper on the paper list.  Returns a list of the first and last authors of those papers with spelling variants of the same person merged.  Different people who share a name are listed separately with their institution in parentheses.
 
     Arguments:
     paper_list - list; paper IDs (str)
@@ -201,20 +226,40 @@ def create_master_biologist_list(paper_list, logger):
     biologist_master_list - list; biologist names (str)
     """
     ref_citedin_ids = compile_refs_and_citedin(paper_list, logger)
-    first_last_author_list = []
-    for paper in ref_citedin_ids:
-        logger.info("Getting the authors of paper {}.".format(paper))
-        authors = get_first_last_authors(paper)
-        first_last_author_list.extend(authors)
-    set_f_l_author_list = list(set(first_last_author_list))
-    #print(len(set_f_l_author_list))
-    format_f_l_author_list = author_formatting(set_f_l_author_list)
-    #print(len(format_f_l_author_list))
-    no_dup_f_l_author_list = remove_duplicates(format_f_l_author_list)
-    #print(len(no_dup_f_l_author_list))
-    return no_dup_f_l_author_list
+    logger.info("Getting the authors of {} papers.".format(len(ref_citedin_ids)))
+    author_index = create_author_index(get_author_records_bulk(ref_citedin_ids, logger))
+    return author_index.biologist_list()
+
+
+def get_author_papers(biologist, **date_range):
+    """Looks up the IDs of the papers authored by a biologist, answering from the citation graph store when it holds an unexpired search for the biologist.
+
+    Arguments:
+    biologist - str; biologist name in the format "lastname, firstname", optionally followed by the institution in parentheses which is then added to the search
+    date_range (optional) - str; only look for papers in a date window, e.g. mindate="2024/01/01", maxdate="2024/01/31", datetype="edat".  The store is then skipped, and the papers found are added to the biologist's papers in the store if it holds the biologist, keeping the time of the full search so the list still expires with it.
+
+    Returns:
+    papers - list; paper IDs (str)
+    """
+    store = bfgraph.get_graph_store()
+    if store is not None and not date_range:
+        stored = store.get_author_papers(biologist)
+        if stored is not None:
+            return stored
+    name, affiliation = bfauthors.split_biologist_label(biologist)
+    biologist_nocomma = name.replace(',', '')
+    papers = get_scientist_papers(biologist_nocomma, affiliation, **date_range)[0]
+    if store is not None:
+        if not date_range:
+            store.add_author_papers(biologist, papers)
+        else:
+            stored = store.get_author_papers(biologist, include_expired=True)
+            if stored is not None and papers:
+                store.add_author_papers(biologist, list(dict.fromkeys(papers + stored)), store.author_papers_fetched_at(biologist))
+    return papers
 
 
+@bfmetrics.timed
 def create_biologist_paper_dict(biologist_list, logger):
     """Takes a list of biologists and looks up the IDs of all the papers they authored in PubMed.  Returns a dictionary where the biologist's name is the key and the value is a list of their paper IDs.
 
@@ -224,13 +269,11 @@ def create_biologist_paper_dict(biologist_list, logger):
     Returns:
     biologist_paper_dict - dict; keys are biologist names (str) and the values are a list of IDs of the papers authored by the biologist
     """
-    biologist_papers_dict = {}
-    for biologist in biologist_list:
+    def lookup_papers(biologist):
         logger.info("Looking up papers authored by {}.".format(biologist))
-        biologist_nocomma = biologist.replace(',', '')
-        #logger.info("Getting papers authored by {}.".format(biologist_nocomma))
-        papers = get_scientist_papers(biologist_nocomma)[0]
-        biologist_papers_dict[biologist] = papers
+        return get_author_papers(biologist)
+
+    biologist_papers_dict = dict(zip(biologist_list, bfscheduler.map_concurrent(lookup_papers, biologist_list)))
     zero_papers = []
     has_papers = []
     total = 0
@@ -246,6 +289,91 @@ def create_biologist_paper_dict(biologist_list, logger):
     return biologist_papers_dict
 
 
+# Graph store relation holding the links of each elink linkname
+LINK_RELATIONS = {'pubmed_pubmed_refs': "refs", 'pubmed_pubmed_citedin': "citedby"}
+
+
+def get_links_bulk(paper_list, logger, linkname='pubmed_pubmed_refs', chunk_size=100, **date_range):
+    """Takes a list of paper IDs and looks up the papers linked to each of them (referenced papers for "pubmed_pubmed_refs", citing papers for "pubmed_pubmed_citedin").  Every elink request carries up to chunk_size IDs as separate "id" parameters so PubMed returns one link set per source paper, which keeps the links of each paper apart.  Papers already in the citation graph store are answered locally, unless their cited-by links have expired (see biologyfinder_graph.EXPIRING_RELATIONS), and newly fetched links are added to it.
+
+    Arguments:
+    paper_list - list; paper IDs (str)
+    linkname (optional) - str; "pubmed_pubmed_refs" or "pubmed_pubmed_citedin"
+    chunk_size (optional) - int; number of papers per elink request
+    date_range (optional) - str; only look for linked papers in a date window, e.g. mindate="2024/01/01", maxdate="2024/01/31", datetype="edat".  The store is then skipped, and the links found are added to the links the store holds for each paper, keeping the time of the full lookup so they still expire with it.
+
+    Returns:
+    paper_links_dict - dict; keys are paper IDs (str) and the values are lists of the IDs of the linked papers.  Papers whose request failed are left out.
+    """
+    def fetch_chunk(chunk):
+        try:
+            return Entrez.read(bfcache.elink(dbfrom="pubmed", id=chunk, linkname=linkname, **date_range))
+        except (IOError, RuntimeError) as err:
+            logger.info("Could not retrieve the links of {} papers ({}).".format(len(chunk), err))
+            return None
+
+    store = bfgraph.get_graph_store()
+    relation = LINK_RELATIONS[linkname]
+    paper_links_dict = {}
+    missing = []
+    for paper in dict.fromkeys(paper_list):
+        stored = store.get_pmids(relation, paper) if store is not None and not date_range else None
+        if stored is None:
+            missing.append(paper)
+        else:
+            paper_links_dict[paper] = stored
+    chunks = split_into_chunks(missing, chunk_size)
+    for chunk, pub_records in zip(chunks, bfscheduler.map_concurrent(fetch_chunk, chunks)):
+        if pub_records is None:
+            continue
+        fetched = {paper: [] for paper in chunk}
+        for linkset in pub_records:
+            source = linkset["IdList"][0]
+            for entry in linkset["LinkSetDb"]:
+                if entry["LinkName"] == linkname:
+                    fetched[source] = [link['Id'] for link in entry["Link"]]
+        if store is not None:
+            for paper, links in fetched.items():
+                if not date_range:
+                    store.add_pmids(relation, paper, links)
+                elif links:
+                    stored = store.get_pmids(relation, paper, include_expired=True)
+                    if stored is not None:
+                        store.add_pmids(relation, paper, list(dict.fromkeys(links + stored)), store.fetched_at(relation, int(paper)))
+        paper_links_dict.update(fetched)
+    return paper_links_dict
+
+
+def get_refs_bulk(paper_list, logger, chunk_size=100):
+    """Takes a list of paper IDs and looks up the papers referenced by each of them with batched elink requests (see get_links_bulk).  The reference lists may be incomplete since PubMed does not provide references for all papers.
+
+    Arguments:
+    paper_list - list; paper IDs (str)
+    chunk_size (optional) - int; number of papers per elink request
+
+    Returns:
+    paper_refs_dict - dict; keys are paper IDs (str) and the values are lists of the IDs of the papers they reference.  Papers whose request failed are left out.
+    """
+    return get_links_bulk(paper_list, logger, 'pubmed_pubmed_refs', chunk_size)
+
+
+def compile_refs(paper_list, paper_refs_dict):
+    """Combines the references of a list of papers into one list with no duplicates.
+
+    Arguments:
+    paper_list - list; paper IDs (str)
+    paper_refs_dict - dict; keys are paper IDs (str) and the values are lists of the IDs of the papers they reference
+
+    Returns:
+    ref_ids - list; paper IDs (str) in the order they were first referenced
+    """
+    ref_ids = {}
+    for paper in paper_list:
+        for ref in paper_refs_dict.get(paper, []):
+            ref_ids[ref] = None
+    return list(ref_ids)
+
+
 def get_and_compile_refs(paper_list, logger):
     """Takes a list of paper IDs and returns a list of the IDs of the papers referenced by papers in the original list. The reference list may be incomplete since PubMed does not provide references for all papers.
 
@@ -255,43 +383,52 @@ def get_and_compile_refs(paper_list, logger):
     Returns:
     pubmed_refs - list, paper IDs
     """
-    str_paper_list = ",".join(paper_list)
-    search_results = Entrez.read(Entrez.epost("pubmed", id=str_paper_list))
-    query_key = search_results["QueryKey"]
-    webenv = search_results["WebEnv"]
-    pub_records = Entrez.read(Entrez.elink(dbfrom="pubmed", WebEnv=webenv, query_key=query_key))
-    for entry in pub_records[0]["LinkSetDb"]:
-        if entry["LinkName"] == 'pubmed_pubmed_refs':
-            pubmed_refs = entry["Link"]
-    ref_ids = []
-    try:
-        for ref in pubmed_refs:
-            ref_ids.append(ref['Id'])
-    except UnboundLocalError:
+    ref_ids = compile_refs(paper_list, get_refs_bulk(paper_list, logger))
+    if not ref_ids:
         logger.info("No references found")
     return ref_ids
 
 
-def create_biologist_cited_papers_dict(biologist_paper_dict, logger):
-    """Takes a dictionary of biologists and the papers they wrote, looks up each paper in PubMed and returns a new dictionary containing the biologist and a list of all the papers they cite(reference) within the papers they wrote.
+@bfmetrics.timed
+def create_paper_refs_dict(biologist_paper_dict, logger):
+    """Looks up the references of every paper written by any biologist in one pass of batched elink requests.  This paper to references map is built once and reused to regroup the references by biologist.
+
+    Arguments:
+    biologist_paper_dict - dict; keys are biologist's names (str) and the values are a list of IDs of the papers authored by the biologist
+
+    Returns:
+    paper_refs_dict - dict; keys are paper IDs (str) and the values are lists of the IDs of the papers they reference
+    """
+    all_papers = []
+    for value in biologist_paper_dict.values():
+        all_papers.extend(value)
+    logger.info("Looking up the references of {} papers.".format(len(set(all_papers))))
+    return get_refs_bulk(all_papers, logger)
+
+
+@bfmetrics.timed
+def create_biologist_cited_papers_dict(biologist_paper_dict, logger, paper_refs_dict=None):
+    """Takes a dictionary of biologists and the papers they wrote and returns a new dictionary containing the biologist and a list of all the papers they cite(reference) within the papers they wrote.
 
     Arguments:
     biologist_paper_dict - dict; keys are biologist's names (str) and the values are a list of IDs of the papers authored by the biologist
+    paper_refs_dict (optional) - dict; keys are paper IDs (str) and the values are lists of the IDs of the papers they reference.  Looked up with create_paper_refs_dict if not provided.
 
     Returns:
     biologist_cited_papers_dict - dict; keys are biologist's names (str) and the values are a list of IDS of papers cited by the biologist
     """
+    if paper_refs_dict is None:
+        paper_refs_dict = create_paper_refs_dict(biologist_paper_dict, logger)
     biologist_cited_papers_dict = {}
     for key, value in biologist_paper_dict.items():
-        logger.info("Looking up papers cited by {}.".format(key))
-        try:
-            paper_list = get_and_compile_refs(value, logger)
-            biologist_cited_papers_dict[key] = paper_list
-        except:
-            biologist_cited_papers_dict[key] = []
+        missing = [paper for paper in value if paper not in paper_refs_dict]
+        if missing:
+            logger.info("References could not be retrieved for {} of the papers by {}.".format(len(missing), key))
+        biologist_cited_papers_dict[key] = compile_refs(value, paper_refs_dict)
     return biologist_cited_papers_dict
 
 
+@bfmetrics.timed
 def create_paper_features_list(biologist_cited_papers_dict):
     """Takes a dictionary of cited papers and combines them into a list with no duplicates.
 
@@ -308,89 +445,387 @@ def create_paper_features_list(biologist_cited_papers_dict):
     return paper_features
 
 
+def create_paper_index(paper_features_list):
+    """Interns each paper ID in the paper features list to an integer column number.
+
+    Arguments:
+    paper_features_list - list; list of all the papers cited by every author in the starting dict
+
+    Returns:
+    paper_index - dict; keys are paper IDs (str) and the values are the column number (int) of the paper
+    """
+    return {paper: column for column, paper in enumerate(paper_features_list)}
+
+
+def create_binary_row(paper_list, paper_index):
+    """Converts a list of cited paper IDs into the sorted column numbers of the papers that are in the paper index. Papers missing from the index are skipped.
+
+    Arguments:
+    paper_list - list; paper IDs (str)
+    paper_index - dict; keys are paper IDs (str) and the values are column numbers (int)
+
+    Returns:
+    columns - numpy array; sorted column numbers (int32) with no duplicates
+    """
+    columns = {paper_index[paper] for paper in paper_list if paper in paper_index}
+    return np.array(sorted(columns), dtype=np.int32)
+
+
+def create_binary_matrix(rows, num_columns):
+    """Stacks rows of column numbers into a sparse binary matrix.
+
+    Arguments:
+    rows - list of numpy arrays; sorted column numbers of the 1s in each row
+    num_columns - int; width of the matrix
+
+    Returns:
+    binary_matrix - scipy.sparse.csr_matrix; one row per entry of rows filled with 1s and 0s
+    """
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    if rows:
+        indptr[1:] = np.cumsum([len(row) for row in rows])
+        indices = np.concatenate(rows).astype(np.int32, copy=False)
+    else:
+        indices = np.zeros(0, dtype=np.int32)
+    data = np.ones(len(indices), dtype=np.int32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(rows), num_columns))
+
+
+def citation_matrix_nbytes(matrix):
+    """Returns the memory (int, bytes) used by the arrays of a sparse CSR matrix."""
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+@bfmetrics.timed
+def prune_paper_features(biologist_finder, logger, min_df=2, max_df=None, comparison_only=False, protected_columns=None):
+    """Drops paper columns that cannot change the similarity ranking before scoring: papers cited by fewer than min_df biologists, papers cited by more than max_df biologists (ubiquitous classics) and, with comparison_only, every paper the originating set of papers does not cite.  Papers cited by the originating set of papers, and the protected columns, are always kept.  Every score only depends on the overlap of each row with the comparison vector, which is unchanged since those columns are kept, and on the row sums and number of papers of the unpruned matrix, which are stored in the result, so similarity scores are identical to the unpruned matrix.  The reading list, its citation threshold report and the "pagerank" engine, whose co-citation graphs are built from the remaining columns, only see the remaining papers, so their results can change.
+
+    Arguments:
+    biologist_finder - CitationMatrix; the last row is the comparison vector
+    min_df (optional) - int; minimum number of biologists citing a paper
+    max_df (optional) - int or float; maximum number of biologists citing a paper, a float is a fraction of the biologists (1.0 keeps every paper), as in scikit-learn
+    comparison_only (optional) - bool; keep only the papers cited by the originating set of papers
+    protected_columns (optional) - array of int; columns that are always kept, e.g. the papers cited by other seed sets scored against the pruned matrix (the columns of create_comparison_matrix)
+
+    Returns:
+    pruned_biologist_finder - CitationMatrix; same rows with fewer columns and the row sums and number of papers of the unpruned matrix
+    """
+    matrix = biologist_finder.matrix.tocsr()
+    bfmetrics.record_matrix("unpruned", matrix)
+    num_biologists = matrix.shape[0] - 1
+    doc_freq = np.bincount(matrix[:-1].indices, minlength=matrix.shape[1])
+    in_comparison = np.zeros(matrix.shape[1], dtype=bool)
+    in_comparison[matrix[-1].indices] = True
+    if protected_columns is not None:
+        in_comparison[np.asarray(protected_columns, dtype=np.intp)] = True
+    if comparison_only:
+        keep = in_comparison.copy()
+    else:
+        keep = doc_freq >= min_df
+        if max_df is not None:
+            keep &= doc_freq <= document_frequency_limit(max_df, num_biologists)
+        keep |= in_comparison
+    columns = np.flatnonzero(keep)
+    if biologist_finder.row_sums is None:
+        row_sums = np.asarray(matrix.sum(axis=1)).ravel()
+        num_papers = matrix.shape[1]
+    else:
+        row_sums = biologist_finder.row_sums
+        num_papers = biologist_finder.num_papers
+    pruned_matrix = matrix[:, columns]
+    saved = citation_matrix_nbytes(matrix) - citation_matrix_nbytes(pruned_matrix)
+    logger.info("Pruned {} of {} paper columns ({} kept), saving {:.1f} MB of matrix memory.".format(matrix.shape[1] - len(columns), matrix.shape[1], len(columns), saved / 1e6))
+    pruned_papers = [biologist_finder.papers[column] for column in columns]
+    return CitationMatrix(pruned_matrix, biologist_finder.biologists, pruned_papers, row_sums, num_papers)
+
+
+def document_frequency_limit(max_df, num_biologists):
+    """Returns the number of biologists (float) a max_df stands for: a float is a fraction of the biologists and an int a number of biologists."""
+    if isinstance(max_df, float):
+        if not 0 <= max_df <= 1:
+            raise ValueError("A fractional max_df must be between 0 and 1, got {}.".format(max_df))
+        return max_df * num_biologists
+    return max_df
+
+
+def parse_document_frequency(text):
+    """Reads a min_df or max_df given as text: "5" is a number of biologists (int) and "0.5" or "1.0" a fraction of the biologists (float)."""
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+@bfmetrics.timed
 def create_binary_feature_vectors(biologist_cited_papers_dict, paper_features_list):
-    """Builds a set of feature vectors for each biologist (key) in the biologist_cited_papers_dict by looking to see if each paper in the paper_feature_list is cited by the biologist (a list of cited papers is the value associated with each biologist key).  Adds a one to the feature vector if the paper is cited and a 0 if it is not.
+    """Builds a sparse feature matrix with one row for each biologist (key) in the biologist_cited_papers_dict and one column for each paper in the paper_features_list.  An entry is 1 if the biologist cited the paper (a list of cited papers is the value associated with each biologist key) and 0 if not.  Only the 1s are stored.
 
     Arguments:
     biologist_cited_papers_dict - dict; keys are biologist's names (str) and the values are a list of paper IDs cited in papers authored by the biologist paper_features_list - list; list of all the papers cited by every author in the starting dict
 
     Returns:
-    all_binary_feature_vectors - list of lists; lists of 1s and 0s that indicate if a biologist cited a paper in the paper_features_list or not
+    binary_feature_matrix - scipy.sparse.csr_matrix; rows follow the order of biologist_cited_papers_dict and columns follow the order of paper_features_list
     """
-    all_binary_feature_vectors = []
-    for key, value in biologist_cited_papers_dict.items():
-        biologist_vector = []
-        for paper in paper_features_list:
-            if paper in value:
-                biologist_vector.append(1)
-            else:
-                biologist_vector.append(0)
-        all_binary_feature_vectors.append(biologist_vector)
-    return all_binary_feature_vectors
+    paper_index = create_paper_index(paper_features_list)
+    rows = [create_binary_row(value, paper_index) for value in biologist_cited_papers_dict.values()]
+    return create_binary_matrix(rows, len(paper_features_list))
 
 
+@bfmetrics.timed
 def create_comparison_binary_vector(paper_list, paper_features_list, logger):
-    """Builds a feature vector for the originating set of papers by looking to see if each paper in the paper_features_list is cited by any of the originating set of papers. Adds a one to the feature vector if the paper is cited and a 0 if it is not.
+    """Builds a feature vector for the originating set of papers by looking to see if each paper in the paper_features_list is cited by any of the originating set of papers. The vector holds a 1 if the paper is cited and a 0 if it is not.
 
     Arguments:
     paper_list - list; list of paper IDs (str) corresponding to the originating set of papers
     paper_features_list - list; list of all the papers cited by every author in the biologist_cited_papers_dict
 
     Returns:
-    comparision_binary_vector - list; list of 1s and 0s that indicate if the originating set of papers cited a paper in the paper_features_list or not
+    comparision_binary_vector - scipy.sparse.csr_matrix; 1 row matrix with a column for each paper in the paper_features_list
     """
-    comparison_binary_vector = []
     comparison_refs = get_and_compile_refs(paper_list, logger)
-    for i in paper_features_list:
-        if i in comparison_refs:
-            comparison_binary_vector.append(1)
-        else:
-            comparison_binary_vector.append(0)
-    return comparison_binary_vector
+    paper_index = create_paper_index(paper_features_list)
+    return create_binary_matrix([create_binary_row(comparison_refs, paper_index)], len(paper_features_list))
+
+
+@bfmetrics.timed
+def create_comparison_matrix(seed_sets, paper_features_list, logger):
+    """Builds one comparison vector for each of several originating sets of papers (e.g. one per project of a lab), looking up the references of all their papers in one pass of batched elink requests.  Each row is the same as create_comparison_binary_vector would build for that set of papers.
+
+    Arguments:
+    seed_sets - dict; keys are seed set names (str) and the values are lists of paper IDs (str) of each originating set of papers
+    paper_features_list - list; list of all the papers cited by every author in the biologist_cited_papers_dict
+
+    Returns:
+    comparison_matrix - scipy.sparse.csr_matrix; one row per seed set, in the order of seed_sets, with a column for each paper in the paper_features_list
+    """
+    seed_papers = list(dict.fromkeys(paper for paper_list in seed_sets.values() for paper in paper_list))
+    paper_refs_dict = get_refs_bulk(seed_papers, logger)
+    paper_index = create_paper_index(paper_features_list)
+    rows = []
+    for seed_set, paper_list in seed_sets.items():
+        row = create_binary_row(compile_refs(paper_list, paper_refs_dict), paper_index)
+        if not len(row):
+            logger.info("None of the papers referenced by seed set {} are in the paper features list.".format(seed_set))
+        rows.append(row)
+    return create_binary_matrix(rows, len(paper_features_list))
+
+
+def select_paper_columns(comparison_matrix, paper_features_list, kept_papers):
+    """Returns the columns of a comparison matrix built for paper_features_list that belong to kept_papers, in their order, e.g. to score it against a pruned CitationMatrix.
+
+    Arguments:
+    comparison_matrix - scipy.sparse matrix; one column for each paper in paper_features_list
+    paper_features_list - list; paper IDs (str) of the columns of comparison_matrix
+    kept_papers - list; paper IDs (str) to keep, all in paper_features_list
+
+    Returns:
+    comparison_matrix - scipy.sparse.csr_matrix; one column for each paper in kept_papers
+    """
+    paper_index = create_paper_index(paper_features_list)
+    return sparse.csr_matrix(comparison_matrix)[:, [paper_index[paper] for paper in kept_papers]]
 
 
-def create_biologist_finder_df(binary_feature_vectors, paper_features_list, biologist_cited_papers_dict, comparison_vector):
-    """Takes the binary feature vectors and comparison binary vector and builds a pandas dataframe that has biologist's names as the index and paper IDs as the columns.  Dataframe is filled with 1s and 0s to indicate if a biologist has cited the column paper or not. The last row contains the data for the originating set of papers.
+@bfmetrics.timed
+def create_biologist_finder_matrix(binary_feature_matrix, paper_features_list, biologist_cited_papers_dict, comparison_vector):
+    """Stacks the biologist feature matrix and the comparison vector into one sparse matrix that has a row for each biologist and a column for each paper ID.  The last row contains the data for the originating set of papers.
 
     Arguments:
-    binary_feature_vectors - list of lists; lists of 0s and 1s that indicate if a biologist cited a paper in the paper_features_list
+    binary_feature_matrix - scipy.sparse.csr_matrix; rows of 0s and 1s that indicate if a biologist cited a paper in the paper_features_list
     paper_features_list - list; list of all the papers cited by every author in the starting dict
     biologist_cited_papers_dict - dict; keys are biologist names (str) and the values are a list of paper IDS corresponding to papers cited by the biologist
-    comparison_vector - list; list of 0s and 1s that indicates if the originating set of papers cited a paper in the paper_features_list
+    comparison_vector - scipy.sparse.csr_matrix; 1 row of 0s and 1s that indicates if the originating set of papers cited a paper in the paper_features_list
+
+    Returns:
+    biologist_finder - CitationMatrix; matrix has the biologists as rows and paper IDs as the columns.  The last row represents the originating set of papers and is labeled "comparison"
+    """
+    matrix = sparse.vstack([binary_feature_matrix, comparison_vector], format="csr")
+    biologists = list(biologist_cited_papers_dict.keys()) + ["comparison"]
+    return CitationMatrix(matrix, biologists, list(paper_features_list))
+
+
+SIMILARITY_METRICS = ("pearson", "jaccard", "cosine", "tanimoto")
+# "similarity" compares citation vectors with a similarity metric, "pagerank" ranks biologists and papers with personalized PageRank on the co-citation graphs (see biologyfinder_pagerank)
+SCORING_ENGINES = ("similarity", "pagerank")
+
+
+def similarity_scores(matrix, comparison, metric="pearson"):
+    """Scores every row of a sparse matrix against a comparison vector in one matrix-vector pass.  Only the row sums, the squared row sums, the dot product of each row with the comparison vector and the number of papers are needed, so the matrix is never made dense.
+
+    Arguments:
+    matrix - scipy.sparse matrix; rows are individual feature vectors
+    comparison - scipy.sparse matrix; 1 row with the same number of columns as matrix
+    metric (optional) - str; one of "pearson", "jaccard", "cosine" or "tanimoto"
+
+    Returns:
+    scores - numpy array; one similarity score (float) per row of matrix, nan where the score is undefined (e.g. pearson against a constant vector)
+    """
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+    comparison = sparse.csr_matrix(comparison, dtype=np.float64)
+    overlap = np.asarray((matrix @ comparison.T).todense()).ravel()
+    row_sums = np.asarray(matrix.sum(axis=1)).ravel()
+    row_squares = np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+    return scores_from_counts(row_sums, row_squares, overlap, comparison.sum(), comparison.multiply(comparison).sum(), matrix.shape[1], metric)
+
+
+def scores_from_counts(row_sums, row_squares, overlap, comparison_sum, comparison_squares, num_papers, metric="pearson"):
+    """Calculates similarity scores from the summary counts of each row and the comparison vector.  Keeping only these counts lets scores be updated as rows or papers are added without revisiting the matrix.
+
+    Arguments:
+    row_sums - numpy array; sum of each row
+    row_squares - numpy array; sum of the squared entries of each row (equal to row_sums for binary rows)
+    overlap - numpy array; dot product of each row with the comparison vector
+    comparison_sum - float; sum of the comparison vector
+    comparison_squares - float; sum of the squared entries of the comparison vector
+    num_papers - int; number of columns
+    metric (optional) - str; one of "pearson", "jaccard", "cosine" or "tanimoto"
 
     Returns:
-    final_df - Pandas df; has biologist's names as the index and paper IDs as the columns.  Dataframe is filled with 1s and 0s to indicate if a biologist has cited the column paper or not. The last row represents the originating set of papers and is indexed as "comparison"
+    scores - numpy array; one similarity score (float) per row, nan where the score is undefined
     """
-    temp_df = pd.DataFrame(binary_feature_vectors, columns=paper_features_list, index=biologist_cited_papers_dict.keys())
-    comp_series = pd.Series(comparison_vector).to_frame("comparison").T
-    comp_series.columns = temp_df.columns
-    final_df = pd.concat([temp_df, comp_series])
-    final_df.dropna(axis=0, inplace=True)
-    return final_df
+    if metric not in SIMILARITY_METRICS:
+        raise ValueError("Unknown similarity metric {}. Choose from {}.".format(metric, ", ".join(SIMILARITY_METRICS)))
+    row_sums = np.asarray(row_sums, dtype=np.float64)
+    row_squares = np.asarray(row_squares, dtype=np.float64)
+    overlap = np.asarray(overlap, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if metric == "pearson":
+            numerator = num_papers * overlap - row_sums * comparison_sum
+            denominator = np.sqrt((num_papers * row_squares - row_sums ** 2) * (num_papers * comparison_squares - comparison_sum ** 2))
+        elif metric == "jaccard":
+            # Binary vectors: shared papers divided by papers cited by either vector
+            numerator = overlap
+            denominator = row_sums + comparison_sum - overlap
+        elif metric == "cosine":
+            numerator = overlap
+            denominator = np.sqrt(row_squares * comparison_squares)
+        else:
+            numerator = overlap
+            denominator = row_squares + comparison_squares - overlap
+        scores = numerator / denominator
+    scores[denominator == 0] = np.nan
+    return scores
 
 
-def create_similarity_scores_df(biologist_finder_df):
-    """Calculates pearsonr correlation coefficients between the last row of a dataframe and all the remaining rows. Reports the coefficient ("similarity") in a new dataframe with the same row index as the original dataframe.
+def citation_matrix_scores(biologist_finder, metric="pearson"):
+    """Scores every row of a citation matrix against its last row.  Uses the row sums and number of papers of the unpruned matrix when the matrix has been pruned.
 
     Arguments:
-    biologist_finder_df - pandas dataframe; rows are individual feature vectors and the last row is compared to all other rows
+    biologist_finder - CitationMatrix; the last row is the comparison vector
+    metric (optional) - str; one of "pearson", "jaccard", "cosine" or "tanimoto"
+
+    Returns:
+    scores - numpy array; one similarity score (float) per row
+    """
+    matrix = biologist_finder.matrix
+    if biologist_finder.row_sums is None:
+        return similarity_scores(matrix, matrix[-1], metric)
+    comparison = sparse.csr_matrix(matrix[-1], dtype=np.float64)
+    overlap = np.asarray((sparse.csr_matrix(matrix, dtype=np.float64) @ comparison.T).todense()).ravel()
+    row_sums = np.asarray(biologist_finder.row_sums, dtype=np.float64)
+    return scores_from_counts(row_sums, row_sums, overlap, row_sums[-1], row_sums[-1], biologist_finder.num_papers, metric)
+
+
+@bfmetrics.timed
+def multi_similarity_scores(biologist_finder, comparison_matrix, metric="pearson", max_workers=None, block_size=4096):
+    """Scores every biologist row of a citation matrix (all rows but the last) against every row of a comparison matrix with one sparse matrix product per block of biologist rows.  The blocks are multiplied on a thread pool, which runs them on several cores since scipy's sparse products release the GIL.  Uses the row sums and number of papers of the unpruned matrix when the matrix has been pruned, although references of the seed sets that were pruned away are not counted.
+
+    Arguments:
+    biologist_finder - CitationMatrix; the last row is the comparison vector of the papers the matrix was built from and is not scored
+    comparison_matrix - scipy.sparse matrix; one comparison vector per row with the same columns as biologist_finder, see create_comparison_matrix
+    metric (optional) - str; one of "pearson", "jaccard", "cosine" or "tanimoto"
+    max_workers (optional) - int; number of threads, defaults to the number of cores
+    block_size (optional) - int; number of biologist rows multiplied at a time
+
+    Returns:
+    scores - numpy array; one row per biologist and one column per comparison vector of similarity scores (float), nan where the score is undefined
+    """
+    matrix = biologist_finder.matrix.tocsr()
+    num_biologists = matrix.shape[0] - 1
+    comparisons = sparse.csr_matrix(comparison_matrix, dtype=matrix.dtype)
+    comparison_sums = np.diff(comparisons.indptr).astype(np.float64)
+    comparisons_t = comparisons.T.tocsc()
+    if biologist_finder.row_sums is None:
+        row_sums = np.diff(matrix.indptr)[:num_biologists].astype(np.float64)
+        num_papers = matrix.shape[1]
+    else:
+        row_sums = np.asarray(biologist_finder.row_sums[:num_biologists], dtype=np.float64)
+        num_papers = biologist_finder.num_papers
+
+    def block_overlap(start):
+        return (matrix[start:min(start + block_size, num_biologists)] @ comparisons_t).toarray()
+
+    starts = range(0, num_biologists, block_size)
+    max_workers = max_workers or os.cpu_count() or 1
+    if len(starts) <= 1 or max_workers <= 1:
+        blocks = [block_overlap(start) for start in starts]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            blocks = list(executor.map(block_overlap, starts))
+    overlap = np.vstack(blocks) if blocks else np.zeros((0, comparisons.shape[0]))
+    return scores_from_counts(row_sums[:, np.newaxis], row_sums[:, np.newaxis], overlap, comparison_sums, comparison_sums, num_papers, metric)
+
+
+@bfmetrics.timed
+def create_multi_similarity_scores_dfs(biologist_finder, comparison_matrix, seed_set_names, metric="pearson", max_workers=None, engine="similarity"):
+    """Scores the biologists of a citation matrix against several comparison vectors at once (see multi_similarity_scores) and ranks them separately for each seed set.  Each dataframe has the same form as create_similarity_scores_df gives for that seed set, including a "comparison" row with the score of the comparison vector against itself, so it can be passed to most_sim_biologists and reading_list with the same citation matrix.
+
+    Arguments:
+    biologist_finder - CitationMatrix; rows are individual feature vectors and the last row is not scored
+    comparison_matrix - scipy.sparse matrix; one comparison vector per seed set, see create_comparison_matrix
+    seed_set_names - list; name (str) of the seed set of each row of comparison_matrix
+    metric (optional) - str; one of "pearson", "jaccard", "cosine" or "tanimoto"
+    max_workers (optional) - int; number of threads, defaults to the number of cores
+    engine (optional) - str; "similarity", or "pagerank" to rank the biologists with personalized PageRank restarting at each comparison vector (see biologyfinder_pagerank.biologist_pagerank), with the comparison row scored 1
+
+    Returns:
+    sorted_sim_dfs - dict; keys are seed set names (str) and the values are pandas dataframes with 2 columns - "similarity" and "Scientist", sorted from highest to lowest similarity
+    """
+    if engine not in SCORING_ENGINES:
+        raise ValueError("Unknown scoring engine {}, use one of {}.".format(engine, ", ".join(SCORING_ENGINES)))
+    if engine == "pagerank":
+        scores = bfpagerank.biologist_pagerank(biologist_finder, comparison_matrix=comparison_matrix)
+        self_scores = np.ones(len(seed_set_names))
+    else:
+        scores = multi_similarity_scores(biologist_finder, comparison_matrix, metric, max_workers)
+        comparison_sums = np.diff(sparse.csr_matrix(comparison_matrix).indptr)
+        num_papers = biologist_finder.num_papers or biologist_finder.matrix.shape[1]
+        self_scores = scores_from_counts(comparison_sums, comparison_sums, comparison_sums, comparison_sums, comparison_sums, num_papers, metric)
+    scientists = list(biologist_finder.biologists[:-1]) + ["comparison"]
+    sorted_sim_dfs = {}
+    for column, seed_set in enumerate(seed_set_names):
+        sim_df = pd.Series(np.append(scores[:, column], self_scores[column])).to_frame("similarity")
+        sim_df["Scientist"] = scientists
+        sorted_sim_dfs[seed_set] = sim_df.sort_values('similarity', ascending=False)
+    return sorted_sim_dfs
+
+
+@bfmetrics.timed
+def create_similarity_scores_df(biologist_finder, metric="pearson", engine="similarity"):
+    """Calculates similarity scores (pearsonr correlation coefficients by default) between the last row of a citation matrix and all the remaining rows. Reports the score ("similarity") in a new dataframe.  With the "pagerank" engine the score is the biologist's personalized PageRank on the co-citation graph instead (see biologyfinder_pagerank.create_pagerank_scores_df).
+
+    Arguments:
+    biologist_finder - CitationMatrix; rows are individual feature vectors and the last row is compared to all other rows
+    metric (optional) - str; one of "pearson", "jaccard", "cosine" or "tanimoto", not used by the "pagerank" engine
+    engine (optional) - str; "similarity" or "pagerank"
 
     Returns:
     sorted_sim_df - pandas dataframe; 2 columns - "scientist" which is the biologist's name and "similarity" which is
-    the pearsonr coefficient between the scientist's feature vector and the last row of biologist_finder_df.  Dataframe is sorted based on similarity scores from highest to lowest.
-    """
-    sim_score = {}
-    for i in range(len(biologist_finder_df)):
-        score = pearsonr(biologist_finder_df.iloc[-1, :], biologist_finder_df.iloc[i, :])
-        sim_score.update({i: score[0]})
-    sim_df = pd.Series(sim_score).to_frame("similarity")
-    sim_df["Scientist"] = biologist_finder_df.index
+    the score between the scientist's feature vector and the last row of biologist_finder.  Dataframe is sorted based on similarity scores from highest to lowest.
+    """
+    if engine not in SCORING_ENGINES:
+        raise ValueError("Unknown scoring engine {}, use one of {}.".format(engine, ", ".join(SCORING_ENGINES)))
+    bfmetrics.record_matrix("scored", biologist_finder.matrix)
+    if engine == "pagerank":
+        return bfpagerank.create_pagerank_scores_df(biologist_finder)
+    scores = citation_matrix_scores(biologist_finder, metric)
+    sim_df = pd.Series(scores).to_frame("similarity")
+    sim_df["Scientist"] = biologist_finder.biologists
     sorted_sim_df = sim_df.sort_values('similarity', ascending=False)
     return sorted_sim_df
 
 
 def most_sim_biologists(similarity_df, per):
-    """Takes a sorted dataframe and a float representing a percent.  Returns that percentage of the dataframe.
+    """Takes a sorted dataframe and a float representing a percent.  Returns that percentage of the dataframe.  Rows without a score, such as the biologists an approximate search did not retrieve, are left out, so fewer rows may be returned.
 
     Arguments:
     similarity_df - pandas dataframe; sorted dataframe
@@ -401,11 +836,12 @@ def most_sim_biologists(similarity_df, per):
     """
     num_biologists = similarity_df.shape[0]
     top_per = int(num_biologists * per)
-    similarity_df_per = similarity_df.head(top_per)
+    similarity_df_per = similarity_df.head(top_per).dropna(subset=["similarity"])
     #print(similarity_df_per)
     return similarity_df_per
 
 
+@bfmetrics.timed
 def get_citations(rec_paper_list, logger):
     """Takes a list of paper ID numbers and return a PubMed reference for each paper on the list.
 
@@ -417,38 +853,231 @@ def get_citations(rec_paper_list, logger):
     (prints the references to the screen)
     """
     id_list = ",".join(rec_paper_list)
-    search_results = Entrez.read(Entrez.epost("pubmed", id=id_list))
+    search_results = Entrez.read(bfcache.epost(db="pubmed", id=id_list))
     query_key = search_results["QueryKey"]
     webenv = search_results["WebEnv"]
-    handle = Entrez.efetch(db="pubmed", id=id_list, rettype='medline', retmode='text', webenv=webenv, query_key=query_key)
-    records = Medline.parse(handle)
-    for index, record in enumerate(records, 1):
-        logger.info("{}. {} {}. {}. {}. ({})".format(index, record.get("TI", "?"), record.get("AU", "?"), record.get("JT", "?"), record.get("DP", "?"), record.get("PMID", "?")))
+    with bfcache.efetch_stream(db="pubmed", id=id_list, rettype='medline', retmode='text', webenv=webenv, query_key=query_key) as handle:
+        for index, record in enumerate(bfmedline.parse(handle, bfmedline.CITATION_TAGS), 1):
+            logger.info("{}. {} {}. {}. {}. ({})".format(index, record.get("TI", "?"), record.get("AU", "?"), record.get("JT", "?"), record.get("DP", "?"), record.get("PMID", "?")))
+
+READING_LIST_WEIGHTINGS = ("count", "similarity", "recency")
 
-def reading_list(biologist_finder_df, most_sim_bio_df, logger):
-    """Takes a dataframe containing the most similar biologists as well as the binary feature vector dataframe. Creates a new dataframe with paper IDs as the index and biologists as columns and it contains a 1 if the biologist ever cited the paper and a 0 if not.  Citations per paper are summed and then the df is sorted so that the most cited papers are at the top.  Prints to the terminal the number of papers cited by 10%, 20%, 30%, etc of the most similar biologists.  Prints to the terminal citations for the user-specified number of papers.
+
+def get_publication_years_bulk(paper_list, logger, chunk_size=200):
+    """Given a list of papers, returns the publication year of every paper, fetched a chunk at a time with epost and efetch like get_author_records_bulk.
 
     Arguments:
-    biologist_finder_df - pandas dataframe; rows are individual biologist feature vectors
-    most_sim_bio_df - pandas dataframe; 2 columns - "scientist" which is the biologist's name and "similarity" which is the pearsonr coefficient between scientist's feature vector and the last row of biologist_finder_df.
+    paper_list - list; paper IDs (str)
+    chunk_size (optional) - int; number of papers per epost/efetch request
 
     Returns:
-    None
-    (prints to the terminal citations for a user-specified number of most cited papers)
-    """
-    top_per_biologists = list(most_sim_bio_df.iloc[1:, 1])
-    num_top_biologists = len(top_per_biologists)
-    most_cited_papers = biologist_finder_df.loc[top_per_biologists, :][biologist_finder_df.loc[top_per_biologists, :] ==1].fillna(0).T
-    most_cited_papers['sum'] = most_cited_papers.sum(axis=1)
-    most_cited_papers_sort = most_cited_papers.sort_values('sum', ascending=False)
-    total_num_papers = most_cited_papers_sort.shape[0]
+    publication_years - dict; keys are paper IDs (str) and the values are publication years (int).  Papers without a publication date are left out.
+    """
+    def fetch_chunk(chunk):
+        search_results = Entrez.read(bfcache.epost(db="pubmed", id=",".join(chunk)))
+        query_key = search_results["QueryKey"]
+        webenv = search_results["WebEnv"]
+        with bfcache.efetch_stream(db="pubmed", rettype='medline', retmode='text', retmax=len(chunk), webenv=webenv, query_key=query_key) as handle:
+            return list(bfmedline.parse(handle, ("PMID", "DP")))
+
+    publication_years = {}
+    for records in bfscheduler.map_concurrent(fetch_chunk, split_into_chunks(list(dict.fromkeys(paper_list)), chunk_size)):
+        for record in records:
+            year = record.get("DP", "")[:4]
+            if year.isdigit():
+                publication_years[record.get("PMID", "?")] = int(year)
+            else:
+                logger.info("No publication year found for paper {}.".format(record.get("PMID", "?")))
+    return publication_years
+
+
+def recency_weights(paper_list, logger, half_life=10, current_year=None):
+    """Weights papers by age so that older papers, which have had more time to collect citations, do not crowd out recent ones.  A paper's weight halves every half_life years.  Papers without a known year get the median weight of the others.
+
+    Arguments:
+    paper_list - list; paper IDs (str)
+    half_life (optional) - float; number of years after which a paper's weight halves
+    current_year (optional) - int; year of weight 1, the latest publication year if not provided
+
+    Returns:
+    weights - numpy array; one weight (float) per paper in paper_list
+    """
+    publication_years = get_publication_years_bulk(paper_list, logger)
+    years = np.array([publication_years.get(paper, np.nan) for paper in paper_list], dtype=np.float64)
+    if np.isnan(years).all():
+        return np.ones(len(paper_list))
+    if current_year is None:
+        current_year = np.nanmax(years)
+    weights = 0.5 ** (np.maximum(current_year - years, 0) / half_life)
+    weights[np.isnan(weights)] = np.nanmedian(weights)
+    return weights
+
+
+def paper_citation_counts(biologist_finder, most_sim_bio_df, logger=None, weighting="count", half_life=10, engine="similarity", num_papers=None, current_year=None):
+    """Counts the citations per paper over the rows of the most similar biologists (skipping the first row of most_sim_bio_df, which is the comparison vector itself) with one sparse column sum.  The counts can be weighted by the similarity score of each citing biologist or by the age of each paper.  With the "pagerank" engine, papers are ranked by their personalized PageRank on the paper co-citation graph instead and the weighting is not used.  When only the top num_papers are needed, "recency" looks up the years of the candidate papers only, see recency_top_scores.  Both ways weight ages relative to the same year, so they give the same scores.
+
+    Arguments:
+    biologist_finder - CitationMatrix; rows are individual biologist feature vectors
+    most_sim_bio_df - pandas dataframe; 2 columns - "similarity" and "Scientist", sorted from most to least similar
+    weighting (optional) - str; "count" for plain citation counts, "similarity" to add up the similarity scores of the citing biologists or "recency" to weight each paper with recency_weights
+    half_life (optional) - float; half life in years of the "recency" weighting
+    engine (optional) - str; "similarity" or "pagerank"
+    num_papers (optional) - int; number of top papers the scores will be used for, every paper is scored exactly if not provided
+    current_year (optional) - int; year of weight 1 for "recency", the current year if not provided.  Pass a fixed year to compare runs made in different years.
+
+    Returns:
+    citation_counts - numpy array; number of the most similar biologists citing each paper, in column order
+    paper_scores - numpy array; weighted citation counts used to rank the papers, the same as citation_counts for "count", or the PageRank of each paper for the "pagerank" engine
+    num_top_biologists - int; number of biologists the citations were counted over
+    """
+    if weighting not in READING_LIST_WEIGHTINGS:
+        raise ValueError("Unknown reading list weighting {}, use one of {}.".format(weighting, ", ".join(READING_LIST_WEIGHTINGS)))
+    if engine not in SCORING_ENGINES:
+        raise ValueError("Unknown scoring engine {}, use one of {}.".format(engine, ", ".join(SCORING_ENGINES)))
+    logger = logger or logging.getLogger(__name__)
+    top_sim_bio_df = most_sim_bio_df.iloc[1:]
+    biologist_rows = {biologist: row for row, biologist in enumerate(biologist_finder.biologists)}
+    top_rows = [biologist_rows[biologist] for biologist in top_sim_bio_df["Scientist"]]
+    top_matrix = biologist_finder.matrix[top_rows]
+    citation_counts = np.asarray(top_matrix.sum(axis=0)).ravel()
+    if engine == "pagerank":
+        paper_scores = bfpagerank.paper_pagerank(biologist_finder)
+    elif weighting == "count":
+        paper_scores = citation_counts
+    elif weighting == "similarity":
+        similarities = np.clip(np.nan_to_num(top_sim_bio_df["similarity"].to_numpy(dtype=np.float64)), 0, None)
+        paper_scores = np.asarray(top_matrix.T @ similarities).ravel()
+    elif num_papers is not None:
+        paper_scores = recency_top_scores(biologist_finder, citation_counts, num_papers, logger, half_life, current_year=current_year)
+    else:
+        paper_scores = citation_counts.astype(np.float64)
+        cited_columns = np.flatnonzero(citation_counts)
+        paper_scores[cited_columns] *= recency_weights([biologist_finder.papers[column] for column in cited_columns], logger, half_life, current_year if current_year is not None else datetime.date.today().year)
+    return citation_counts, paper_scores, len(top_rows)
+
+
+def recency_top_scores(biologist_finder, citation_counts, num_papers, logger, half_life=10, batch_size=200, current_year=None):
+    """Weights citation counts by recency (see recency_weights) looking up the years of as few papers as the top num_papers need.  A recency weight is at most 1, so a paper's count bounds its weighted score: years are looked up for the most cited papers first, in growing batches, until the num_papers-th best weighted score beats the count of every paper not looked up yet.  The top num_papers are then the same as when every year is looked up.  Weights are relative to current_year rather than the latest year of the papers, which is not known until every year is looked up.
+
+    Arguments:
+    biologist_finder - CitationMatrix; the columns of citation_counts are its papers
+    citation_counts - numpy array; number of the most similar biologists citing each paper
+    num_papers - int; number of top papers needed
+    half_life (optional) - float; number of years after which a paper's weight halves
+    batch_size (optional) - int; number of years looked up first, doubling every round
+    current_year (optional) - int; year of weight 1, the current year if not provided
+
+    Returns:
+    paper_scores - numpy array; recency-weighted counts of the papers looked up.  The other papers get their count times the lowest weight seen, which stays below the top num_papers.
+    """
+    paper_scores = citation_counts.astype(np.float64)
+    candidates = np.flatnonzero(citation_counts)
+    candidates = candidates[np.argsort(-citation_counts[candidates], kind="stable")]
+    if current_year is None:
+        current_year = datetime.date.today().year
+    looked_up = 0
+    batch_size = max(batch_size, num_papers)
+    while looked_up < len(candidates):
+        batch = candidates[looked_up:looked_up + batch_size]
+        paper_scores[batch] *= recency_weights([biologist_finder.papers[column] for column in batch], logger, half_life, current_year)
+        looked_up += len(batch)
+        batch_size *= 2
+        if num_papers <= 0 or looked_up >= len(candidates):
+            break
+        if looked_up >= num_papers and np.partition(paper_scores[candidates[:looked_up]], looked_up - num_papers)[looked_up - num_papers] > citation_counts[candidates[looked_up]]:
+            break
+    if looked_up < len(candidates):
+        paper_scores[candidates[looked_up:]] *= (paper_scores[candidates[:looked_up]] / citation_counts[candidates[:looked_up]]).min() if looked_up else 0.0
+        logger.info("Looked up the publication years of {} of {} cited papers.".format(looked_up, len(candidates)))
+    return paper_scores
+
+
+def top_papers(paper_scores, num_papers):
+    """Returns the columns of the num_papers highest scores from highest to lowest without sorting every paper.  Ties are broken by column order, the same as a stable sort.
+
+    Arguments:
+    paper_scores - numpy array; score of each paper
+    num_papers - int; number of columns to return
+
+    Returns:
+    columns - numpy array; column numbers from highest to lowest score
+    """
+    num_papers = min(num_papers, len(paper_scores))
+    if num_papers <= 0:
+        return np.zeros(0, dtype=np.intp)
+    threshold = np.partition(paper_scores, len(paper_scores) - num_papers)[len(paper_scores) - num_papers]
+    above = np.flatnonzero(paper_scores > threshold)
+    tied = np.flatnonzero(paper_scores == threshold)[:num_papers - len(above)]
+    candidates = np.concatenate([above, tied])
+    return candidates[np.lexsort((candidates, -paper_scores[candidates]))]
+
+
+def citation_threshold_report(citation_counts, num_top_biologists):
+    """Counts the papers cited by at least 10%, 20%, ... 100% of the most similar biologists from one histogram of the citation counts.
+
+    Arguments:
+    citation_counts - numpy array; number of the most similar biologists citing each paper
+    num_top_biologists - int; number of biologists the citations were counted over
+
+    Returns:
+    report - list of tuples; (percent (int), number of biologists (int), number of papers (int)) for each threshold
+    """
+    histogram = np.bincount(np.asarray(citation_counts, dtype=np.int64), minlength=num_top_biologists + 1)
+    cited_at_least = np.cumsum(histogram[::-1])[::-1]
+    report = []
     for i in range(10, 110, 10):
         per_of_top_biol = round(num_top_biologists * i/100)
-        num_papers = most_cited_papers_sort[most_cited_papers_sort["sum"] >= per_of_top_biol].shape[0]
-        if num_papers != 1:
-            logger.info("{} papers were cited at least once by {}% ({}) of the most similar biologists.".format(num_papers, i, per_of_top_biol))
+        report.append((i, per_of_top_biol, int(cited_at_least[per_of_top_biol])))
+    return report
+
+
+def most_cited_papers(biologist_finder, most_sim_bio_df, num_papers=None, weighting="count", logger=None, engine="similarity"):
+    """Sums the citations per paper over the rows of the most similar biologists (skipping the first row of most_sim_bio_df, which is the comparison vector itself).
+
+    Arguments:
+    biologist_finder - CitationMatrix; rows are individual biologist feature vectors
+    most_sim_bio_df - pandas dataframe; 2 columns - "similarity" and "Scientist", sorted from most to least similar
+    num_papers (optional) - int; only rank this many of the most cited papers, every paper is ranked if not provided
+    weighting (optional) - str; "count", "similarity" or "recency", see paper_citation_counts
+    engine (optional) - str; "similarity" or "pagerank", see paper_citation_counts
+
+    Returns:
+    paper_sums - numpy array; (weighted) number of the most similar biologists citing each paper, in column order
+    most_cited_order - numpy array; column numbers sorted from most to least cited
+    num_top_biologists - int; number of biologists the citations were summed over
+    """
+    paper_scores, num_top_biologists = paper_citation_counts(biologist_finder, most_sim_bio_df, logger, weighting, engine=engine, num_papers=num_papers)[1:]
+    most_cited_order = top_papers(paper_scores, len(paper_scores) if num_papers is None else num_papers)
+    return paper_scores, most_cited_order, num_top_biologists
+
+
+@bfmetrics.timed
+def reading_list(biologist_finder, most_sim_bio_df, logger, num_papers=None, weighting="count", engine="similarity", paper_scores=None):
+    """Takes a dataframe containing the most similar biologists as well as the citation matrix. Counts the citations per paper over the rows of the most similar biologists and picks the most cited papers.  Prints to the terminal the number of papers cited by 10%, 20%, 30%, etc of the most similar biologists.  Prints to the terminal citations for the requested number of papers.
+
+    Arguments:
+    biologist_finder - CitationMatrix; rows are individual biologist feature vectors
+    most_sim_bio_df - pandas dataframe; 2 columns - "scientist" which is the biologist's name and "similarity" which is the pearsonr coefficient between scientist's feature vector and the last row of biologist_finder.
+    num_papers (optional) - int; length of the reading list, the user is asked if not provided
+    weighting (optional) - str; "count", "similarity" or "recency", see paper_citation_counts
+    engine (optional) - str; "similarity" or "pagerank", see paper_citation_counts
+    paper_scores (optional) - numpy array; score of each paper in column order used instead of weighting and engine, e.g. the paper_pagerank column of one comparison vector
+
+    Returns:
+    reading_list_ids - list; paper IDs (str) of the reading list from most to least cited
+    (prints to the terminal citations for the most cited papers)
+    """
+    citation_counts, num_top_biologists = paper_citation_counts(biologist_finder, most_sim_bio_df, logger)[0::2]
+    for i, per_of_top_biol, num_cited in citation_threshold_report(citation_counts, num_top_biologists):
+        if num_cited != 1:
+            logger.info("{} papers were cited at least once by {}% ({}) of the most similar biologists.".format(num_cited, i, per_of_top_biol))
         else:
-            logger.info("{} paper was cited at least once by {}% ({}) of the most similar biologists.".format(num_papers, i, per_of_top_biol))
-    num_papers = int(input("How many papers do you want on the recommended reading list? "))
-    reading_list_ids = most_cited_papers_sort.head(num_papers).index.to_list()
+            logger.info("{} paper was cited at least once by {}% ({}) of the most similar biologists.".format(num_cited, i, per_of_top_biol))
+    if num_papers is None:
+        num_papers = int(input("How many papers do you want on the recommended reading list? "))
+    # Scored once the length is known, so "recency" only looks up the years of the candidate papers
+    if paper_scores is None:
+        paper_scores = citation_counts if weighting == "count" and engine == "similarity" else paper_citation_counts(biologist_finder, most_sim_bio_df, logger, weighting, engine=engine, num_papers=num_papers)[1]
+    reading_list_ids = [biologist_finder.papers[column] for column in top_papers(paper_scores, num_papers)]
     get_citations(reading_list_ids, logger)
+    return reading_list_ids
@@ -0,0 +1,287 @@
+'''
+Persistent local citation graph shared by every BiologyFinder query.  PMID to references, PMID to cited-by, PMID to authors and affiliations (the MEDLINE FAU and AD lists) and author to PMIDs are kept as compact integer CSR adjacency arrays that are memory-mapped from disk, and grow as new data is fetched from PubMed.  Once the store is warm most lookups are answered locally.  References and authors of a paper do not change, but new papers cite it and authors publish new papers, so the cited-by and author-to-PMIDs lists expire after the TTL of the E-utility they came from, as in the request cache.
+'''
+import atexit
+import os
+import threading
+import time
+import numpy as np
+import biologyfinder_cache as bfcache
+import biologyfinder_storage as bfstorage
+
+
+RELATIONS = ("refs", "citedby", "authors", "affiliations", "author_papers")
+# E-utility each relation is fetched with, for relations that go stale.  They expire after the TTL of that E-utility in the request cache (or biologyfinder_cache.DEFAULT_TTLS when caching is off).
+EXPIRING_RELATIONS = {"citedby": "elink", "author_papers": "esearch"}
+# Arrays of a CSRAdjacency, saved together as one array set (see biologyfinder_storage.save_array_set) so a crash or a concurrent flush never mixes generations
+CSR_DTYPES = {"keys": np.uint32, "indptr": np.int64, "targets": np.uint32, "fetched": np.float64}
+STRING_TABLE_DTYPES = {"data": np.uint8, "offsets": np.int64}
+# Pending additions kept in memory before they are merged into the files on disk
+DEFAULT_FLUSH_EVERY = 20000
+
+
+class CSRAdjacency:
+    """Read-only adjacency lists in CSR form: keys (sorted uint32), indptr (int64) and targets (uint32).  The neighbours of keys[i] are targets[indptr[i]:indptr[i + 1]] and were fetched at fetched[i].  A key with no neighbours is stored with an empty range, so "known to have none" differs from "unknown".
+
+    Arguments:
+    keys - numpy array; sorted source IDs
+    indptr - numpy array; start of each key's neighbours in targets, one longer than keys
+    targets - numpy array; neighbour IDs
+    fetched (optional) - numpy array; time (seconds since the epoch, float64) each key's neighbours were fetched, 0 if unknown
+    """
+
+    def __init__(self, keys, indptr, targets, fetched=None):
+        self.keys = keys
+        self.indptr = indptr if len(indptr) else np.zeros(1, dtype=np.int64)
+        self.targets = targets
+        # Stores written before fetch times were kept have none, their entries count as fetched long ago
+        self.fetched = fetched if fetched is not None and len(fetched) == len(keys) else np.zeros(len(keys), dtype=np.float64)
+
+    def _position(self, key):
+        position = np.searchsorted(self.keys, key)
+        if position == len(self.keys) or self.keys[position] != key:
+            return None
+        return position
+
+    def get(self, key):
+        """Returns the neighbours of key (numpy array) or None if the key is unknown."""
+        position = self._position(key)
+        if position is None:
+            return None
+        return self.targets[self.indptr[position]:self.indptr[position + 1]]
+
+    def fetched_at(self, key):
+        """Returns the time (float) the neighbours of key were fetched or None if the key is unknown."""
+        position = self._position(key)
+        return None if position is None else float(self.fetched[position])
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def load(cls, prefix):
+        arrays = bfstorage.load_array_set(prefix, CSR_DTYPES)
+        return cls(arrays["keys"], arrays["indptr"], arrays["targets"], arrays["fetched"])
+
+    def save(self, prefix):
+        bfstorage.save_array_set(prefix, {name: np.asarray(getattr(self, name), dtype=dtype) for name, dtype in CSR_DTYPES.items()})
+
+    def merge(self, delta):
+        """Returns a new CSRAdjacency with the lists in delta (dict of key to a (list of IDs, fetch time) pair) added, replacing the lists of keys already present."""
+        if not delta:
+            return self
+        delta_keys = np.array(sorted(delta), dtype=np.uint32)
+        delta_lists = [np.asarray(delta[key][0], dtype=np.uint32) for key in delta_keys.tolist()]
+        delta_fetched = np.array([delta[key][1] for key in delta_keys.tolist()], dtype=np.float64)
+        lengths = np.diff(self.indptr)
+        keep = ~np.isin(self.keys, delta_keys)
+        all_keys = np.concatenate([np.asarray(self.keys)[keep], delta_keys])
+        all_fetched = np.concatenate([np.asarray(self.fetched)[keep], delta_fetched])
+        all_lengths = np.concatenate([lengths[keep], [len(item) for item in delta_lists]]).astype(np.int64)
+        all_targets = np.concatenate([np.asarray(self.targets)[np.repeat(keep, lengths)]] + delta_lists).astype(np.uint32)
+        order = np.argsort(all_keys, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(all_lengths)[:-1]])
+        sorted_lengths = all_lengths[order]
+        indptr = np.zeros(len(all_keys) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(sorted_lengths)
+        gather = np.repeat(starts[order] - indptr[:-1], sorted_lengths) + np.arange(indptr[-1])
+        return CSRAdjacency(all_keys[order], indptr, all_targets[gather], all_fetched[order])
+
+
+def save_string_table(prefix, strings):
+    """Saves a string table of the store as one array set, so its bytes and offsets always match."""
+    data, offsets = bfstorage.encode_string_table(strings)
+    bfstorage.save_array_set(prefix, {"data": data, "offsets": offsets})
+
+
+def load_string_table(prefix):
+    """Loads a string table saved with save_string_table (or by an earlier version with biologyfinder_storage.save_string_table)."""
+    arrays = bfstorage.load_array_set(prefix, STRING_TABLE_DTYPES, mmap=False)
+    return bfstorage.decode_string_table(arrays["data"], arrays["offsets"])
+
+
+class CitationGraphStore:
+    """Local store of the PubMed citation graph.  Papers are identified by their PMID as a uint32, and authors and affiliations by their position in a string table.  New data is kept in memory and merged into the memory-mapped files by flush().
+
+    Arguments:
+    path - str; directory holding the store
+    flush_every (optional) - int; number of pending additions that triggers a flush
+    """
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY):
+        self.path = path
+        self.flush_every = flush_every
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self.authors = load_string_table(os.path.join(path, "author_names"))
+        self.author_ids = {name: author_id for author_id, name in enumerate(self.authors)}
+        self._saved_authors = len(self.authors)
+        self.affiliations = load_string_table(os.path.join(path, "affiliation_names"))
+        self.affiliation_ids = {affiliation: affiliation_id for affiliation_id, affiliation in enumerate(self.affiliations)}
+        self._saved_affiliations = len(self.affiliations)
+        self.adjacency = {relation: CSRAdjacency.load(os.path.join(path, relation)) for relation in RELATIONS}
+        self.pending = {relation: {} for relation in RELATIONS}
+        self._num_pending = 0
+
+    def ttl(self, relation):
+        """Returns the seconds (float) the lists of relation stay fresh, None if they never expire."""
+        if relation not in EXPIRING_RELATIONS:
+            return None
+        cache = bfcache.get_cache()
+        if cache is None:
+            return bfcache.DEFAULT_TTLS[EXPIRING_RELATIONS[relation]]
+        # Offline runs use whatever is stored, as the request cache does
+        return None if cache.offline else cache.ttls.get(EXPIRING_RELATIONS[relation], 0)
+
+    def fetched_at(self, relation, key):
+        """Returns the time (float) the neighbours of key in relation were fetched or None if the store does not know key."""
+        with self._lock:
+            if key in self.pending[relation]:
+                return self.pending[relation][key][1]
+            return self.adjacency[relation].fetched_at(key)
+
+    def lookup(self, relation, key, include_expired=False):
+        """Returns the neighbours (list of int) of key in relation or None if the store does not know key or its neighbours have expired (see ttl)."""
+        ttl = None if include_expired else self.ttl(relation)
+        with self._lock:
+            if key in self.pending[relation]:
+                values, fetched = self.pending[relation][key]
+                found = list(values)
+            else:
+                found = self.adjacency[relation].get(key)
+                if found is None:
+                    return None
+                fetched = self.adjacency[relation].fetched_at(key)
+                found = found.tolist()
+        if ttl is not None and time.time() - fetched > ttl:
+            return None
+        return found
+
+    def add(self, relation, key, values, fetched=None):
+        """Records the neighbours (list of int) of key in relation, replacing what was stored for key.
+
+        Arguments:
+        fetched (optional) - float; time the neighbours were fetched, now if not provided
+        """
+        with self._lock:
+            self.pending[relation][key] = (list(values), time.time() if fetched is None else fetched)
+            self._num_pending += 1
+            if self._num_pending >= self.flush_every:
+                self.flush()
+
+    def intern_author(self, name):
+        """Returns the integer ID of an author name, adding the name to the string table if it is new."""
+        with self._lock:
+            if name not in self.author_ids:
+                self.author_ids[name] = len(self.authors)
+                self.authors.append(name)
+            return self.author_ids[name]
+
+    def get_pmids(self, relation, pmid, include_expired=False):
+        """Returns the linked PMIDs (list of str) of a paper ("refs" or "citedby") or None if the paper is unknown or its links have expired."""
+        found = self.lookup(relation, int(pmid), include_expired)
+        return None if found is None else [str(item) for item in found]
+
+    def add_pmids(self, relation, pmid, pmids, fetched=None):
+        """Records the linked PMIDs (list of str) of a paper for "refs" or "citedby", fetched at fetched (float, now if not provided)."""
+        self.add(relation, int(pmid), [int(item) for item in pmids], fetched)
+
+    def intern_affiliation(self, affiliation):
+        """Returns the integer ID of an affiliation, adding it to the string table if it is new."""
+        with self._lock:
+            if affiliation not in self.affiliation_ids:
+                self.affiliation_ids[affiliation] = len(self.affiliations)
+                self.affiliations.append(affiliation)
+            return self.affiliation_ids[affiliation]
+
+    def get_authors(self, pmid):
+        """Returns the author names (list of str, MEDLINE FAU) and affiliations (list of str, MEDLINE AD) of a paper, ([], []) if it has no authors or None if the paper is unknown."""
+        with self._lock:
+            authors = self.lookup("authors", int(pmid))
+            # Stores written before affiliations were kept only hold the first and last authors, so those papers count as unknown
+            affiliations = self.lookup("affiliations", int(pmid))
+        if authors is None or affiliations is None:
+            return None
+        return [self.authors[author_id] for author_id in authors], [self.affiliations[affiliation_id] for affiliation_id in affiliations]
+
+    def add_authors(self, pmid, names, affiliations=()):
+        """Records the author names (list of str) and affiliations (list of str) of a paper."""
+        with self._lock:
+            self.add("authors", int(pmid), [self.intern_author(name) for name in names])
+            self.add("affiliations", int(pmid), [self.intern_affiliation(affiliation) for affiliation in affiliations])
+
+    def get_author_papers(self, name, include_expired=False):
+        """Returns the PMIDs (list of str) found for an author name search or None if the author is unknown or the search has expired."""
+        with self._lock:
+            if name not in self.author_ids:
+                return None
+            found = self.lookup("author_papers", self.author_ids[name], include_expired)
+        return None if found is None else [str(item) for item in found]
+
+    def author_papers_fetched_at(self, name):
+        """Returns the time (float) the papers of an author were searched for or None if the author is unknown."""
+        with self._lock:
+            return self.fetched_at("author_papers", self.author_ids[name]) if name in self.author_ids else None
+
+    def add_author_papers(self, name, pmids, fetched=None):
+        """Records the PMIDs (list of str) found for an author name search, made at fetched (float, now if not provided)."""
+        with self._lock:
+            self.add("author_papers", self.intern_author(name), [int(item) for item in pmids], fetched)
+
+    def flush(self):
+        """Merges the pending additions into the CSR files on disk and memory-maps the merged files."""
+        with self._lock:
+            if len(self.authors) != self._saved_authors:
+                save_string_table(os.path.join(self.path, "author_names"), self.authors)
+                self._saved_authors = len(self.authors)
+            if len(self.affiliations) != self._saved_affiliations:
+                save_string_table(os.path.join(self.path, "affiliation_names"), self.affiliations)
+                self._saved_affiliations = len(self.affiliations)
+            for relation in RELATIONS:
+                if self.pending[relation]:
+                    prefix = os.path.join(self.path, relation)
+                    self.adjacency[relation].merge(self.pending[relation]).save(prefix)
+                    self.adjacency[relation] = CSRAdjacency.load(prefix)
+                    self.pending[relation] = {}
+            self._num_pending = 0
+
+    def stats(self):
+        """Returns the number of stored entries for each relation and the number of authors and affiliations (dict)."""
+        with self._lock:
+            counts = {relation: len(self.adjacency[relation]) + sum(1 for key in self.pending[relation] if self.adjacency[relation].get(key) is None) for relation in RELATIONS}
+        counts["author_names"] = len(self.authors)
+        counts["affiliation_names"] = len(self.affiliations)
+        return counts
+
+
+_store = None
+
+
+def configure_graph_store(path="BiologyFinder_graph", flush_every=DEFAULT_FLUSH_EVERY):
+    """Turns on the shared citation graph store.  Pending data is flushed when the program exits.
+
+    Arguments:
+    path (optional) - str; directory holding the store
+    flush_every (optional) - int; number of pending additions that triggers a flush
+
+    Returns:
+    store - CitationGraphStore; the store now in use
+    """
+    global _store
+    if _store is not None:
+        _store.flush()
+    _store = CitationGraphStore(path, flush_every)
+    return _store
+
+
+def get_graph_store():
+    """Returns the CitationGraphStore in use or None if the store is off."""
+    return _store
+
+
+def _flush_at_exit():
+    if _store is not None:
+        _store.flush()
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,320 @@
+'''
+Approximate nearest-biologist search for very large master lists.  Each biologist's set of cited papers is reduced to a MinHash signature and the signatures are split into bands of an LSH index, so the biologists likely to be similar to the originating set of papers are found without scoring every biologist.  The originating set is small next to a biologist's set (a hundred papers against a thousand), so their Jaccard similarity is tiny even when most of the originating papers are cited.  The index is therefore queried by containment, the share of the originating papers a biologist cites, as in LSH Ensemble: a containment threshold is turned into a Jaccard threshold for each biologist's set size, and the banding (number of bands and rows per band) that best separates that threshold is used for the biologist.  The candidates are then scored exactly with the same similarity metrics as the full matrix.  Signatures are saved with numpy so they can be reused by later queries.
+'''
+import os
+import numpy as np
+import pandas as pd
+import biologyfinder_fxn as bffxn
+import biologyfinder_metrics as bfmetrics
+
+
+# Mersenne prime 2**31 - 1 used by the universal hash functions (a * x + b) % PRIME
+PRIME = np.int64(2 ** 31 - 1)
+EMPTY_HASH = np.int64(PRIME)
+# Rows per band the index keeps buckets for, the banding of each biologist is chosen among these at query time
+BAND_ROWS = (1, 2, 4)
+# Share of the originating papers a biologist has to cite to be a likely candidate
+DEFAULT_CONTAINMENT = 0.1
+# Jaccard thresholds the best banding is worked out for, and weight of false negatives against false positives when choosing it
+THRESHOLD_GRID = np.concatenate([[0.0], np.geomspace(1e-4, 1, 200)])
+FALSE_NEGATIVE_WEIGHT = 0.5
+
+
+def pmid_array(paper_list):
+    """Converts paper IDs (str) to a numpy array of unique integer PMIDs."""
+    return np.unique(np.fromiter((int(paper) for paper in paper_list), dtype=np.int64))
+
+
+def containment_to_jaccard(containment, query_size, set_sizes):
+    """Returns the Jaccard similarity (numpy array) a query set of query_size has with sets of set_sizes that contain exactly the given share of it.  Sets smaller than containment * query_size cannot reach the containment and get nan."""
+    set_sizes = np.asarray(set_sizes, dtype=np.float64)
+    overlap = containment * query_size
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaccard = overlap / (query_size + set_sizes - overlap)
+    return np.where(set_sizes >= overlap, jaccard, np.nan)
+
+
+def best_bandings(num_perm, band_rows=BAND_ROWS, thresholds=THRESHOLD_GRID, false_negative_weight=FALSE_NEGATIVE_WEIGHT):
+    """Works out, for each Jaccard threshold, the banding that minimizes the weighted probability mass of false positives (similarity below the threshold but a candidate) and false negatives (above the threshold but not a candidate).  A set with Jaccard similarity s is a candidate with probability 1 - (1 - s ** rows) ** bands.
+
+    Arguments:
+    num_perm - int; number of hash functions in a signature
+    band_rows (optional) - tuple of int; rows per band to choose from
+    thresholds (optional) - numpy array; increasing Jaccard thresholds
+
+    Returns:
+    bands - numpy array; number of bands for each threshold
+    rows - numpy array; rows per band for each threshold
+    """
+    similarity = np.linspace(0, 1, 1001)
+    step = similarity[1]
+    best_cost = np.full(len(thresholds), np.inf)
+    best_bands = np.zeros(len(thresholds), dtype=np.int64)
+    best_rows = np.zeros(len(thresholds), dtype=np.int64)
+    positions = np.searchsorted(similarity, thresholds)
+    for rows in band_rows:
+        for bands in range(1, num_perm // rows + 1):
+            candidate = 1 - (1 - similarity ** rows) ** bands
+            false_positives = np.concatenate([[0], np.cumsum(candidate[1:] + candidate[:-1]) * step / 2])
+            missed = 1 - candidate
+            false_negatives = np.concatenate([[0], np.cumsum(missed[1:] + missed[:-1]) * step / 2])
+            cost = (1 - false_negative_weight) * false_positives[positions] + false_negative_weight * (false_negatives[-1] - false_negatives[positions])
+            better = cost < best_cost
+            best_cost[better] = cost[better]
+            best_bands[better] = bands
+            best_rows[better] = rows
+    return best_bands, best_rows
+
+
+class MinHashLSH:
+    """MinHash signatures of the cited papers of each biologist with LSH buckets over bands of 1, 2 and 4 rows (BAND_ROWS).  Two sets land in the same bucket of a band of r rows when every hash in the band matches, which happens with probability jaccard ** r, so with b such bands a set becomes a candidate with probability 1 - (1 - jaccard ** r) ** b.  The b and r of each biologist are chosen at query time from the containment threshold and the sizes of both sets, see query.
+
+    Arguments:
+    num_perm (optional) - int; number of hash functions in a signature, must be divisible by every entry of BAND_ROWS
+    seed (optional) - int; seed of the hash functions, signatures are only comparable between indexes with the same seed and num_perm
+    """
+
+    def __init__(self, num_perm=128, seed=1):
+        if any(num_perm % rows for rows in BAND_ROWS):
+            raise ValueError("The number of hash functions ({}) must be divisible by {}.".format(num_perm, ", ".join(str(rows) for rows in BAND_ROWS)))
+        self.num_perm = num_perm
+        self.seed = seed
+        random_state = np.random.RandomState(seed)
+        self.hash_a = random_state.randint(1, PRIME, size=num_perm, dtype=np.int64)
+        self.hash_b = random_state.randint(0, PRIME, size=num_perm, dtype=np.int64)
+        self.biologists = []
+        self.biologist_rows = {}
+        self.signatures = np.zeros((0, num_perm), dtype=np.int64)
+        self.sizes = np.zeros(0, dtype=np.int64)
+        self.buckets = {rows: [{} for _ in range(num_perm // rows)] for rows in BAND_ROWS}
+        self._bandings = None
+
+    def __len__(self):
+        return len(self.biologists)
+
+    def signatures_of(self, paper_sets):
+        """Returns the MinHash signatures (numpy array, one row per set) of a list of sets of paper IDs and the number of unique papers in each set (numpy array).  Empty sets get a signature that matches nothing."""
+        pmid_sets = [pmid_array(papers) for papers in paper_sets]
+        lengths = np.array([len(pmids) for pmids in pmid_sets], dtype=np.int64)
+        signatures = np.full((len(pmid_sets), self.num_perm), EMPTY_HASH, dtype=np.int64)
+        filled = np.flatnonzero(lengths)
+        if not len(filled):
+            return signatures, lengths
+        pmids = np.concatenate([pmid_sets[row] for row in filled]) % PRIME
+        starts = np.concatenate([[0], np.cumsum(lengths[filled])[:-1]])
+        for perm in range(self.num_perm):
+            hashes = (self.hash_a[perm] * pmids + self.hash_b[perm]) % PRIME
+            signatures[filled, perm] = np.minimum.reduceat(hashes, starts)
+        return signatures, lengths
+
+    def band_keys(self, signature, rows):
+        """Returns the bucket key (bytes) of each band of rows hashes of a signature."""
+        return [band.tobytes() for band in np.split(signature, self.num_perm // rows)]
+
+    def _index_rows(self, biologist_rows):
+        for row in biologist_rows:
+            if self.signatures[row, 0] == EMPTY_HASH:
+                continue
+            for rows, buckets in self.buckets.items():
+                for band, key in enumerate(self.band_keys(self.signatures[row], rows)):
+                    buckets[band].setdefault(key, []).append(row)
+
+    def add_biologists(self, biologist_cited_papers_dict):
+        """Adds the biologists not yet in the index.  Biologists already indexed keep their signatures.
+
+        Arguments:
+        biologist_cited_papers_dict - dict; keys are biologist names (str) and the values are lists of the IDs of the papers they cited
+
+        Returns:
+        num_added - int; number of biologists added
+        """
+        new_biologists = [biologist for biologist in biologist_cited_papers_dict if biologist not in self.biologist_rows]
+        if not new_biologists:
+            return 0
+        first_row = len(self.biologists)
+        signatures, sizes = self.signatures_of([biologist_cited_papers_dict[biologist] for biologist in new_biologists])
+        self.signatures = np.vstack([self.signatures, signatures])
+        self.sizes = np.concatenate([self.sizes, sizes])
+        for row, biologist in enumerate(new_biologists, first_row):
+            self.biologist_rows[biologist] = row
+            self.biologists.append(biologist)
+        self._index_rows(range(first_row, len(self.biologists)))
+        return len(new_biologists)
+
+    def bandings(self, query_size, containment=DEFAULT_CONTAINMENT):
+        """Returns the number of bands and rows per band (numpy arrays, one entry per indexed biologist) used to look for a query set of query_size with the given containment threshold.  Biologists whose set is too small to reach the threshold get 0 bands."""
+        if self._bandings is None:
+            self._bandings = best_bandings(self.num_perm)
+        jaccard = containment_to_jaccard(containment, query_size, self.sizes)
+        reachable = ~np.isnan(jaccard)
+        grid = np.clip(np.searchsorted(THRESHOLD_GRID, np.where(reachable, jaccard, 0)), 0, len(THRESHOLD_GRID) - 1)
+        bands = np.where(reachable, self._bandings[0][grid], 0)
+        return bands, self._bandings[1][grid]
+
+    def query(self, paper_list, containment=DEFAULT_CONTAINMENT):
+        """Returns the names (set of str) of the indexed biologists likely to cite at least the containment share of a set of papers.  Each biologist is looked up in the bands chosen for it by bandings.
+
+        Arguments:
+        paper_list - list; paper IDs (str)
+        containment (optional) - float; share of paper_list a biologist should cite
+        """
+        signatures, sizes = self.signatures_of([paper_list])
+        signature = signatures[0]
+        if signature[0] == EMPTY_HASH or not len(self):
+            return set()
+        biologist_bands, biologist_band_rows = self.bandings(sizes[0], containment)
+        found = set()
+        for rows, buckets in self.buckets.items():
+            uses_rows = (biologist_band_rows == rows) & (biologist_bands > 0)
+            if not uses_rows.any():
+                continue
+            for band, key in enumerate(self.band_keys(signature, rows)[:biologist_bands[uses_rows].max()]):
+                found.update(row for row in buckets[band].get(key, ()) if biologist_band_rows[row] == rows and band < biologist_bands[row])
+        return {self.biologists[row] for row in found}
+
+    def save(self, path):
+        """Saves the hash parameters, biologist names, set sizes and signatures to a .npz file.  The LSH buckets are rebuilt from the signatures on load."""
+        temp_path = path + ".tmp.npz"
+        np.savez(temp_path, params=np.array([self.num_perm, self.seed], dtype=np.int64), biologists=np.array(self.biologists, dtype=str), signatures=self.signatures, sizes=self.sizes)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index saved with save.  Raises ValueError for an index saved without set sizes by an earlier version."""
+        with np.load(path) as saved:
+            if "sizes" not in saved.files:
+                raise ValueError("The MinHash index {} has no set sizes, it has to be built again.".format(path))
+            num_perm, seed = (int(value) for value in saved["params"])
+            index = cls(num_perm, seed)
+            index.biologists = saved["biologists"].tolist()
+            index.signatures = saved["signatures"]
+            index.sizes = saved["sizes"]
+        index.biologist_rows = {biologist: row for row, biologist in enumerate(index.biologists)}
+        index._index_rows(range(len(index.biologists)))
+        return index
+
+
+def citation_sets(biologist_finder):
+    """Reads the cited papers of every biologist and of the originating set of papers back out of a CitationMatrix.
+
+    Arguments:
+    biologist_finder - CitationMatrix; the last row is the comparison vector
+
+    Returns:
+    biologist_cited_papers_dict - dict; keys are biologist names (str) and the values are lists of the IDs of the papers they cited
+    comparison_refs - list; paper IDs (str) cited by the originating set of papers
+    """
+    matrix = biologist_finder.matrix.tocsr()
+    papers = np.asarray(biologist_finder.papers)
+    rows = [papers[matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]].tolist() for row in range(matrix.shape[0])]
+    return dict(zip(biologist_finder.biologists[:-1], rows[:-1])), rows[-1]
+
+
+@bfmetrics.timed
+def load_or_build_index(biologist_cited_papers_dict, path=None, num_perm=128, logger=None):
+    """Loads the MinHash index saved at path (if any), adds the biologists it does not know yet and saves it again.  An index saved by an earlier version without set sizes is built again.
+
+    Arguments:
+    biologist_cited_papers_dict - dict; keys are biologist names (str) and the values are lists of the IDs of the papers they cited
+    path (optional) - str; .npz file of the index, the index is kept in memory only if not provided
+    num_perm (optional) - int; number of hash functions of a new index
+
+    Returns:
+    index - MinHashLSH
+    """
+    index = None
+    if path and os.path.exists(path):
+        try:
+            index = MinHashLSH.load(path)
+        except ValueError as err:
+            if logger is not None:
+                logger.info(str(err))
+    rebuilt = index is None
+    if rebuilt:
+        index = MinHashLSH(num_perm)
+    num_added = index.add_biologists(biologist_cited_papers_dict)
+    if logger is not None:
+        logger.info("Computed MinHash signatures for {} new biologists ({} indexed).".format(num_added, len(index)))
+    if path and (num_added or rebuilt):
+        index.save(path)
+    return index
+
+
+def comparison_columns(biologist_finder):
+    """Reads the papers cited by the originating set of papers and the number of paper columns out of a CitationMatrix, as approximate_similarity_scores_df takes them.
+
+    Arguments:
+    biologist_finder - CitationMatrix; the last row is the comparison vector
+
+    Returns:
+    comparison_refs - list; paper IDs (str) of the columns of the comparison vector
+    num_papers - int; number of paper columns the similarity metrics count, before any pruning
+    """
+    comparison_row = biologist_finder.matrix.tocsr()[-1]
+    num_papers = biologist_finder.num_papers if biologist_finder.num_papers is not None else len(biologist_finder.papers)
+    return [biologist_finder.papers[column] for column in comparison_row.indices], num_papers
+
+
+@bfmetrics.timed
+def approximate_similarity_scores_df(biologist_cited_papers_dict, comparison_refs, index, num_papers, metric="pearson", logger=None, containment=DEFAULT_CONTAINMENT):
+    """Scores only the biologists the LSH index returns as candidates for the originating set of papers, using the exact similarity metric.  Only the cited papers of the candidates are read, the number of paper columns is given, so the scores of the candidates are the same as in create_similarity_scores_df without building or scoring the full matrix.  Biologists that are not candidates are listed without a score (nan) after the scored ones, so percentages of the master list mean the same as in exact mode; most_sim_biologists never selects them.
+
+    Arguments:
+    biologist_cited_papers_dict - dict; keys are biologist names (str) and the values are lists of the IDs of the papers they cited
+    comparison_refs - list; paper IDs (str) cited by the originating set of papers that are also cited by a biologist, i.e. the columns of the comparison vector
+    index - MinHashLSH; index holding every biologist of biologist_cited_papers_dict
+    num_papers - int; number of papers cited by any biologist, i.e. the columns of the full matrix
+    metric (optional) - str; one of "pearson", "jaccard", "cosine" or "tanimoto"
+    containment (optional) - float; share of the originating papers a biologist should cite to be a candidate, see MinHashLSH.query
+
+    Returns:
+    sorted_sim_df - pandas dataframe; 2 columns - "similarity" and "Scientist", with the comparison papers as "comparison", sorted from highest to lowest similarity
+    """
+    comparison_set = set(comparison_refs)
+    found = index.query(comparison_set, containment)
+    candidates = sorted((biologist for biologist in found if biologist in biologist_cited_papers_dict), key=index.biologist_rows.get)
+    row_sums = np.zeros(len(candidates) + 1)
+    overlaps = np.zeros(len(candidates) + 1)
+    for row, biologist in enumerate(candidates):
+        papers = set(biologist_cited_papers_dict[biologist])
+        row_sums[row] = len(papers)
+        overlaps[row] = len(comparison_set.intersection(papers))
+    row_sums[-1] = overlaps[-1] = len(comparison_set)
+    scores = bffxn.scores_from_counts(row_sums, row_sums, overlaps, len(comparison_set), len(comparison_set), num_papers, metric)
+    if logger is not None:
+        logger.info("The LSH index returned {} of {} biologists as candidates.".format(len(candidates), len(biologist_cited_papers_dict)))
+    scored_df = pd.DataFrame({"similarity": scores, "Scientist": candidates + ["comparison"]}).sort_values('similarity', ascending=False)
+    candidate_set = set(candidates)
+    unscored = [biologist for biologist in biologist_cited_papers_dict if biologist not in candidate_set]
+    unscored_df = pd.DataFrame({"similarity": np.full(len(unscored), np.nan), "Scientist": unscored})
+    return pd.concat([scored_df, unscored_df], ignore_index=True)
+
+
+def candidate_citation_matrix(biologist_cited_papers_dict, comparison_refs, similarity_df):
+    """Builds a CitationMatrix of the biologists an approximate search scored, for the reading list, which only reads the rows of the most similar biologists.
+
+    Arguments:
+    biologist_cited_papers_dict - dict; keys are biologist names (str) and the values are lists of the IDs of the papers they cited
+    comparison_refs - list; paper IDs (str) cited by the originating set of papers
+    similarity_df - pandas dataframe; scores returned by approximate_similarity_scores_df
+
+    Returns:
+    biologist_finder - CitationMatrix; a row for each scored biologist and a column for each paper they or the originating set of papers cite, the last row is the comparison vector
+    """
+    scored = [biologist for biologist in similarity_df.dropna(subset=["similarity"])["Scientist"] if biologist != "comparison"]
+    candidate_cited_papers_dict = {biologist: biologist_cited_papers_dict[biologist] for biologist in scored}
+    paper_features = list(dict.fromkeys([paper for papers in candidate_cited_papers_dict.values() for paper in papers] + list(comparison_refs)))
+    paper_index = bffxn.create_paper_index(paper_features)
+    rows = [bffxn.create_binary_row(papers, paper_index) for papers in candidate_cited_papers_dict.values()]
+    rows.append(bffxn.create_binary_row(comparison_refs, paper_index))
+    return bffxn.CitationMatrix(bffxn.create_binary_matrix(rows, len(paper_features)), scored + ["comparison"], paper_features)
+
+
+def lsh_recall(exact_sim_df, approximate_sim_df, top_k):
+    """Returns the fraction (float) of the top_k most similar biologists of exact mode that approximate mode also ranks in its top_k.  The comparison row is left out of both, and so are the biologists approximate mode did not score."""
+    exact_top = [name for name in exact_sim_df["Scientist"] if name != "comparison"][:top_k]
+    scored_sim_df = approximate_sim_df.dropna(subset=["similarity"])
+    approximate_top = set([name for name in scored_sim_df["Scientist"] if name != "comparison"][:top_k])
+    if not exact_top:
+        return float("nan")
+    return sum(1 for name in exact_top if name in approximate_top) / len(exact_top)
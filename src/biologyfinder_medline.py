@@ -0,0 +1,125 @@
+'''
+Streaming, field-selective MEDLINE reader.  Bio.Medline builds a dictionary with every tag of every record, while BiologyFinder only ever reads a few tags (title, authors, journal, date, PMID and affiliations).  This reader reads the response a chunk at a time, skips the tags that were not asked for without building strings for them, and yields small records that hold only the requested tags.  Values are the same as Bio.Medline gives for those tags.
+'''
+import codecs
+
+
+# Tags Bio.Medline joins into one string, every other tag is a list with one entry per line
+TEXT_TAGS = frozenset(("ID", "PMID", "SO", "RF", "NI", "JC", "TA", "IS", "CY", "TT", "CA", "IP", "VI", "DP", "YR", "PG", "LID", "DA", "LR", "OWN", "STAT", "DCOM", "PUBM", "DEP", "PL", "JID", "SB", "PMC", "EDAT", "MHDA", "PST", "AB", "EA", "TI", "JT"))
+# List tags whose continuation lines extend the last entry instead of starting a new one
+JOINED_TAGS = frozenset(("MH", "AD"))
+# Tags used for printing citations
+CITATION_TAGS = ("PMID", "TI", "AU", "JT", "DP")
+# Tags used to identify authors
+AUTHOR_TAGS = ("PMID", "FAU", "AD")
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+_record_classes = {}
+
+
+def record_class(tags):
+    """Returns a class for records holding only tags, with one slot per tag.  Classes are made once per set of tags."""
+    tags = tuple(dict.fromkeys(tags))
+    if tags not in _record_classes:
+        _record_classes[tags] = type("MedlineRecord", (MedlineRecord,), {"__slots__": tags, "tags": tags})
+    return _record_classes[tags]
+
+
+class MedlineRecord:
+    """Base class of the records made by record_class.  Supports record.get(tag, default), record[tag] and "tag in record" like a Bio.Medline record, for the tags it was made with."""
+    __slots__ = ()
+    tags = ()
+
+    def get(self, tag, default=None):
+        return getattr(self, tag, default) if tag in self.tags else default
+
+    def __getitem__(self, tag):
+        value = self.get(tag)
+        if value is None:
+            raise KeyError(tag)
+        return value
+
+    def __contains__(self, tag):
+        return self.get(tag) is not None
+
+    def __repr__(self):
+        return "MedlineRecord({})".format(", ".join("{}={!r}".format(tag, self.get(tag)) for tag in self.tags if tag in self))
+
+
+def iter_line_blocks(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields the complete lines (list of str, without line endings) of each chunk of a text or binary handle, or of an iterable of str or bytes chunks, as the chunks arrive.  Bytes are decoded as UTF-8 incrementally, so a character split across two chunks is handled."""
+    if hasattr(source, "read"):
+        chunks = iter(lambda: source.read(chunk_size), source.read(0))
+    else:
+        chunks = iter(source)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    remainder = ""
+    for chunk in chunks:
+        text = remainder + (decoder.decode(chunk) if isinstance(chunk, (bytes, bytearray)) else chunk)
+        if "\r" in text:
+            text = text.replace("\r\n", "\n")
+        lines = text.split("\n")
+        remainder = lines.pop()
+        yield lines
+    remainder += decoder.decode(b"", final=True)
+    if remainder:
+        yield [remainder.rstrip("\r")]
+
+
+def _finish(cls, values):
+    record = cls()
+    for tag, value in values.items():
+        setattr(record, tag, " ".join(value) if tag in TEXT_TAGS else value)
+    return record
+
+
+def parse(source, tags=CITATION_TAGS, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Reads MEDLINE records from an efetch response one at a time, keeping only the requested tags.
+
+    Arguments:
+    source - text or binary handle, or iterable of str or bytes chunks; MEDLINE text (rettype="medline", retmode="text")
+    tags (optional) - iterable of str; MEDLINE tags to keep, e.g. ("PMID", "TI", "AU", "JT", "DP")
+    chunk_size (optional) - int; number of characters or bytes read from a handle at a time
+
+    Returns:
+    generator of MedlineRecord; one record per MEDLINE record with the requested tags that were present.  Text tags are str and the rest are lists of str, as in Bio.Medline.
+    """
+    cls = record_class(tags)
+    wanted = frozenset(cls.tags)
+    values = {}
+    in_record = False
+    current = None
+    tag = None
+    for lines in iter_line_blocks(source, chunk_size):
+        for line in lines:
+            if line.startswith("      "):
+                # Continuation of the previous tag
+                if current is None:
+                    continue
+                line = line.rstrip() or "      \n"
+                if tag in JOINED_TAGS:
+                    current[-1] += line[5:]
+                else:
+                    current.append(line[6:])
+            elif line and not line.isspace():
+                in_record = True
+                tag = line[:4].rstrip()
+                if tag in wanted:
+                    current = values.setdefault(tag, [])
+                    current.append(line[6:].rstrip())
+                else:
+                    current = None
+            elif in_record:
+                yield _finish(cls, values)
+                values = {}
+                in_record = False
+                current = None
+    if in_record:
+        yield _finish(cls, values)
+
+
+def read(source, tags=CITATION_TAGS):
+    """Reads a single MEDLINE record with the requested tags, see parse.  Raises ValueError if the source has no record."""
+    for record in parse(source, tags):
+        return record
+    raise ValueError("No MEDLINE record found.")
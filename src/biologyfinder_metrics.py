@@ -0,0 +1,266 @@
+'''
+Run instrumentation for BiologyFinder.  Records how long each stage takes, the E-utilities requests made (count, latency histogram, bytes and retries per endpoint), cache hits and misses, peak memory and the shape and density of the citation matrices built.  Results can be written as JSON, as a Chrome/Perfetto trace (chrome://tracing) or logged as a summary table at the end of a run.  Nothing is recorded until configure_metrics is called, and the hooks then cost one global lookup each.
+'''
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Upper bounds (seconds) of the request latency histogram buckets, the last bucket takes everything slower
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+def peak_rss():
+    """Returns the peak resident memory of the process in bytes or None where the resource module is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class EndpointStats:
+    """Request statistics of one E-utility."""
+    __slots__ = ("requests", "errors", "retries", "bytes", "seconds", "max_seconds", "histogram", "cache_hits", "cache_misses")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add_request(self, seconds, num_bytes):
+        self.requests += 1
+        self.bytes += num_bytes
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+    def quantile(self, fraction):
+        """Returns the upper bound (seconds) of the histogram bucket holding the given fraction of requests, None without requests."""
+        if not self.requests:
+            return None
+        target = fraction * self.requests
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if seen >= target:
+                return LATENCY_BUCKETS[bucket] if bucket < len(LATENCY_BUCKETS) else self.max_seconds
+        return self.max_seconds
+
+    def to_dict(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "total_seconds": self.seconds,
+            "mean_seconds": self.seconds / self.requests if self.requests else None,
+            "p50_seconds": self.quantile(0.5),
+            "p95_seconds": self.quantile(0.95),
+            "max_seconds": self.max_seconds,
+            "latency_histogram": {("<= {:g}s".format(bound) if bucket < len(LATENCY_BUCKETS) else "> {:g}s".format(LATENCY_BUCKETS[-1])): count for bucket, (bound, count) in enumerate(zip(LATENCY_BUCKETS + (None,), self.histogram))},
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_ratio": self.cache_hits / lookups if lookups else None,
+        }
+
+
+class MetricsRecorder:
+    """Collects the spans, request statistics and matrix sizes of a run.  Thread-safe, since requests are made from thread pools."""
+
+    def __init__(self):
+        self.started = time.time()
+        self._clock_start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.spans = []
+        self.endpoints = {}
+        self.matrices = []
+
+    def _endpoint(self, endpoint):
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointStats()
+        return self.endpoints[endpoint]
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        stack = self._local.__dict__.setdefault("stack", [])
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            with self._lock:
+                self.spans.append({
+                    "name": name,
+                    "parent": parent,
+                    "start_seconds": start - self._clock_start,
+                    "seconds": end - start,
+                    "thread": threading.get_ident(),
+                    "peak_rss_bytes": peak_rss(),
+                    "attributes": attributes,
+                })
+
+    def record_request(self, endpoint, seconds, num_bytes, retries=0):
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats.add_request(seconds, num_bytes)
+            stats.retries += retries
+
+    def record_error(self, endpoint, retries=0):
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats.errors += 1
+            stats.retries += retries
+
+    def record_cache(self, endpoint, hit):
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            if hit:
+                stats.cache_hits += 1
+            else:
+                stats.cache_misses += 1
+
+    def record_matrix(self, name, matrix):
+        rows, columns = matrix.shape
+        nnz = int(matrix.nnz)
+        with self._lock:
+            self.matrices.append({"name": name, "rows": rows, "columns": columns, "nnz": nnz, "density": nnz / (rows * columns) if rows and columns else 0.0})
+
+    def to_dict(self):
+        """Returns everything recorded (dict) in a JSON-serializable form."""
+        with self._lock:
+            return {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "elapsed_seconds": time.perf_counter() - self._clock_start,
+                "peak_rss_bytes": peak_rss(),
+                "spans": list(self.spans),
+                "endpoints": {endpoint: stats.to_dict() for endpoint, stats in sorted(self.endpoints.items())},
+                "matrices": list(self.matrices),
+            }
+
+    def write_json(self, path):
+        with open(path, "w") as handle:
+            json.dump(self.to_dict(), handle, indent=2)
+        return path
+
+    def write_trace(self, path):
+        """Writes the spans in the Chrome trace event format, viewable in chrome://tracing or Perfetto."""
+        with self._lock:
+            events = [{"name": span["name"], "ph": "X", "ts": span["start_seconds"] * 1e6, "dur": span["seconds"] * 1e6, "pid": 1, "tid": span["thread"], "args": span["attributes"]} for span in self.spans]
+        with open(path, "w") as handle:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, handle)
+        return path
+
+    def summary_table(self):
+        """Returns a plain text table (str) of the stage timings, requests per endpoint, cache hit ratio, peak memory and matrix sizes."""
+        data = self.to_dict()
+        lines = ["{:<44} {:>10}".format("Stage", "Seconds")]
+        depth = {}
+        for span in sorted(data["spans"], key=lambda span: span["start_seconds"]):
+            depth[span["name"]] = depth.get(span["parent"], -1) + 1
+            lines.append("{:<44} {:>10.2f}".format("  " * depth[span["name"]] + span["name"], span["seconds"]))
+        lines.append("")
+        lines.append("{:<10} {:>8} {:>7} {:>8} {:>8} {:>8} {:>12} {:>10}".format("Endpoint", "Requests", "Retries", "Mean s", "p95 s", "Max s", "MB", "Cache hit"))
+        for endpoint, stats in data["endpoints"].items():
+            lines.append("{:<10} {:>8} {:>7} {:>8} {:>8} {:>8.2f} {:>12.2f} {:>10}".format(
+                endpoint, stats["requests"], stats["retries"],
+                "-" if stats["mean_seconds"] is None else "{:.3f}".format(stats["mean_seconds"]),
+                "-" if stats["p95_seconds"] is None else "{:.3f}".format(stats["p95_seconds"]),
+                stats["max_seconds"], stats["bytes"] / 1e6,
+                "-" if stats["cache_hit_ratio"] is None else "{:.0%}".format(stats["cache_hit_ratio"])))
+        for matrix in data["matrices"]:
+            lines.append("")
+            lines.append("Matrix {}: {} x {}, {} citations stored, density {:.4%}".format(matrix["name"], matrix["rows"], matrix["columns"], matrix["nnz"], matrix["density"]))
+        lines.append("")
+        lines.append("Elapsed {:.1f}s, peak memory {}".format(data["elapsed_seconds"], "unknown" if data["peak_rss_bytes"] is None else "{:.0f} MB".format(data["peak_rss_bytes"] / 1e6)))
+        return "\n".join(lines)
+
+
+_recorder = None
+
+
+def configure_metrics():
+    """Starts recording metrics for the rest of the run.
+
+    Returns:
+    recorder - MetricsRecorder; the recorder now in use
+    """
+    global _recorder
+    _recorder = MetricsRecorder()
+    return _recorder
+
+
+def get_metrics():
+    """Returns the MetricsRecorder in use or None if metrics are off."""
+    return _recorder
+
+
+def disable_metrics():
+    """Stops recording metrics."""
+    global _recorder
+    _recorder = None
+
+
+def span(name, **attributes):
+    """Context manager timing a stage of the run, e.g. with bfmetrics.span("reading_list"): ...  Spans opened inside another span are recorded as its children.  Does nothing when metrics are off."""
+    if _recorder is None:
+        return _NO_SPAN
+    return _recorder.span(name, **attributes)
+
+
+def timed(func):
+    """Decorator recording every call of a function as a span named after the function."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _recorder is None:
+            return func(*args, **kwargs)
+        with _recorder.span(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def record_request(endpoint, seconds, num_bytes, retries=0):
+    """Records a successful E-utilities request: its latency (seconds), response size (bytes) and the number of retries it needed."""
+    if _recorder is not None:
+        _recorder.record_request(endpoint, seconds, num_bytes, retries)
+
+
+def record_error(endpoint, retries=0):
+    """Records an E-utilities request that failed after all its retries."""
+    if _recorder is not None:
+        _recorder.record_error(endpoint, retries)
+
+
+def record_cache(endpoint, hit):
+    """Records a lookup in the fetch cache."""
+    if _recorder is not None:
+        _recorder.record_cache(endpoint, hit)
+
+
+def record_matrix(name, matrix):
+    """Records the shape, number of stored citations and density of a sparse citation matrix."""
+    if _recorder is not None:
+        _recorder.record_matrix(name, matrix)
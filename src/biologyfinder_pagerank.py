@@ -0,0 +1,152 @@
+'''
+Co-citation graph ranking for BiologyFinder.  The biologist x paper citation matrix A defines two weighted graphs: biologists linked by the number of papers they both cite (A·Aᵀ) and papers linked by the number of biologists citing both (Aᵀ·A).  Biologists and papers are ranked with personalized PageRank on these graphs, restarting at the papers cited by the originating set of papers, so a biologist ranks high when they are close to the seed papers' neighbourhood in the graph and not only when their own citation vector overlaps with it.  Neither graph is ever built: each power iteration step multiplies by A and Aᵀ, which keeps the cost to two sparse matrix-vector products.
+'''
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import biologyfinder_metrics as bfmetrics
+
+
+DEFAULT_ALPHA = 0.85
+DEFAULT_TOL = 1e-10
+DEFAULT_MAX_ITER = 200
+
+
+class CoCitationGraph:
+    """One of the two co-citation graphs of a citation matrix, applied implicitly.  Self-loops (a biologist with itself, a paper with itself) are left out.
+
+    Arguments:
+    matrix - scipy.sparse matrix; biologist x paper citation matrix without the comparison row
+    of (optional) - str; "biologists" for the A·Aᵀ graph between the rows or "papers" for the Aᵀ·A graph between the columns
+    """
+
+    def __init__(self, matrix, of="biologists"):
+        if of not in ("biologists", "papers"):
+            raise ValueError("Unknown co-citation graph {}, use biologists or papers.".format(of))
+        matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+        if of == "papers":
+            matrix = matrix.T.tocsr()
+        self.matrix = matrix
+        self.matrix_t = matrix.T.tocsr()
+        # The diagonal of A·Aᵀ, the number of papers each node shares with itself
+        self.self_weights = np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+        self.degrees = self.matvec(np.ones(matrix.shape[0]))
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def matvec(self, vector):
+        """Returns the product (numpy array) of the weighted adjacency matrix of the graph with a vector, or with each column of a 2-D array."""
+        if vector.ndim == 1:
+            return self.matrix @ (self.matrix_t @ vector) - self.self_weights * vector
+        return self.matrix @ (self.matrix_t @ vector) - self.self_weights[:, np.newaxis] * vector
+
+
+def normalize(vector):
+    """Scales a non-negative vector (or each column of a 2-D array) to sum to 1.  All-zero vectors become uniform."""
+    vector = np.asarray(vector, dtype=np.float64)
+    totals = vector.sum(axis=0)
+    uniform = np.full(vector.shape, 1.0 / max(vector.shape[0], 1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(totals > 0, vector / totals, uniform)
+
+
+@bfmetrics.timed
+def personalized_pagerank(graph, personalization, alpha=DEFAULT_ALPHA, tol=DEFAULT_TOL, max_iter=DEFAULT_MAX_ITER):
+    """Ranks the nodes of a co-citation graph by sparse power iteration.  At each step the walk follows an edge with probability alpha, choosing edges in proportion to their weight, and otherwise restarts at a node drawn from the personalization vector.  Nodes without edges send their whole score back to the personalization vector.
+
+    Arguments:
+    graph - CoCitationGraph; graph to rank
+    personalization - numpy array; restart weight of each node, or a 2-D array with one column per personalization to rank several at once
+    alpha (optional) - float; probability of following an edge instead of restarting
+    tol (optional) - float; stop when the scores change by less than this (L1 norm, per column)
+    max_iter (optional) - int; maximum number of iterations
+
+    Returns:
+    scores - numpy array; PageRank of each node (summing to 1), with the same shape as personalization
+    iterations - int; number of iterations run
+    """
+    restart = normalize(personalization)
+    inverse_degrees = np.zeros(len(graph))
+    connected = graph.degrees > 0
+    inverse_degrees[connected] = 1.0 / graph.degrees[connected]
+    if restart.ndim == 2:
+        inverse_degrees = inverse_degrees[:, np.newaxis]
+        connected = connected[:, np.newaxis]
+    scores = restart.copy()
+    for iteration in range(1, max_iter + 1):
+        dangling = np.where(connected, 0.0, scores).sum(axis=0)
+        updated = alpha * graph.matvec(scores * inverse_degrees) + (alpha * dangling + 1 - alpha) * restart
+        change = np.abs(updated - scores).sum(axis=0)
+        scores = updated
+        if np.all(change < tol):
+            break
+    return scores, iteration
+
+
+def seed_personalizations(biologist_finder, comparison_matrix=None):
+    """Returns the restart vectors of the originating set of papers (the last row of the matrix): for the paper graph, the papers it cites, and for the biologist graph, each biologist weighted by the number of those papers they cite.
+
+    Arguments:
+    biologist_finder - CitationMatrix; the last row is the comparison vector
+    comparison_matrix (optional) - scipy.sparse matrix; comparison vectors to use instead of the last row, one per row (see biologyfinder_fxn.create_comparison_matrix)
+
+    Returns:
+    biologist_personalization - numpy array; one weight per biologist, or one column per comparison vector with comparison_matrix
+    paper_personalization - numpy array; one weight per paper, or one column per comparison vector with comparison_matrix
+    """
+    matrix = sparse.csr_matrix(biologist_finder.matrix, dtype=np.float64)
+    if comparison_matrix is None:
+        paper_personalization = np.asarray(matrix[-1].todense()).ravel()
+    else:
+        paper_personalization = sparse.csr_matrix(comparison_matrix, dtype=np.float64).T.toarray()
+    biologist_personalization = matrix[:-1] @ paper_personalization
+    return biologist_personalization, paper_personalization
+
+
+def biologist_pagerank(biologist_finder, alpha=DEFAULT_ALPHA, tol=DEFAULT_TOL, max_iter=DEFAULT_MAX_ITER, comparison_matrix=None):
+    """Ranks the biologists of a citation matrix with personalized PageRank on the biologist co-citation graph (A·Aᵀ), restarting at the biologists who cite the papers cited by the originating set of papers.
+
+    Arguments:
+    biologist_finder - CitationMatrix; the last row is the comparison vector
+    alpha (optional) - float; probability of following an edge instead of restarting
+    comparison_matrix (optional) - scipy.sparse matrix; rank for each of these comparison vectors instead of the last row, all in the same power iteration
+
+    Returns:
+    scores - numpy array; PageRank (float) of each biologist, in row order without the comparison row, with one column per comparison vector when comparison_matrix is given
+    """
+    graph = CoCitationGraph(biologist_finder.matrix[:-1], "biologists")
+    return personalized_pagerank(graph, seed_personalizations(biologist_finder, comparison_matrix)[0], alpha, tol, max_iter)[0]
+
+
+def paper_pagerank(biologist_finder, alpha=DEFAULT_ALPHA, tol=DEFAULT_TOL, max_iter=DEFAULT_MAX_ITER, comparison_matrix=None):
+    """Ranks the papers of a citation matrix with personalized PageRank on the paper co-citation graph (Aᵀ·A), restarting at the papers cited by the originating set of papers.
+
+    Arguments:
+    biologist_finder - CitationMatrix; the last row is the comparison vector
+    alpha (optional) - float; probability of following an edge instead of restarting
+    comparison_matrix (optional) - scipy.sparse matrix; rank for each of these comparison vectors instead of the last row, all in the same power iteration
+
+    Returns:
+    scores - numpy array; PageRank (float) of each paper, in column order, with one column per comparison vector when comparison_matrix is given
+    """
+    graph = CoCitationGraph(biologist_finder.matrix[:-1], "papers")
+    return personalized_pagerank(graph, seed_personalizations(biologist_finder, comparison_matrix)[1], alpha, tol, max_iter)[0]
+
+
+@bfmetrics.timed
+def create_pagerank_scores_df(biologist_finder, alpha=DEFAULT_ALPHA):
+    """Ranks the biologists of a citation matrix with biologist_pagerank.  The dataframe has the same form as create_similarity_scores_df so it can be passed to most_sim_biologists and reading_list.  The comparison row gets a score of 1, the total PageRank of all biologists, so it comes first like its self-similarity does.
+
+    Arguments:
+    biologist_finder - CitationMatrix; the last row is the comparison vector
+    alpha (optional) - float; probability of following an edge instead of restarting
+
+    Returns:
+    sorted_rank_df - pandas dataframe; 2 columns - "similarity" holding the PageRank and "Scientist", sorted from highest to lowest PageRank
+    """
+    scores = np.append(biologist_pagerank(biologist_finder, alpha), 1.0)
+    rank_df = pd.Series(scores).to_frame("similarity")
+    rank_df["Scientist"] = biologist_finder.biologists
+    sorted_rank_df = rank_df.sort_values('similarity', ascending=False)
+    return sorted_rank_df
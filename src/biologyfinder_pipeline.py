@@ -0,0 +1,205 @@
+'''
+Streaming version of the BiologyFinder pipeline.  Each biologist on the master list goes straight into paper lookup, then reference lookup, then into the citation matrix while the rest of the master list is still being resolved, so network waits overlap and similarity scores are available as rows arrive.
+'''
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import biologyfinder_fxn as bffxn
+import biologyfinder_metrics as bfmetrics
+import biologyfinder_scheduler as bfscheduler
+import biologyfinder_authors as bfauthors
+
+
+class IncrementalCitationMatrix:
+    """Citation matrix that grows one biologist row at a time.  New papers get the next free column, and the counts needed for scoring (row sums and overlap with the comparison papers) are kept up to date so scores can be refreshed without rebuilding the matrix.
+
+    Arguments:
+    comparison_refs - list; paper IDs (str) cited by the originating set of papers
+    """
+
+    def __init__(self, comparison_refs):
+        self.comparison_refs = set(comparison_refs)
+        self.paper_index = {}
+        self.papers = []
+        self.biologists = []
+        self.rows = []
+        self.row_sums = []
+        self.overlaps = []
+        self.comparison_sum = 0
+
+    def add_biologist(self, biologist, cited_papers):
+        """Appends a biologist's row, adding any paper not yet in the paper index as a new column."""
+        for paper in cited_papers:
+            if paper not in self.paper_index:
+                self.paper_index[paper] = len(self.papers)
+                self.papers.append(paper)
+                if paper in self.comparison_refs:
+                    self.comparison_sum += 1
+        row = bffxn.create_binary_row(cited_papers, self.paper_index)
+        self.biologists.append(biologist)
+        self.rows.append(row)
+        self.row_sums.append(len(row))
+        self.overlaps.append(len(self.comparison_refs.intersection(cited_papers)))
+
+    def scores(self, metric="pearson"):
+        """Returns the similarity score of every row added so far against the comparison papers (numpy array)."""
+        row_sums = np.array(self.row_sums, dtype=np.float64)
+        return bffxn.scores_from_counts(row_sums, row_sums, self.overlaps, self.comparison_sum, self.comparison_sum, len(self.papers), metric)
+
+    def top_biologists(self, top_k, metric="pearson"):
+        """Returns the set of the top_k highest scoring biologists so far."""
+        scores = np.nan_to_num(self.scores(metric), nan=-np.inf)
+        top_rows = np.argsort(-scores, kind="stable")[:top_k]
+        return {self.biologists[row] for row in top_rows}
+
+    def comparison_columns(self):
+        """Returns the papers cited by the originating set of papers that have a column so far (list) and the number of columns (int), as biologyfinder_lsh.approximate_similarity_scores_df takes them."""
+        return [paper for paper in self.comparison_refs if paper in self.paper_index], len(self.papers)
+
+    def to_citation_matrix(self):
+        """Returns a CitationMatrix of the rows so far with the comparison vector as the last row, labeled "comparison"."""
+        comparison_row = bffxn.create_binary_row(self.comparison_refs, self.paper_index)
+        matrix = bffxn.create_binary_matrix(self.rows + [comparison_row], len(self.papers))
+        return bffxn.CitationMatrix(matrix, self.biologists + ["comparison"], list(self.papers))
+
+
+def iter_master_biologists(paper_list, logger, chunk_size=200, author_index=None):
+    """Yields the biologists of the master list as soon as the authors of each chunk of referenced or citing papers are known.  Names go through an author identity index, so a biologist is only yielded the first time they are seen under any spelling of their name.  The new identities of a chunk are labeled once every record of the chunk is in, but a fuller spelling or a same-name person found in a later chunk can still change the label the complete master list gives them, see relabel_biologists.
+
+    Arguments:
+    paper_list - list; paper IDs (str)
+    chunk_size (optional) - int; number of papers whose authors are fetched per request
+    author_index (optional) - biologyfinder_authors.AuthorIdentityIndex; index the authors are added to, e.g. to relabel the biologists once the master list is complete
+
+    Returns:
+    generator of str; biologist names formatted "lastname, firstname", with the institution in parentheses for people sharing a name
+    """
+    ref_citedin_ids = bffxn.compile_refs_and_citedin(paper_list, logger)
+    if author_index is None:
+        author_index = bfauthors.AuthorIdentityIndex()
+    for chunk in bffxn.split_into_chunks(ref_citedin_ids, chunk_size):
+        author_records = bffxn.get_author_records_bulk(chunk, logger, chunk_size)
+        known = len(author_index.identities)
+        for paper, record in author_records.items():
+            author_index.add_record(paper, record["authors"], record["affiliations"])
+        for identity_id in range(known, len(author_index.identities)):
+            yield author_index.label(identity_id)
+
+
+def relabel_biologists(author_index, biologist_paper_dict, biologist_cited_papers_dict, logger, max_workers=None):
+    """Gives the streamed biologists the labels of the complete author identity index, the same as create_master_biologist_list gives them.  Biologists whose search name or institution changed with their label are looked up again under the new label, the others are only renamed.
+
+    Arguments:
+    author_index - biologyfinder_authors.AuthorIdentityIndex; index the streamed labels were given out by
+    biologist_paper_dict - dict; keys are streamed biologist labels (str) and the values are lists of the IDs of the papers they authored
+    biologist_cited_papers_dict - dict; keys are streamed biologist labels (str) and the values are lists of the IDs of the papers they cited
+    max_workers (optional) - int; number of biologists looked up at once
+
+    Returns:
+    biologist_paper_dict - dict; the same keyed by the final labels
+    biologist_cited_papers_dict - dict; the same keyed by the final labels
+    looked_up_again - list; final labels (str) of the biologists looked up again
+    """
+    identity_ids = {biologist: author_index.labels[biologist] for biologist in biologist_paper_dict}
+    author_index.biologist_list()
+    final_labels = {biologist: author_index.identities[identity_id].label for biologist, identity_id in identity_ids.items()}
+    looked_up_again = [final_labels[biologist] for biologist in biologist_paper_dict if bfauthors.split_biologist_label(final_labels[biologist]) != bfauthors.split_biologist_label(biologist)]
+    biologist_paper_dict = {final_labels[biologist]: papers for biologist, papers in biologist_paper_dict.items()}
+    biologist_cited_papers_dict = {final_labels[biologist]: cited_papers for biologist, cited_papers in biologist_cited_papers_dict.items()}
+    if looked_up_again:
+        logger.info("Looking up {} biologists again under the name or institution the complete master list gives them.".format(len(looked_up_again)))
+        for biologist, papers, cited_papers in iter_biologist_refs(looked_up_again, logger, max_workers):
+            biologist_paper_dict[biologist] = papers
+            biologist_cited_papers_dict[biologist] = cited_papers
+    return biologist_paper_dict, biologist_cited_papers_dict, looked_up_again
+
+
+def iter_biologist_refs(biologists, logger, max_workers=None):
+    """Looks up the papers and then the references of every biologist in a thread pool, taking biologists from the (possibly still running) generator and yielding each one as soon as their lookups finish.  References of papers shared between biologists are only fetched once.
+
+    Arguments:
+    biologists - iterable of str; biologist names
+    max_workers (optional) - int; number of biologists looked up at once, defaults to the allowed requests per second
+
+    Returns:
+    generator of tuples; (biologist name (str), paper IDs (list), cited paper IDs (list)) in the order the lookups finish
+    """
+    paper_refs_dict = {}
+    lock = threading.Lock()
+
+    def lookup(biologist):
+        logger.info("Looking up papers authored by {}.".format(biologist))
+        papers = bffxn.get_author_papers(biologist)
+        with lock:
+            missing = [paper for paper in papers if paper not in paper_refs_dict]
+        fetched = bffxn.get_refs_bulk(missing, logger)
+        with lock:
+            paper_refs_dict.update(fetched)
+            return biologist, papers, bffxn.compile_refs(papers, paper_refs_dict)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or int(bfscheduler.allowed_rate()))
+    pending = set()
+    try:
+        for biologist in biologists:
+            pending.add(executor.submit(lookup, biologist))
+            for future in [future for future in pending if future.done()]:
+                pending.discard(future)
+                yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+@bfmetrics.timed
+def run_pipeline(paper_list, logger, metric="pearson", top_k=None, patience=25, max_workers=None, build_matrix=True):
+    """Runs the master list, paper lookup, reference lookup and matrix building stages as one stream.  Once the stream ends, the biologists are relabeled as in the batch master list, see relabel_biologists.  With top_k set, the run stops early once the top_k most similar biologists have not changed for patience consecutive biologists.  Without build_matrix the sparse matrix is not assembled, e.g. for the approximate search, which only reads the cited papers of each biologist and the counts kept by the IncrementalCitationMatrix.
+
+    Arguments:
+    paper_list - list; paper IDs (str) of the originating set of papers
+    metric (optional) - str; similarity metric used for the early exit check
+    top_k (optional) - int; number of most similar biologists that must be stable before stopping early, None runs to completion
+    patience (optional) - int; number of consecutive biologists that must leave the top_k unchanged
+    max_workers (optional) - int; number of biologists looked up at once
+    build_matrix (optional) - bool; assemble the CitationMatrix, the IncrementalCitationMatrix is returned in its place if False
+
+    Returns:
+    biologist_finder - CitationMatrix; biologists as rows and cited papers as columns, the last row is the comparison vector (IncrementalCitationMatrix without build_matrix)
+    biologist_paper_dict - dict; keys are biologist names (str) and the values are lists of the IDs of the papers they authored
+    biologist_cited_papers_dict - dict; keys are biologist names (str) and the values are lists of the IDs of the papers they cited
+    """
+    comparison_refs = bffxn.get_and_compile_refs(paper_list, logger)
+    incremental_matrix = IncrementalCitationMatrix(comparison_refs)
+    biologist_paper_dict = {}
+    biologist_cited_papers_dict = {}
+    top_biologists = None
+    unchanged = 0
+    author_index = bfauthors.AuthorIdentityIndex()
+    biologist_stream = iter_biologist_refs(iter_master_biologists(paper_list, logger, author_index=author_index), logger, max_workers)
+    try:
+        for biologist, papers, cited_papers in biologist_stream:
+            biologist_paper_dict[biologist] = papers
+            biologist_cited_papers_dict[biologist] = cited_papers
+            incremental_matrix.add_biologist(biologist, cited_papers)
+            if top_k is None:
+                continue
+            current_top = incremental_matrix.top_biologists(top_k, metric)
+            unchanged = unchanged + 1 if current_top == top_biologists else 0
+            top_biologists = current_top
+            if len(incremental_matrix.biologists) >= top_k and unchanged >= patience:
+                logger.info("The top {} biologists were stable for {} biologists, stopping after {} biologists.".format(top_k, patience, len(incremental_matrix.biologists)))
+                break
+    finally:
+        biologist_stream.close()
+    biologist_paper_dict, biologist_cited_papers_dict, looked_up_again = relabel_biologists(author_index, biologist_paper_dict, biologist_cited_papers_dict, logger, max_workers)
+    if looked_up_again:
+        incremental_matrix = IncrementalCitationMatrix(comparison_refs)
+        for biologist, cited_papers in biologist_cited_papers_dict.items():
+            incremental_matrix.add_biologist(biologist, cited_papers)
+    else:
+        incremental_matrix.biologists = list(biologist_cited_papers_dict)
+    if not build_matrix:
+        return incremental_matrix, biologist_paper_dict, biologist_cited_papers_dict
+    return incremental_matrix.to_citation_matrix(), biologist_paper_dict, biologist_cited_papers_dict
@@ -0,0 +1,229 @@
+'''
+Rate-limited scheduler for the NCBI E-utilities requests made by BiologyFinder.  Every request waits for a token from a shared token bucket (3 requests per second without an API key, 10 with Entrez.api_key), is retried with jittered exponential backoff on HTTP 429/5xx and network errors, and independent requests can be run concurrently up to the allowed rate.
+'''
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from Bio import Entrez
+import biologyfinder_metrics as bfmetrics
+
+
+DEFAULT_BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+CGI_NAMES = {"esearch": "esearch.fcgi", "efetch": "efetch.fcgi", "epost": "epost.fcgi", "elink": "elink.fcgi", "esummary": "esummary.fcgi"}
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Thread-safe token bucket.  acquire() blocks until a token is available.
+
+    Arguments:
+    rate - float; tokens added per second
+    capacity (optional) - float; largest burst allowed, defaults to one second worth of tokens
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _Settings:
+    base_url = DEFAULT_BASE_URL
+    max_workers = None
+    max_tries = 5
+    backoff = 0.5
+    timeout = 120
+    rate = None
+    bucket = None
+    bucket_lock = threading.Lock()
+
+
+def configure_scheduler(base_url=DEFAULT_BASE_URL, max_workers=None, max_tries=5, backoff=0.5, timeout=120, rate=None):
+    """Sets up the scheduler used for every E-utilities request.
+
+    Arguments:
+    base_url (optional) - str; E-utilities base URL, point it at a local fake server for tests
+    max_workers (optional) - int; number of concurrent requests, defaults to the allowed requests per second
+    max_tries (optional) - int; attempts per request before the error is raised
+    backoff (optional) - float; seconds of the first retry delay, doubled on every further attempt
+    timeout (optional) - float; seconds before a request is abandoned
+    rate (optional) - float; requests per second, defaults to 10 with Entrez.api_key and 3 without
+
+    Returns:
+    None
+    """
+    _Settings.base_url = base_url if base_url.endswith("/") else base_url + "/"
+    _Settings.max_workers = max_workers
+    _Settings.max_tries = max_tries
+    _Settings.backoff = backoff
+    _Settings.timeout = timeout
+    _Settings.rate = rate
+    _Settings.bucket = None
+
+
+def allowed_rate():
+    """Returns the number of requests per second NCBI allows for the current credentials."""
+    if _Settings.rate is not None:
+        return _Settings.rate
+    return 10 if Entrez.api_key else 3
+
+
+def _bucket():
+    # Created lazily since Entrez.api_key is usually set after this module is imported
+    with _Settings.bucket_lock:
+        if _Settings.bucket is None or _Settings.bucket.rate != allowed_rate():
+            _Settings.bucket = TokenBucket(allowed_rate())
+        return _Settings.bucket
+
+
+def build_request(endpoint, params):
+    """Builds the HTTP request for an E-utility.  Lists of IDs are joined with commas except for elink, where each ID is sent as its own "id" parameter so the links stay separated by source paper.
+
+    Arguments:
+    endpoint - str; E-utility name ("esearch", "efetch", "epost" or "elink")
+    params - dict; keyword arguments of the request as they would be passed to Bio.Entrez
+
+    Returns:
+    request - urllib.request.Request; POST when the encoded parameters are long
+    """
+    query = {}
+    for name, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = [str(item) for item in value]
+            if endpoint != "elink":
+                value = ",".join(value)
+        query[name] = value
+    query.setdefault("tool", Entrez.tool)
+    if Entrez.email:
+        query.setdefault("email", Entrez.email)
+    if Entrez.api_key:
+        query.setdefault("api_key", Entrez.api_key)
+    url = _Settings.base_url + CGI_NAMES[endpoint]
+    encoded = urlencode(query, doseq=True)
+    if len(encoded) > 1000:
+        return Request(url, data=encoded.encode("utf-8"), method="POST")
+    return Request(url + "?" + encoded, method="GET")
+
+
+class ResponseStream:
+    """Binary file-like view of an E-utilities response that is read from the connection as it arrives.  The request is recorded in the metrics (time until the end of the body and bytes read) once the body has been read to the end or the stream is closed.
+
+    Arguments:
+    handle - http.client.HTTPResponse; open response
+    endpoint - str; E-utility name
+    start - float; time.perf_counter() when the request was sent
+    retries - int; number of failed attempts before this one
+    """
+
+    def __init__(self, handle, endpoint, start, retries=0):
+        self._handle = handle
+        self.endpoint = endpoint
+        self._start = start
+        self._retries = retries
+        self.bytes_read = 0
+        self._recorded = False
+
+    def read(self, size=-1):
+        if size == 0:
+            return b""
+        data = self._handle.read(size)
+        self.bytes_read += len(data)
+        if size is None or size < 0 or not data:
+            self._record()
+        return data
+
+    def _record(self):
+        if not self._recorded:
+            self._recorded = True
+            bfmetrics.record_request(self.endpoint, time.perf_counter() - self._start, self.bytes_read, self._retries)
+
+    def close(self):
+        self._record()
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_stream(endpoint, params):
+    """Sends an E-utilities request once a rate-limit token is available and returns the response without reading it, so it can be parsed as it arrives.  Failures to connect and HTTP 429/5xx answers are retried; an error while the body is being read is raised to the reader.
+
+    Arguments:
+    endpoint - str; E-utility name ("esearch", "efetch", "epost" or "elink")
+    params - dict; keyword arguments of the request as they would be passed to Bio.Entrez
+
+    Returns:
+    stream - ResponseStream; binary handle to the response body, to be closed by the caller
+    """
+    http_request = build_request(endpoint, params)
+    for attempt in range(_Settings.max_tries):
+        _bucket().acquire()
+        start = time.perf_counter()
+        try:
+            return ResponseStream(urlopen(http_request, timeout=_Settings.timeout), endpoint, start, attempt)
+        except HTTPError as err:
+            if err.code not in RETRY_STATUS_CODES or attempt == _Settings.max_tries - 1:
+                bfmetrics.record_error(endpoint, attempt)
+                raise
+        except URLError:
+            if attempt == _Settings.max_tries - 1:
+                bfmetrics.record_error(endpoint, attempt)
+                raise
+        time.sleep(_Settings.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def request(endpoint, params):
+    """Sends an E-utilities request once a rate-limit token is available, retries transient failures and reads the whole response.
+
+    Arguments:
+    endpoint - str; E-utility name ("esearch", "efetch", "epost" or "elink")
+    params - dict; keyword arguments of the request as they would be passed to Bio.Entrez
+
+    Returns:
+    body - bytes; response body
+    """
+    with open_stream(endpoint, params) as stream:
+        return stream.read()
+
+
+def map_concurrent(func, items, max_workers=None):
+    """Calls func on every item with as many requests in flight as the rate limit allows.  The token bucket keeps the combined request rate within NCBI's limit.
+
+    Arguments:
+    func - function; called with one item at a time
+    items - iterable; arguments for func
+    max_workers (optional) - int; number of threads, defaults to the configured max_workers or the allowed requests per second
+
+    Returns:
+    results - list; return value of func for each item, in the order of items
+    """
+    items = list(items)
+    if max_workers is None:
+        max_workers = _Settings.max_workers or int(allowed_rate())
+    if len(items) <= 1 or max_workers <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, items))
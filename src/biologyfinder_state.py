@@ -0,0 +1,327 @@
+'''
+Resumable run state for BiologyFinder.  Each stage of a run (master list, biologist to papers map, paper to references map and the interned paper feature index) is checkpointed to disk as it progresses, so a crashed or interrupted run picks up where it stopped and a run whose seed papers change only fetches the new biologists and papers.  A finished run keeps its citation matrix and the date of its last sync with PubMed, so refresh_run can later fetch only what PubMed added since then.
+'''
+import json
+import os
+import time
+import numpy as np
+import biologyfinder_fxn as bffxn
+import biologyfinder_scheduler as bfscheduler
+import biologyfinder_storage as bfstorage
+import biologyfinder_metrics as bfmetrics
+
+
+DEFAULT_RUNS_DIR = "BiologyFinder_runs"
+# Stage name to the attribute of RunState holding its data
+STAGES = {
+    "seed_papers": "seed_papers",
+    "paper_authors": "paper_authors",
+    "master_list": "master_list",
+    "biologist_papers": "biologist_paper_dict",
+    "paper_refs": "paper_refs_dict",
+    "feature_index": "paper_features",
+    "sync": "sync",
+}
+# Date format of the mindate and maxdate E-utilities parameters
+SYNC_DATE_FORMAT = "%Y/%m/%d"
+
+
+def new_run_id():
+    """Returns a run ID (str) based on the current time."""
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+def today():
+    """Returns today's date (str) in the format of the E-utilities date parameters."""
+    return time.strftime(SYNC_DATE_FORMAT)
+
+
+def list_runs(runs_dir=DEFAULT_RUNS_DIR):
+    """Returns the IDs (list of str) of the runs saved in runs_dir."""
+    if not os.path.isdir(runs_dir):
+        return []
+    return sorted(name for name in os.listdir(runs_dir) if os.path.isdir(os.path.join(runs_dir, name)))
+
+
+def write_json(path, data):
+    """Writes data as JSON through a temporary file so an interrupted write never leaves a half-written checkpoint."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as handle:
+        json.dump(data, handle)
+    os.replace(temp_path, path)
+
+
+class RunState:
+    """On-disk checkpoints of one BiologyFinder run.  Every stage is stored as a JSON file in runs_dir/run_id and loaded again when the same run_id is used.
+
+    Arguments:
+    run_id (optional) - str; ID of the run to resume, a new ID is made if not provided
+    runs_dir (optional) - str; directory holding all runs
+    """
+
+    def __init__(self, run_id=None, runs_dir=DEFAULT_RUNS_DIR):
+        self.run_id = run_id or new_run_id()
+        self.path = os.path.join(runs_dir, self.run_id)
+        os.makedirs(self.path, exist_ok=True)
+        self.seed_papers = []
+        self.paper_authors = {}
+        self.master_list = []
+        self.biologist_paper_dict = {}
+        self.paper_refs_dict = {}
+        self.paper_features = []
+        self.sync = {}
+        for stage, attribute in STAGES.items():
+            stage_path = os.path.join(self.path, stage + ".json")
+            if os.path.exists(stage_path):
+                with open(stage_path) as handle:
+                    setattr(self, attribute, json.load(handle))
+
+    @property
+    def matrix_path(self):
+        """Directory of the citation matrix saved at the end of the run."""
+        return os.path.join(self.path, "matrix")
+
+    def save(self, stage):
+        """Checkpoints one stage to disk."""
+        write_json(os.path.join(self.path, stage + ".json"), getattr(self, STAGES[stage]))
+
+
+def collect_author_records(state, ref_citedin_ids, logger, chunk_size=200):
+    """Returns the author records of papers, fetching only those that are not already in the run state.
+
+    Arguments:
+    state - RunState; run to update
+    ref_citedin_ids - list; paper IDs (str)
+
+    Returns:
+    author_records - dict; keys are paper IDs (str) and the values are the author records of create_author_index
+    """
+    missing = [paper for paper in ref_citedin_ids if paper not in state.paper_authors]
+    logger.info("Getting the authors of {} papers ({} already saved).".format(len(missing), len(ref_citedin_ids) - len(missing)))
+    for chunk in bffxn.split_into_chunks(missing, chunk_size):
+        found = bffxn.get_author_records_bulk(chunk, logger, chunk_size)
+        for paper in chunk:
+            state.paper_authors[paper] = found.get(paper, {"authors": [], "affiliations": []})
+        state.save("paper_authors")
+    author_records = {}
+    for paper in ref_citedin_ids:
+        record = state.paper_authors.get(paper, {"authors": [], "affiliations": []})
+        if isinstance(record, list):
+            # Checkpoints written before author records were kept only hold the first and last author
+            record = {"authors": record, "affiliations": []}
+        author_records[paper] = record
+    return author_records
+
+
+@bfmetrics.timed
+def update_master_list(state, paper_list, logger, chunk_size=200):
+    """Builds the master list of biologists for the seed papers, fetching authors only for referenced or citing papers that are not already in the run state.
+
+    Arguments:
+    state - RunState; run to update
+    paper_list - list; paper IDs (str) of the originating set of papers
+
+    Returns:
+    master_list - list; biologist names (str)
+    """
+    if state.master_list and state.seed_papers == list(paper_list):
+        logger.info("Resuming with the saved master list of {} biologists.".format(len(state.master_list)))
+        return state.master_list
+    ref_citedin_ids = bffxn.compile_refs_and_citedin(paper_list, logger)
+    author_records = collect_author_records(state, ref_citedin_ids, logger, chunk_size)
+    state.master_list = bffxn.create_author_index(author_records).biologist_list()
+    state.seed_papers = list(paper_list)
+    state.save("master_list")
+    state.save("seed_papers")
+    return state.master_list
+
+
+@bfmetrics.timed
+def update_biologist_papers(state, logger, checkpoint_every=50):
+    """Looks up the papers of every biologist on the master list who is not yet in the run state, checkpointing after every checkpoint_every biologists.
+
+    Arguments:
+    state - RunState; run to update
+
+    Returns:
+    biologist_paper_dict - dict; keys are the biologists on the master list (str) and the values are lists of the IDs of the papers they authored
+    """
+    missing = [biologist for biologist in state.master_list if biologist not in state.biologist_paper_dict]
+    logger.info("Looking up papers for {} biologists ({} already saved).".format(len(missing), len(state.master_list) - len(missing)))
+    for chunk in bffxn.split_into_chunks(missing, checkpoint_every):
+        state.biologist_paper_dict.update(bffxn.create_biologist_paper_dict(chunk, logger))
+        state.save("biologist_papers")
+    return {biologist: state.biologist_paper_dict[biologist] for biologist in state.master_list}
+
+
+@bfmetrics.timed
+def update_paper_refs(state, biologist_paper_dict, logger, checkpoint_every=1000):
+    """Looks up the references of every paper that is not yet in the run state, checkpointing after every checkpoint_every papers.
+
+    Arguments:
+    state - RunState; run to update
+    biologist_paper_dict - dict; keys are biologist names (str) and the values are lists of paper IDs
+
+    Returns:
+    paper_refs_dict - dict; keys are paper IDs (str) and the values are lists of the IDs of the papers they reference
+    """
+    all_papers = []
+    for value in biologist_paper_dict.values():
+        all_papers.extend(value)
+    missing = [paper for paper in dict.fromkeys(all_papers) if paper not in state.paper_refs_dict]
+    logger.info("Looking up the references of {} papers ({} already saved).".format(len(missing), len(set(all_papers)) - len(missing)))
+    for chunk in bffxn.split_into_chunks(missing, checkpoint_every):
+        state.paper_refs_dict.update(bffxn.get_refs_bulk(chunk, logger))
+        state.save("paper_refs")
+    return state.paper_refs_dict
+
+
+@bfmetrics.timed
+def update_feature_index(state, biologist_cited_papers_dict):
+    """Adds papers cited by the biologists that are new to the saved paper feature index.  Papers already in the index keep their column so an existing matrix only gains columns.
+
+    Arguments:
+    state - RunState; run to update
+    biologist_cited_papers_dict - dict; keys are biologist names (str) and the values are lists of cited paper IDs
+
+    Returns:
+    paper_features - list; paper IDs (str) in column order
+    """
+    known = set(state.paper_features)
+    for paper in bffxn.create_paper_features_list(biologist_cited_papers_dict):
+        if paper not in known:
+            known.add(paper)
+            state.paper_features.append(paper)
+    state.save("feature_index")
+    return state.paper_features
+
+
+@bfmetrics.timed
+def run_resumable(paper_list, logger, run_id=None, runs_dir=DEFAULT_RUNS_DIR):
+    """Runs the BiologyFinder data gathering stages with a checkpoint after each stage (and regularly within the long ones).  Using the run_id of an earlier run resumes it, and if the seed papers changed only the new biologists and papers are fetched and merged.
+
+    Arguments:
+    paper_list - list; paper IDs (str) of the originating set of papers
+    run_id (optional) - str; ID of the run to resume, a new run is started if not provided
+    runs_dir (optional) - str; directory holding all runs
+
+    Returns:
+    biologist_finder - CitationMatrix; biologists as rows and cited papers as columns, the last row is the comparison vector
+    state - RunState; the saved run
+    """
+    state = RunState(run_id, runs_dir)
+    logger.info("Run ID {} (checkpoints in {}).".format(state.run_id, state.path))
+    update_master_list(state, paper_list, logger)
+    biologist_paper_dict = update_biologist_papers(state, logger)
+    seed_missing = [paper for paper in paper_list if paper not in state.paper_refs_dict]
+    if seed_missing:
+        state.paper_refs_dict.update(bffxn.get_refs_bulk(seed_missing, logger))
+        state.save("paper_refs")
+    paper_refs_dict = update_paper_refs(state, biologist_paper_dict, logger)
+    biologist_cited_papers_dict = bffxn.create_biologist_cited_papers_dict(biologist_paper_dict, logger, paper_refs_dict)
+    paper_features = update_feature_index(state, biologist_cited_papers_dict)
+    # Papers only cited by biologists of an earlier seed set stay in the saved index but are left out of this matrix, so its scores match a fresh run
+    cited = set(bffxn.create_paper_features_list(biologist_cited_papers_dict))
+    active_papers = [paper for paper in paper_features if paper in cited]
+    paper_index = bffxn.create_paper_index(active_papers)
+    rows = [bffxn.create_binary_row(value, paper_index) for value in biologist_cited_papers_dict.values()]
+    rows.append(bffxn.create_binary_row(bffxn.compile_refs(paper_list, paper_refs_dict), paper_index))
+    matrix = bffxn.create_binary_matrix(rows, len(active_papers))
+    biologist_finder = bffxn.CitationMatrix(matrix, list(biologist_cited_papers_dict.keys()) + ["comparison"], active_papers)
+    bfstorage.save_citation_matrix(biologist_finder, state.matrix_path, paper_list)
+    if "last_sync" not in state.sync:
+        # Later seed set changes only add data fetched after the first sync, so it stays the start of the next refresh
+        state.sync["last_sync"] = today()
+        state.save("sync")
+    return biologist_finder, state
+
+
+@bfmetrics.timed
+def refresh_run(run_id, logger, runs_dir=DEFAULT_RUNS_DIR, until=None, datetype="edat"):
+    """Brings a finished run up to date with what PubMed added since its last sync instead of building it again.  New papers citing the seed papers are found with one date-limited elink and new papers of each biologist with one date-limited esearch, paged past retmax.  Only the new papers, the authors of new citing papers and the papers of biologists new to the master list are then looked up.  The new papers are merged into the saved biologist to papers and references data, and the citation matrix rows of biologists without new papers are copied from the saved matrix, so only the rows of affected biologists are rebuilt.
+
+    Arguments:
+    run_id - str; ID of a run finished by run_resumable
+    runs_dir (optional) - str; directory holding all runs
+    until (optional) - str; last day of the refresh as "YYYY/MM/DD", today if not provided
+    datetype (optional) - str; PubMed date the window applies to, "edat" for the date papers were added to PubMed, "pdat" for the publication date or "mdat" for the last modification
+
+    Returns:
+    biologist_finder - CitationMatrix; biologists as rows and cited papers as columns, the last row is the comparison vector
+    state - RunState; the saved run
+    changes - dict; the window ("since", "until"), the number of new papers, the new and removed biologists and the number of matrix rows rebuilt
+    """
+    state = RunState(run_id, runs_dir)
+    if not state.seed_papers or not state.master_list:
+        raise ValueError("Run {} has no master list to refresh, finish it with run_resumable first.".format(state.run_id))
+    paper_list = state.seed_papers
+    since = state.sync.get("last_sync") or time.strftime(SYNC_DATE_FORMAT, time.localtime(os.path.getmtime(os.path.join(state.path, "master_list.json"))))
+    until = until or today()
+    date_range = {"mindate": since, "maxdate": until, "datetype": datetype}
+    logger.info("Refreshing run {} with papers from {} to {} ({}).".format(state.run_id, since, until, datetype))
+
+    # New papers citing the seed papers can add biologists to the master list
+    new_citing = bffxn.compile_refs(paper_list, bffxn.get_links_bulk(paper_list, logger, 'pubmed_pubmed_citedin', **date_range))
+    previous_master_list = list(state.master_list)
+    if new_citing:
+        logger.info("{} new papers cite the seed papers.".format(len(new_citing)))
+        ref_citedin_ids = list(dict.fromkeys(bffxn.compile_refs_and_citedin(paper_list, logger) + new_citing))
+        state.master_list = bffxn.create_author_index(collect_author_records(state, ref_citedin_ids, logger)).biologist_list()
+        state.save("master_list")
+    master = set(state.master_list)
+    removed_biologists = [biologist for biologist in previous_master_list if biologist not in master]
+
+    # New papers of the biologists already in the run
+    known_biologists = [biologist for biologist in state.master_list if biologist in state.biologist_paper_dict]
+    logger.info("Looking for new papers of {} biologists.".format(len(known_biologists)))
+    found = bfscheduler.map_concurrent(lambda biologist: bffxn.get_author_papers(biologist, **date_range), known_biologists)
+    changed = set()
+    num_new_papers = 0
+    for biologist, papers in zip(known_biologists, found):
+        known = set(state.biologist_paper_dict[biologist])
+        new_papers = [paper for paper in papers if paper not in known]
+        if new_papers:
+            state.biologist_paper_dict[biologist] = new_papers + state.biologist_paper_dict[biologist]
+            changed.add(biologist)
+            num_new_papers += len(new_papers)
+    state.save("biologist_papers")
+    new_biologists = [biologist for biologist in state.master_list if biologist not in state.biologist_paper_dict]
+    logger.info("Found {} new papers of {} biologists and {} new biologists.".format(num_new_papers, len(changed), len(new_biologists)))
+    biologist_paper_dict = update_biologist_papers(state, logger)
+    paper_refs_dict = update_paper_refs(state, biologist_paper_dict, logger)
+
+    # Rows of biologists without new papers are copied from the saved matrix
+    previous = bfstorage.load_citation_matrix(state.matrix_path, mmap=False) if os.path.isdir(state.matrix_path) else None
+    previous_rows = {} if previous is None else {biologist: row for row, biologist in enumerate(previous.biologists[:-1])}
+    affected = {biologist: biologist_paper_dict[biologist] for biologist in state.master_list if biologist in changed or biologist not in previous_rows}
+    biologist_cited_papers_dict = bffxn.create_biologist_cited_papers_dict(affected, logger, paper_refs_dict)
+    update_feature_index(state, biologist_cited_papers_dict)
+    papers = list(previous.papers) if previous is not None else []
+    known_papers = set(papers)
+    for paper in bffxn.create_paper_features_list(biologist_cited_papers_dict):
+        if paper not in known_papers:
+            known_papers.add(paper)
+            papers.append(paper)
+    paper_index = bffxn.create_paper_index(papers)
+    rows = []
+    for biologist in state.master_list:
+        if biologist in biologist_cited_papers_dict:
+            rows.append(bffxn.create_binary_row(biologist_cited_papers_dict[biologist], paper_index))
+        else:
+            row = previous_rows[biologist]
+            rows.append(np.asarray(previous.matrix.indices[previous.matrix.indptr[row]:previous.matrix.indptr[row + 1]], dtype=np.int32))
+    rows.append(bffxn.create_binary_row(bffxn.compile_refs(paper_list, paper_refs_dict), paper_index))
+    matrix = bffxn.create_binary_matrix(rows, len(papers))
+    # Papers only cited by biologists who left the master list are dropped, so scores match a fresh run
+    cited_columns = np.flatnonzero(np.bincount(matrix[:-1].indices, minlength=len(papers)))
+    if len(cited_columns) < len(papers):
+        matrix = matrix[:, cited_columns]
+        papers = [papers[column] for column in cited_columns]
+    biologist_finder = bffxn.CitationMatrix(matrix, list(state.master_list) + ["comparison"], papers)
+    bfstorage.save_citation_matrix(biologist_finder, state.matrix_path, paper_list)
+    changes = {"since": since, "until": until, "new_papers": num_new_papers, "new_biologists": new_biologists, "removed_biologists": removed_biologists, "rows_rebuilt": len(affected)}
+    state.sync["last_sync"] = until
+    state.sync.setdefault("refreshes", []).append(dict(changes, new_biologists=len(new_biologists), removed_biologists=len(removed_biologists)))
+    state.save("sync")
+    logger.info("Rebuilt {} of {} matrix rows.".format(len(affected), len(state.master_list)))
+    return biologist_finder, state, changes
@@ -0,0 +1,176 @@
+'''
+Compact binary storage for BiologyFinder data.  Arrays are written as .npy files that can be memory-mapped, paper IDs are stored as uint32 PMIDs and names as a UTF-8 string table.  A saved citation matrix can be loaded and rescored in milliseconds without fetching anything from PubMed.
+'''
+import json
+import os
+import uuid
+import numpy as np
+from scipy import sparse
+import biologyfinder_fxn as bffxn
+
+
+# Version of the layout written by save_citation_matrix
+FORMAT_VERSION = 1
+
+
+def save_array(path, array):
+    """Saves a numpy array as a .npy file through a temporary file so readers never see a partial file."""
+    temp_path = path + ".tmp.npy"
+    np.save(temp_path, array)
+    os.replace(temp_path, path)
+
+
+def load_array(path, dtype, mmap=True):
+    """Loads a .npy file, memory-mapped by default.  Returns an empty array of dtype if the file does not exist."""
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=dtype)
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+def array_set_path(prefix, generation, name):
+    """Returns the .npy file of one array of a generation of an array set, see save_array_set."""
+    return "{}.{}_{}.npy".format(prefix, generation, name)
+
+
+def read_generation(prefix):
+    """Returns the current generation (str) of an array set or None if it was never saved with save_array_set."""
+    try:
+        with open(prefix + "_generation") as handle:
+            return handle.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def save_array_set(prefix, arrays):
+    """Saves numpy arrays that are only valid together, such as the parts of a CSR matrix, so readers see either all the old or all the new arrays even if the writer crashes or another process saves the same set at the same time.  The arrays are written under a new generation name, then the generation file (prefix + "_generation") is atomically replaced to point at them and the files of the previous generation are removed.  Readers that memory-mapped those keep their data.
+
+    Arguments:
+    prefix - str; path and name of the array set
+    arrays - dict; names (str) to numpy arrays
+    """
+    generation = uuid.uuid4().hex
+    for name, array in arrays.items():
+        np.save(array_set_path(prefix, generation, name), array)
+    previous = read_generation(prefix)
+    temp_path = "{}_generation.{}.tmp".format(prefix, generation)
+    with open(temp_path, "w") as handle:
+        handle.write(generation)
+    os.replace(temp_path, prefix + "_generation")
+    # Files written before array sets had generations are only read while there is no generation file
+    old_paths = [array_set_path(prefix, previous, name) if previous is not None else "{}_{}.npy".format(prefix, name) for name in arrays]
+    for old_path in old_paths:
+        try:
+            os.remove(old_path)
+        except FileNotFoundError:
+            pass
+
+
+def load_array_set(prefix, dtypes, mmap=True):
+    """Loads the current generation of an array set saved with save_array_set, memory-mapped by default.  A set saved before generations were kept is read from prefix + "_" + name + ".npy" and arrays that do not exist are empty.
+
+    Arguments:
+    prefix - str; path and name of the array set
+    dtypes - dict; names (str) of the arrays to the dtype of an empty array
+
+    Returns:
+    arrays - dict; names (str) to numpy arrays
+    """
+    for attempt in range(3):
+        generation = read_generation(prefix)
+        if generation is None:
+            return {name: load_array("{}_{}.npy".format(prefix, name), dtype, mmap) for name, dtype in dtypes.items()}
+        try:
+            return {name: np.load(array_set_path(prefix, generation, name), mmap_mode="r" if mmap else None) for name in dtypes}
+        except FileNotFoundError:
+            # Another process saved a newer generation and removed this one while it was being read
+            if attempt == 2:
+                raise
+
+
+def encode_string_table(strings):
+    """Encodes a list of strings as one UTF-8 byte array and the offsets of each string (numpy arrays)."""
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) for item in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def decode_string_table(data, offsets):
+    """Decodes the list of strings encoded by encode_string_table."""
+    raw = np.asarray(data).tobytes()
+    return [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(max(len(offsets) - 1, 0))]
+
+
+def save_string_table(path, strings):
+    """Saves a list of strings as one UTF-8 byte array (path + "_data.npy") and the offsets of each string (path + "_offsets.npy")."""
+    data, offsets = encode_string_table(strings)
+    save_array(path + "_data.npy", data)
+    save_array(path + "_offsets.npy", offsets)
+
+
+def load_string_table(path):
+    """Loads a list of strings saved with save_string_table.  Returns an empty list if it does not exist."""
+    return decode_string_table(load_array(path + "_data.npy", np.uint8, mmap=False), load_array(path + "_offsets.npy", np.int64, mmap=False))
+
+
+def save_citation_matrix(biologist_finder, path, seed_pmids=None):
+    """Saves a CitationMatrix to a directory: the CSR arrays of the matrix, the paper feature index as uint32 PMIDs, the biologist names as a string table and, for a pruned matrix, the unpruned row sums.  Shape and other details go in meta.json.
+
+    Arguments:
+    biologist_finder - CitationMatrix; the last row is the comparison vector
+    path - str; directory to write, created if needed
+    seed_pmids (optional) - list; paper IDs (str) of the originating set of papers, kept with the matrix
+
+    Returns:
+    path - str; directory written
+    """
+    os.makedirs(path, exist_ok=True)
+    matrix = sparse.csr_matrix(biologist_finder.matrix)
+    matrix.sort_indices()
+    save_array(os.path.join(path, "data.npy"), matrix.data)
+    save_array(os.path.join(path, "indices.npy"), matrix.indices)
+    save_array(os.path.join(path, "indptr.npy"), matrix.indptr)
+    save_array(os.path.join(path, "papers.npy"), np.asarray([int(paper) for paper in biologist_finder.papers], dtype=np.uint32))
+    save_string_table(os.path.join(path, "biologists"), biologist_finder.biologists)
+    if biologist_finder.row_sums is not None:
+        save_array(os.path.join(path, "row_sums.npy"), np.asarray(biologist_finder.row_sums))
+    meta = {
+        "version": FORMAT_VERSION,
+        "shape": list(matrix.shape),
+        "num_papers": biologist_finder.num_papers,
+        "seed_pmids": list(seed_pmids) if seed_pmids else None,
+    }
+    temp_path = os.path.join(path, "meta.json.tmp")
+    with open(temp_path, "w") as handle:
+        json.dump(meta, handle)
+    os.replace(temp_path, os.path.join(path, "meta.json"))
+    return path
+
+
+def load_citation_meta(path):
+    """Returns the details (dict) saved in meta.json with a citation matrix."""
+    with open(os.path.join(path, "meta.json")) as handle:
+        meta = json.load(handle)
+    if meta.get("version") != FORMAT_VERSION:
+        raise ValueError("{} was saved in storage format {}, this version reads format {}.".format(path, meta.get("version"), FORMAT_VERSION))
+    return meta
+
+
+def load_citation_matrix(path, mmap=True):
+    """Loads a CitationMatrix saved with save_citation_matrix.  With mmap, the CSR arrays are memory-mapped rather than read, so only the parts used for scoring are paged in.
+
+    Arguments:
+    path - str; directory written by save_citation_matrix
+    mmap (optional) - bool; memory-map the arrays instead of reading them
+
+    Returns:
+    biologist_finder - CitationMatrix; the last row is the comparison vector
+    """
+    meta = load_citation_meta(path)
+    arrays = [load_array(os.path.join(path, name + ".npy"), None, mmap) for name in ("data", "indices", "indptr")]
+    matrix = sparse.csr_matrix(tuple(arrays), shape=tuple(meta["shape"]), copy=False)
+    papers = load_array(os.path.join(path, "papers.npy"), np.uint32, mmap).astype(str).tolist()
+    biologists = load_string_table(os.path.join(path, "biologists"))
+    row_sums_path = os.path.join(path, "row_sums.npy")
+    row_sums = load_array(row_sums_path, None, mmap) if os.path.exists(row_sums_path) else None
+    return bffxn.CitationMatrix(matrix, biologists, papers, row_sums, meta["num_papers"])
@@ -5,10 +5,22 @@ import numpy as np
 import pandas as pd
 from Bio import Entrez
 from Bio import Medline
-from sklearn.metrics import jaccard_similarity_score
-from scipy.stats import pearsonr
 import biologyfinder_fxn as bffxn
+import biologyfinder_cache as bfcache
+import biologyfinder_graph as bfgraph
+import biologyfinder_pipeline as bfpipeline
+import biologyfinder_state as bfstate
+import biologyfinder_cli as bfcli
+import biologyfinder_lsh as bflsh
+import biologyfinder_storage as bfstorage
+import biologyfinder_metrics as bfmetrics
+import biologyfinder_pagerank as bfpagerank
 import logging
+import sys
+
+# With command line arguments, runs the non-interactive interface instead, e.g. python main.py run --pmids 30150312 29146775 28202734
+if len(sys.argv) > 1:
+    sys.exit(bfcli.main(sys.argv[1:]))
 
 # Set up logging
 # Create custom logger
@@ -36,12 +48,58 @@ logger.info("As this script runs, it will print status updates and key analysis
 Entrez.email = ""
 Entrez.api_key = ""
 
+# Caches PubMed responses on disk so repeated runs do not repeat the same requests.  Set offline_mode to True to answer only from the cache.
+offline_mode = False
+bfcache.configure_cache("BiologyFinder_cache.sqlite", offline=offline_mode)
+
+# Keeps every fetched reference, cited-by and author link in a local citation graph shared by all runs, so overlapping queries are answered from disk
+bfgraph.configure_graph_store("BiologyFinder_graph")
+
+# Records stage timings, request counts and latencies per endpoint, cache hits, peak memory and matrix sizes.  A summary table is logged at the end of the run and the details are saved to BiologyFinder_metrics.json, with a trace for chrome://tracing in BiologyFinder_metrics.trace.json.  Set to False to turn off.
+collect_metrics = True
+if collect_metrics:
+    bfmetrics.configure_metrics()
+
+# Similarity metric used to compare biologists: "pearson", "jaccard", "cosine" or "tanimoto"
+similarity_metric = "pearson"
+
+# How biologists and reading list papers are ranked: "similarity" compares each biologist's citation vector with the original papers' using similarity_metric, "pagerank" ranks biologists and papers with personalized PageRank on the co-citation graphs, restarting at the papers cited by the original papers.  The approximate search always uses similarity.
+scoring_engine = "similarity"
+
+# Runs the master list, paper lookup and reference lookup stages as one stream instead of one phase after another.  Set early_exit_top_k to a number of biologists to stop once that many most similar biologists are stable.
+streaming_pipeline = True
+early_exit_top_k = None
+
+# How citations are weighted when ranking the reading list: "count" (number of similar biologists citing a paper), "similarity" (each citation weighted by the citing biologist's similarity score) or "recency" (older papers weighted down, halving every 10 years)
+reading_list_weighting = "count"
+
+# Saves the citation matrix, biologist list and paper feature index in a compact binary format so the run can be rescored later without fetching anything (python main.py rescore BiologyFinder_matrix).  Set to None to skip.
+matrix_output_path = "BiologyFinder_matrix"
+
+# For very large master lists, scores only the candidate biologists found by a MinHash/LSH index of everyone's cited papers, queried by the share of the selected papers' references each biologist cites (containment).  The index is saved to minhash_index_path and reused by later runs.  The full citation matrix is not built or saved in this mode unless report_lsh_recall or additional_seed_sets need it.  With report_lsh_recall, the exact scores are computed too and the share of the exact top 20% found is reported.
+approximate_search = False
+minhash_index_path = "BiologyFinder_minhash.npz"
+report_lsh_recall = False
+
+# Drops paper columns cited by fewer than prune_min_df biologists (and by more than prune_max_df, if set: a whole number of biologists or a fraction such as 0.5) before scoring, e.g. 2 for very large matrices.  Papers cited by the selected papers are always kept, so the similarity engine's scores of the biologists do not change, but the reading list, its citation counts report and the pagerank engine only see the papers that are kept.  None scores the full matrix.
+prune_min_df = None
+prune_max_df = None
+
+# Additional sets of seed papers, e.g. one per student project in the lab, scored against the same citation matrix in one pass after the main analysis.  Each set gets its own ranking of biologists and reading list.  Example: {"spindle project": ["30150312"], "root project": ["29146775", "28202734"]}
+additional_seed_sets = {}
+
+# Checkpoints every stage of the run in BiologyFinder_runs so an interrupted run can be resumed and a run with changed papers only fetches what is new.  Set run_id to "new" to start a checkpointed run or to the ID of an earlier run to resume it.  A checkpointed run can later be brought up to date with only the papers added to PubMed since it was last synced, e.g. nightly, with python main.py refresh RUN_ID.
+run_id = None
+
+# The approximate search only reads each biologist's cited papers, so the full matrix is only assembled when something else scores it
+build_full_matrix = not approximate_search or report_lsh_recall or bool(additional_seed_sets)
+
 # Obtains name and affiliation of the biologist of interest
 name, affiliation = bffxn.user_entered_info()
 logger.info("This run of BiologyFinder will identify biologists who do work similar to {} and provide a recommended reading list for papers relevant to {}'s subfield.\n ".format(name, name))
 
-# Retrieves papers authored by the biologist of interest
-id_list, webenv, query_key = bffxn.get_scientist_papers(name, affiliation)
+# Retrieves the 200 most recent papers authored by the biologist of interest
+id_list, webenv, query_key = bffxn.get_scientist_papers(name, affiliation, max_results=200)
 
 # User specifies up to 3 papers authored by the biologist of interest on which to base this BiologyFinder session
 chosen_papers = bffxn.user_selected_papers(id_list, webenv, query_key)
@@ -49,40 +107,103 @@ logger.info("The BiologyFinder analysis will be based on the following papers: \
 bffxn.get_citations(chosen_papers, logger)
 logger.info("\n")
 
-# Creates master list of biologists from the first and last authors of papers referenced by the selected papers or cited by the selected papers
-master_biologist_list = bffxn.create_master_biologist_list(chosen_papers, logger)
-logger.info("\n")
-logger.info("The master list contains {} biologists.\n".format(len(master_biologist_list)))
-
-# Stores the papers authored by each of the biologists on the master list
-logger.info("\n")
-the_biologist_paper_dict = bffxn.create_biologist_paper_dict(master_biologist_list, logger)
-logger.info("\n")
-
-# Stores all the papers referenced by each of the biologists on the master list
-the_biologist_cited_papers_dict = bffxn.create_biologist_cited_papers_dict(the_biologist_paper_dict, logger)
-
-# Assembles every paper referenced by any of the biologists into one list
-the_paper_features_list = bffxn.create_paper_features_list(the_biologist_cited_papers_dict)
-logger.info("\n")
-logger.info("The paper features list contains {} papers. \n".format(len(the_paper_features_list)))
-
-# Creates binary vectors for each biologist indicating if they reference or do not reference each paper in the_paper_features_list
-logger.info("Creating binary feature vectors for each biologist.\n")
-the_binary_feature_vectors = bffxn.create_binary_feature_vectors(the_biologist_cited_papers_dict, the_paper_features_list)
-
-# Creates a binary vector indicating if the original papers reference or do not reference each paper in the_paper_features_list
-logger.info("Creating the comparison vector using the original 3 papers.\n")
-the_comparision_binary_vector = bffxn.create_comparison_binary_vector(chosen_papers, the_paper_features_list, logger)
-
-# Turns all the binary feature vectors into a dataframe
-logger.info("Creating a dataframe to hold the biologist feature vectors.\n")
-bf_df = bffxn.create_biologist_finder_df(the_binary_feature_vectors, the_paper_features_list, the_biologist_cited_papers_dict, the_comparision_binary_vector)
-logger.info("Dataframe has {} rows and {} columns.\n".format(bf_df.shape[0], bf_df.shape[1]))
-
-# Creates a sorted dataframe reporting the pearsonr score between the feature vector of each scientist and that of the original papers
+if run_id is not None:
+    # Gathers the citation data stage by stage, resuming from and saving to the checkpoints of the run
+    bf_matrix, run_state = bfstate.run_resumable(chosen_papers, logger, None if run_id == "new" else run_id)
+    logger.info("\n")
+    logger.info("The master list contains {} biologists.\n".format(len(run_state.master_list)))
+    logger.info("Matrix has {} rows and {} columns ({} citations stored).\n".format(bf_matrix.matrix.shape[0], bf_matrix.matrix.shape[1], bf_matrix.matrix.nnz))
+    logger.info("Resume or extend this run later with run_id = \"{}\".\n".format(run_state.run_id))
+elif streaming_pipeline:
+    # Streams each biologist on the master list through paper lookup and reference lookup into the sparse citation matrix as soon as they are found
+    logger.info("Building the master list of biologists and their citation histories.\n")
+    bf_matrix, the_biologist_paper_dict, the_biologist_cited_papers_dict = bfpipeline.run_pipeline(chosen_papers, logger, similarity_metric, top_k=early_exit_top_k, build_matrix=build_full_matrix)
+    logger.info("\n")
+    logger.info("The master list contains {} biologists.\n".format(len(the_biologist_paper_dict)))
+    logger.info("The paper features list contains {} papers. \n".format(len(bf_matrix.papers)))
+    if build_full_matrix:
+        logger.info("Matrix has {} rows and {} columns ({} citations stored).\n".format(bf_matrix.matrix.shape[0], bf_matrix.matrix.shape[1], bf_matrix.matrix.nnz))
+    else:
+        the_comparison_refs, the_num_papers = bf_matrix.comparison_columns()
+        bf_matrix = None
+else:
+    # Creates master list of biologists from the first and last authors of papers referenced by the selected papers or cited by the selected papers
+    master_biologist_list = bffxn.create_master_biologist_list(chosen_papers, logger)
+    logger.info("\n")
+    logger.info("The master list contains {} biologists.\n".format(len(master_biologist_list)))
+
+    # Stores the papers authored by each of the biologists on the master list
+    logger.info("\n")
+    the_biologist_paper_dict = bffxn.create_biologist_paper_dict(master_biologist_list, logger)
+    logger.info("\n")
+
+    # Looks up the references of every paper written by the biologists on the master list
+    the_paper_refs_dict = bffxn.create_paper_refs_dict(the_biologist_paper_dict, logger)
+
+    # Stores all the papers referenced by each of the biologists on the master list
+    the_biologist_cited_papers_dict = bffxn.create_biologist_cited_papers_dict(the_biologist_paper_dict, logger, the_paper_refs_dict)
+
+    # Assembles every paper referenced by any of the biologists into one list
+    the_paper_features_list = bffxn.create_paper_features_list(the_biologist_cited_papers_dict)
+    logger.info("\n")
+    logger.info("The paper features list contains {} papers. \n".format(len(the_paper_features_list)))
+
+    if build_full_matrix:
+        # Creates a sparse binary matrix with a row for each biologist indicating if they reference or do not reference each paper in the_paper_features_list
+        logger.info("Creating binary feature vectors for each biologist.\n")
+        the_binary_feature_matrix = bffxn.create_binary_feature_vectors(the_biologist_cited_papers_dict, the_paper_features_list)
+
+        # Creates a binary vector indicating if the original papers reference or do not reference each paper in the_paper_features_list
+        logger.info("Creating the comparison vector using the original 3 papers.\n")
+        the_comparision_binary_vector = bffxn.create_comparison_binary_vector(chosen_papers, the_paper_features_list, logger)
+
+        # Stacks the biologist feature vectors and the comparison vector into one sparse matrix
+        logger.info("Creating a sparse matrix to hold the biologist feature vectors.\n")
+        bf_matrix = bffxn.create_biologist_finder_matrix(the_binary_feature_matrix, the_paper_features_list, the_biologist_cited_papers_dict, the_comparision_binary_vector)
+        logger.info("Matrix has {} rows and {} columns ({} citations stored).\n".format(bf_matrix.matrix.shape[0], bf_matrix.matrix.shape[1], bf_matrix.matrix.nnz))
+    else:
+        # Finds the papers cited by the selected papers that are columns, the only part of the comparison vector the approximate search needs
+        the_paper_features_set = set(the_paper_features_list)
+        the_comparison_refs = [paper for paper in bffxn.get_and_compile_refs(chosen_papers, logger) if paper in the_paper_features_set]
+        the_num_papers = len(the_paper_features_list)
+        bf_matrix = None
+
+# Saves the full citation matrix before any columns are pruned
+if matrix_output_path is not None and bf_matrix is not None:
+    bfstorage.save_citation_matrix(bf_matrix, matrix_output_path, chosen_papers)
+    logger.info("Citation matrix saved to {}.\n".format(matrix_output_path))
+
+# Reads the comparison papers and the number of paper columns out of the full matrix for the approximate search, and each biologist's cited papers for a checkpointed run
+if approximate_search and bf_matrix is not None:
+    the_comparison_refs, the_num_papers = bflsh.comparison_columns(bf_matrix)
+    if run_id is not None:
+        the_biologist_cited_papers_dict = bflsh.citation_sets(bf_matrix)[0]
+
+# Builds a comparison vector for each additional seed set against the full matrix, so pruning keeps the papers they cite
+if additional_seed_sets:
+    the_comparison_matrix = bffxn.create_comparison_matrix(additional_seed_sets, bf_matrix.papers, logger)
+
+# Removes the paper columns that cannot change the similarity scores of the biologists
+if prune_min_df is not None and bf_matrix is not None:
+    unpruned_papers = bf_matrix.papers
+    bf_matrix = bffxn.prune_paper_features(bf_matrix, logger, prune_min_df, prune_max_df, protected_columns=np.unique(the_comparison_matrix.indices) if additional_seed_sets else None)
+    if additional_seed_sets:
+        the_comparison_matrix = bffxn.select_paper_columns(the_comparison_matrix, unpruned_papers, bf_matrix.papers)
+    logger.info("\n")
+
+# Creates a sorted dataframe reporting the similarity score (pearsonr by default) between the feature vector of each scientist and that of the original papers
 logger.info("Creating a dataframe to hold similarity scores of each biologist.\n")
-ss_df = bffxn.create_similarity_scores_df(bf_df)
+if approximate_search:
+    minhash_index = bflsh.load_or_build_index(the_biologist_cited_papers_dict, minhash_index_path, logger=logger)
+    ss_df = bflsh.approximate_similarity_scores_df(the_biologist_cited_papers_dict, the_comparison_refs, minhash_index, the_num_papers, similarity_metric, logger)
+    if report_lsh_recall:
+        recall_top_k = max(int(len(the_biologist_cited_papers_dict) * 0.2), 1)
+        logger.info("The approximate search found {:.0%} of the exact top {} biologists.\n".format(bflsh.lsh_recall(bffxn.create_similarity_scores_df(bf_matrix, similarity_metric), ss_df, recall_top_k), recall_top_k))
+    # The reading list only reads the rows of the scored biologists
+    if bf_matrix is None:
+        bf_matrix = bflsh.candidate_citation_matrix(the_biologist_cited_papers_dict, the_comparison_refs, ss_df)
+else:
+    ss_df = bffxn.create_similarity_scores_df(bf_matrix, similarity_metric, scoring_engine)
 
 # Prints the user-specified percentage of biologists whose reference history is closest to that of the original biologist as approximated by the references in the selected papers
 user_percent = float(input("For which percentage of the master list of biologists do you want similarity scores reported for? Please enter a decimal.  For example for 20%, enter .2  "))
@@ -92,4 +213,22 @@ logger.info(top_sim_bio_df)
 
 # Prints a reading list of a user-specified number of papers that are the most cited by the list of similar biologists created in the previous step.
 logger.info("Generating reading list.\n")
-bffxn.reading_list(bf_df, top_sim_bio_df, logger)
+reading_list_ids = bffxn.reading_list(bf_matrix, top_sim_bio_df, logger, weighting=reading_list_weighting, engine="similarity" if approximate_search else scoring_engine)
+
+# Ranks the biologists and builds a reading list for each additional seed set, scoring all of them at once across the available cores
+if additional_seed_sets:
+    seed_set_dfs = bffxn.create_multi_similarity_scores_dfs(bf_matrix, the_comparison_matrix, list(additional_seed_sets), similarity_metric, engine=scoring_engine)
+    if scoring_engine == "pagerank":
+        seed_set_paper_scores = bfpagerank.paper_pagerank(bf_matrix, comparison_matrix=the_comparison_matrix)
+    for column, (seed_set, seed_set_df) in enumerate(seed_set_dfs.items()):
+        seed_set_top_df = bffxn.most_sim_biologists(seed_set_df, user_percent)
+        logger.info("\nBiologists with the highest similarity scores for {}: \n".format(seed_set))
+        logger.info(seed_set_top_df)
+        logger.info("Generating reading list for {}.\n".format(seed_set))
+        bffxn.reading_list(bf_matrix, seed_set_top_df, logger, len(reading_list_ids), reading_list_weighting, scoring_engine, seed_set_paper_scores[:, column] if scoring_engine == "pagerank" else None)
+
+# Reports where the time and memory of the run went
+if collect_metrics:
+    logger.info("\n" + bfmetrics.get_metrics().summary_table())
+    bfmetrics.get_metrics().write_json("BiologyFinder_metrics.json")
+    bfmetrics.get_metrics().write_trace("BiologyFinder_metrics.trace.json")
@@ -0,0 +1,11 @@
+'''
+Puts the BiologyFinder modules (src) and the fake E-utilities server (benchmarks) on the import path of the tests.
+'''
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("src", "benchmarks"):
+    path = os.path.join(ROOT, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
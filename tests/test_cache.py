@@ -0,0 +1,144 @@
+'''
+Tests of the Entrez response cache against an in-memory SQLite cache.
+'''
+import io
+import pytest
+import biologyfinder_cache as bfcache
+import biologyfinder_scheduler as bfscheduler
+
+
+class FakeClock:
+    """Stands in for the time module of biologyfinder_cache so tests can move time forward."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(bfcache, "time", fake_clock)
+    return fake_clock
+
+
+@pytest.fixture
+def configured_cache():
+    cache = bfcache.configure_cache(":memory:")
+    yield cache
+    bfcache.disable_cache()
+
+
+def test_put_and_get(clock):
+    cache = bfcache.EntrezCache(":memory:")
+    cache.put("efetch", "key", b"body")
+    assert cache.get("efetch", "key") == b"body"
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_ttl_expiry(clock):
+    cache = bfcache.EntrezCache(":memory:", ttls={"esearch": 60})
+    cache.put("esearch", "key", b"body")
+    clock.now += 59
+    assert cache.get("esearch", "key") == b"body"
+    clock.now += 2
+    assert cache.get("esearch", "key") is None
+    assert cache.misses == 1
+
+
+def test_offline_cache_returns_stale_responses(clock):
+    cache = bfcache.EntrezCache(":memory:", ttls={"esearch": 60}, offline=True)
+    cache.put("esearch", "key", b"body")
+    clock.now += 3600
+    assert cache.get("esearch", "key") == b"body"
+
+
+def test_lru_eviction(clock):
+    cache = bfcache.EntrezCache(":memory:", max_bytes=1000)
+    for number in range(10):
+        clock.now += 1
+        cache.put("efetch", "key{}".format(number), b"x" * 100)
+    # Reading the oldest response makes it the most recently used
+    clock.now += 1
+    assert cache.get("efetch", "key0") is not None
+    clock.now += 1
+    cache.put("efetch", "key10", b"x" * 100)
+    assert cache._total_bytes <= 1000 * bfcache.EVICT_TO
+    assert cache.get("efetch", "key0") is not None
+    assert cache.get("efetch", "key10") is not None
+    assert cache.get("efetch", "key1") is None
+    assert cache.get("efetch", "key2") is None
+
+
+def test_running_total_follows_replaced_responses(clock):
+    cache = bfcache.EntrezCache(":memory:")
+    cache.put("efetch", "key", b"x" * 100)
+    cache.put("efetch", "key", b"x" * 40)
+    cache.put("efetch", "other", b"x" * 10)
+    assert cache._total_bytes == 50
+    cache.clear()
+    assert cache._total_bytes == 0
+
+
+def test_offline_cache_miss(monkeypatch):
+    monkeypatch.setattr(bfcache, "_fetch", lambda endpoint, params: pytest.fail("offline mode used the network"))
+    bfcache.configure_cache(":memory:", offline=True)
+    try:
+        with pytest.raises(bfcache.OfflineCacheMiss):
+            bfcache.request("esearch", {"db": "pubmed", "term": "spindle"})
+        with pytest.raises(bfcache.OfflineCacheMiss):
+            bfcache.stream("efetch", {"db": "pubmed", "id": "1"})
+    finally:
+        bfcache.disable_cache()
+
+
+def test_normalize_params_drops_ignored_params():
+    normalized = bfcache.normalize_params("esearch", {"DB": "pubmed", "term": "spindle", "email": "a@b.c", "api_key": "secret", "retmax": None})
+    assert normalized == bfcache.normalize_params("esearch", {"db": "pubmed", "term": "spindle"})
+
+
+def test_normalize_params_resolves_webenv():
+    cache = bfcache.EntrezCache(":memory:")
+    cache.remember_history("WEBENV1", 1, "search for spindle")
+    cache.remember_history("WEBENV2", "1", "search for spindle")
+    first = bfcache.normalize_params("efetch", {"db": "pubmed", "WebEnv": "WEBENV1", "query_key": 1}, cache)
+    second = bfcache.normalize_params("efetch", {"db": "pubmed", "WebEnv": "WEBENV2", "query_key": "1"}, cache)
+    unknown = bfcache.normalize_params("efetch", {"db": "pubmed", "WebEnv": "WEBENV3", "query_key": "1"}, cache)
+    assert first == second
+    assert "WEBENV" not in first
+    assert "WEBENV3" in unknown
+
+
+def test_request_remembers_history(configured_cache, monkeypatch):
+    responses = iter([b'<?xml version="1.0"?>\n<!DOCTYPE eSearchResult PUBLIC "-//NLM//DTD esearch 20060628//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20060628/esearch.dtd">\n<eSearchResult><Count>1</Count><RetMax>1</RetMax><RetStart>0</RetStart><QueryKey>1</QueryKey><WebEnv>WEBENV1</WebEnv><IdList><Id>1</Id></IdList><TranslationSet/><QueryTranslation>spindle</QueryTranslation></eSearchResult>', b"records"])
+    fetched = []
+    monkeypatch.setattr(bfcache, "_fetch", lambda endpoint, params: fetched.append(endpoint) or next(responses))
+    bfcache.request("esearch", {"db": "pubmed", "term": "spindle", "usehistory": "y"})
+    assert configured_cache.resolve_history("WEBENV1", "1") is not None
+    assert bfcache.request("efetch", {"db": "pubmed", "WebEnv": "WEBENV1", "query_key": "1"}) == b"records"
+    # NCBI hands out a new WebEnv for the same search, the fetch is still answered from the cache
+    configured_cache.remember_history("WEBENV2", "1", configured_cache.resolve_history("WEBENV1", "1"))
+    assert bfcache.request("efetch", {"db": "pubmed", "WebEnv": "WEBENV2", "query_key": "1"}) == b"records"
+    assert fetched == ["esearch", "efetch"]
+
+
+def test_caching_stream_stores_only_complete_bodies(configured_cache, monkeypatch):
+    opened = []
+
+    def open_stream(endpoint, params):
+        opened.append(endpoint)
+        return io.BytesIO(b"0123456789" * 10)
+
+    monkeypatch.setattr(bfscheduler, "open_stream", open_stream)
+    params = {"db": "pubmed", "id": "1", "rettype": "medline"}
+    with bfcache.stream("efetch", params) as handle:
+        assert handle.read(5) == b"01234"
+    assert len(opened) == 1
+    with bfcache.stream("efetch", params) as handle:
+        assert b"".join(iter(lambda: handle.read(7), b"")) == b"0123456789" * 10
+    assert len(opened) == 2
+    with bfcache.stream("efetch", params) as handle:
+        assert handle.read() == b"0123456789" * 10
+    assert len(opened) == 2
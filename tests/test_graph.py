@@ -0,0 +1,48 @@
+'''
+Tests of how the citation graph store saves its arrays.
+'''
+import os
+import numpy as np
+import biologyfinder_graph as bfgraph
+import biologyfinder_storage as bfstorage
+
+
+def test_store_round_trip(tmp_path):
+    store = bfgraph.CitationGraphStore(str(tmp_path))
+    store.add_pmids("refs", "5", ["1", "2"])
+    store.add_authors("5", ["Smith, John", "Doe, Anna"], ["Harvard University"])
+    store.flush()
+    store.add_pmids("refs", "6", ["3"])
+    store.flush()
+    reopened = bfgraph.CitationGraphStore(str(tmp_path))
+    assert reopened.get_pmids("refs", "5") == ["1", "2"]
+    assert reopened.get_pmids("refs", "6") == ["3"]
+    assert reopened.get_authors("5") == (["Smith, John", "Doe, Anna"], ["Harvard University"])
+    # Only the current generation of each array set is left on disk
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("refs.")]) == len(bfgraph.CSR_DTYPES)
+
+
+def test_reads_stores_saved_without_generations(tmp_path):
+    prefix = str(tmp_path / "refs")
+    bfstorage.save_array(prefix + "_keys.npy", np.array([5], dtype=np.uint32))
+    bfstorage.save_array(prefix + "_indptr.npy", np.array([0, 2], dtype=np.int64))
+    bfstorage.save_array(prefix + "_targets.npy", np.array([1, 2], dtype=np.uint32))
+    bfstorage.save_string_table(str(tmp_path / "author_names"), ["Smith, John"])
+    store = bfgraph.CitationGraphStore(str(tmp_path))
+    assert store.get_pmids("refs", "5", include_expired=True) == ["1", "2"]
+    assert store.authors == ["Smith, John"]
+    store.add_pmids("refs", "6", ["3"])
+    store.flush()
+    assert not os.path.exists(prefix + "_keys.npy")
+    assert bfgraph.CitationGraphStore(str(tmp_path)).get_pmids("refs", "5", include_expired=True) == ["1", "2"]
+
+
+def test_interrupted_save_keeps_previous_generation(tmp_path):
+    prefix = str(tmp_path / "refs")
+    bfgraph.CSRAdjacency(np.array([5], dtype=np.uint32), np.array([0, 2], dtype=np.int64), np.array([1, 2], dtype=np.uint32)).save(prefix)
+    # A writer that stopped after some of its arrays were written never switched the generation
+    np.save(bfstorage.array_set_path(prefix, "interrupted", "keys"), np.array([7, 8], dtype=np.uint32))
+    np.save(bfstorage.array_set_path(prefix, "interrupted", "indptr"), np.array([0, 0, 0], dtype=np.int64))
+    adjacency = bfgraph.CSRAdjacency.load(prefix)
+    assert adjacency.get(5).tolist() == [1, 2]
+    assert adjacency.get(7) is None
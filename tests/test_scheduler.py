@@ -0,0 +1,123 @@
+'''
+Tests of the E-utilities scheduler against the local fake E-utilities server of the benchmarks.
+'''
+import random
+import threading
+import time
+from urllib.error import HTTPError
+import pytest
+import fake_eutils
+import biologyfinder_cache as bfcache
+import biologyfinder_scheduler as bfscheduler
+
+
+class ScriptedBackend:
+    """Answers with the synthetic PubMed after failing the first requests with the given HTTP statuses, and keeps the parameters of every request."""
+
+    def __init__(self, statuses=(), delay=None):
+        self.pubmed = fake_eutils.SyntheticPubMed(0.05)
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.params = []
+        self._lock = threading.Lock()
+
+    def respond(self, endpoint, params):
+        with self._lock:
+            self.params.append((endpoint, params))
+            status = self.statuses.pop(0) if self.statuses else None
+        if status is not None:
+            raise fake_eutils.ErrorResponse(status, "scripted failure")
+        if self.delay is not None:
+            time.sleep(self.delay(endpoint, params))
+        return self.pubmed.respond(endpoint, params)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(backend, **settings):
+        server = fake_eutils.FakeEutilsServer(backend).start()
+        servers.append(server)
+        settings.setdefault("backoff", 0.01)
+        settings.setdefault("rate", 1000)
+        bfscheduler.configure_scheduler(base_url=server.url, **settings)
+        return server
+
+    bfcache.disable_cache()
+    yield start
+    bfscheduler.configure_scheduler()
+    for server in servers:
+        server.stop()
+
+
+def test_request_returns_body(serve):
+    backend = ScriptedBackend()
+    server = serve(backend)
+    pmid = backend.pubmed.authored_papers(0)[0]
+    body = bfscheduler.request("efetch", {"db": "pubmed", "id": pmid, "rettype": "medline", "retmode": "text"})
+    assert "PMID- {}".format(pmid) in body.decode("utf-8")
+    assert server.counters()[0] == {"efetch": 1}
+
+
+@pytest.mark.parametrize("statuses", [(429,), (503,), (429, 500, 502)])
+def test_retries_transient_errors(serve, statuses):
+    server = serve(ScriptedBackend(statuses))
+    body = bfscheduler.request("esearch", {"db": "pubmed", "term": "Rasmussen0"})
+    assert b"<eSearchResult>" in body
+    assert server.counters()[0] == {"esearch": len(statuses) + 1}
+
+
+def test_gives_up_after_max_tries(serve):
+    server = serve(ScriptedBackend([503] * 5), max_tries=3)
+    with pytest.raises(HTTPError) as err:
+        bfscheduler.request("esearch", {"db": "pubmed", "term": "Rasmussen0"})
+    assert err.value.code == 503
+    assert server.counters()[0] == {"esearch": 3}
+
+
+def test_client_errors_are_not_retried(serve):
+    server = serve(ScriptedBackend([400]))
+    with pytest.raises(HTTPError) as err:
+        bfscheduler.request("esearch", {"db": "pubmed", "term": "Rasmussen0"})
+    assert err.value.code == 400
+    assert server.counters()[0] == {"esearch": 1}
+
+
+def test_token_bucket_limits_rate():
+    bucket = bfscheduler.TokenBucket(50, capacity=1)
+    start = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    assert time.monotonic() - start >= 10 / 50 * 0.9
+
+
+def test_requests_are_rate_limited(serve):
+    server = serve(ScriptedBackend(), rate=20, max_workers=8)
+    start = time.monotonic()
+    bfscheduler.map_concurrent(lambda number: bfscheduler.request("esearch", {"db": "pubmed", "term": "Rasmussen{}".format(number)}), range(30))
+    # The first second worth of tokens is a burst, the other 10 requests wait for new tokens
+    assert time.monotonic() - start >= 10 / 20 * 0.9
+    assert server.counters()[0] == {"esearch": 30}
+
+
+def test_map_concurrent_keeps_order(serve):
+    rng = random.Random(0)
+    backend = ScriptedBackend(delay=lambda endpoint, params: rng.uniform(0, 0.05))
+    serve(backend, max_workers=8)
+    pmids = backend.pubmed.authored_papers(0)[:6] + backend.pubmed.authored_papers(1)[:6]
+    bodies = bfscheduler.map_concurrent(lambda pmid: bfscheduler.request("efetch", {"db": "pubmed", "id": pmid, "rettype": "medline", "retmode": "text"}), pmids)
+    assert [body.decode("utf-8").split("\n", 1)[0] for body in bodies] == ["PMID- {}".format(pmid) for pmid in pmids]
+
+
+@pytest.mark.parametrize("num_ids", [3, 300])
+def test_elink_sends_ids_separately(serve, num_ids):
+    backend = ScriptedBackend()
+    serve(backend)
+    pmids = [str(20000000 + number) for number in range(num_ids)]
+    bfscheduler.request("elink", {"dbfrom": "pubmed", "db": "pubmed", "id": pmids, "linkname": "pubmed_pubmed_refs"})
+    bfscheduler.request("efetch", {"db": "pubmed", "id": pmids, "rettype": "medline", "retmode": "text"})
+    (elink, elink_params), (efetch, efetch_params) = backend.params
+    assert (elink, efetch) == ("elink", "efetch")
+    assert elink_params["id"] == pmids
+    assert efetch_params["id"] == [",".join(pmids)]